@@ -6,6 +6,8 @@ from qgis.core import (
     QgsFeatureRequest, QgsSpatialIndex, QgsGeometry, QgsVectorLayer
 )
 from qgis.PyQt.QtCore import QVariant
+import numpy as np
+from .hazen_williams import hazen_williams
 from .constants import (
     FIELD_LENGTH, FIELD_AREA, FIELD_COUNT, FIELD_DN, FIELD_FLOW, FIELD_HF,
     DEFAULT_HAZEN_C, VALID_DNS
@@ -127,37 +129,43 @@ class HydraulicCalculator:
             idx_dn = layer.fields().indexFromName(FIELD_DN)
             idx_l = layer.fields().indexFromName(FIELD_LENGTH)
 
-            updated = 0
             invalid = 0
+            fids, flows, dns, lengths = [], [], [], []
             
-            with edit(layer):
-                for feat in layer.getFeatures():
-                    try:
-                        # Access by index is faster than by name
-                        v_val = feat.attributes()[idx_v]
-                        dn_val = feat.attributes()[idx_dn]
-                        l_val = feat.attributes()[idx_l]
-                        
-                        if v_val is None or dn_val is None or l_val is None:
-                            invalid += 1
-                            continue
-
-                        V = float(v_val)
-                        DN = float(dn_val)
-                        L = float(l_val)
-                        
-                        if V <= 0 or DN <= 0 or L < 0:
-                            invalid += 1
-                            continue
+            for feat in layer.getFeatures():
+                try:
+                    # Access by index is faster than by name
+                    v_val = feat.attributes()[idx_v]
+                    dn_val = feat.attributes()[idx_dn]
+                    l_val = feat.attributes()[idx_l]
+                    
+                    if v_val is None or dn_val is None or l_val is None:
+                        invalid += 1
+                        continue
 
-                        Q = V / 3600.0
-                        D = DN / 1000.0
-                        hf = 10.67 * L * (Q ** 1.852) / ((c_factor ** 1.852) * (D ** 4.87))
-                        
-                        layer.changeAttributeValue(feat.id(), idx_hf, float(hf))
-                        updated += 1
-                    except (ValueError, TypeError):
+                    V = float(v_val)
+                    DN = float(dn_val)
+                    L = float(l_val)
+                    
+                    if V <= 0 or DN <= 0 or L < 0:
                         invalid += 1
+                        continue
+
+                    fids.append(feat.id())
+                    flows.append(V)
+                    dns.append(DN)
+                    lengths.append(L)
+                except (ValueError, TypeError):
+                    invalid += 1
+            
+            # One vectorized evaluation for every valid feature
+            hfs, _ = hazen_williams(flows, dns, lengths, c_factor)
+            
+            updated = 0
+            with edit(layer):
+                for fid, hf in zip(fids, hfs.tolist()):
+                    layer.changeAttributeValue(fid, idx_hf, float(hf))
+                    updated += 1
             return f"HF calculado: {updated} ok, {invalid} inválidos."
         except Exception as e:
             return f"Erro ao calcular HF: {str(e)}"
@@ -287,63 +295,54 @@ class HydraulicCalculator:
             updated_count = 0
             errors = 0
             
-            def calc_hf(v: float, dn: float, l: float) -> float:
-                if v <= 0 or dn <= 0 or l <= 0: return 0.0
-                q = v / 3600.0
-                d = dn / 1000.0
-                c = DEFAULT_HAZEN_C
-                return 10.67 * l * (q ** 1.852) / ((c ** 1.852) * (d ** 4.87))
-
-            with edit(layer):
-                for feat in features:
-                    try:
-                        attrs = feat.attributes()
-                        v = float(attrs[idx_v]) if attrs[idx_v] else 0.0
-                        dn = float(attrs[idx_dn]) if attrs[idx_dn] else 0.0
-                        l = float(attrs[idx_l]) if attrs[idx_l] else 0.0
-                        
-                        if v <= 0 or dn <= 0 or l <= 0:
-                            continue
-
-                        current_hf = calc_hf(v, dn, l)
-                        changed = False
-                        
-                        # Optimization logic
-                        while current_hf > limit_hf:
-                            current_idx = -1
-                            for i, val in enumerate(VALID_DNS):
-                                if dn == val:
-                                    current_idx = i
-                                    break
-                            
-                            if current_idx == -1:
-                                # Snap to nearest valid DN
-                                next_dn = VALID_DNS[0]
-                                for val in VALID_DNS:
-                                    if val > dn:
-                                        next_dn = val
-                                        break
-                                    if val == VALID_DNS[-1] and dn > val:
-                                        next_dn = val
-                                dn = next_dn
-                            elif current_idx < len(VALID_DNS) - 1:
-                                dn = VALID_DNS[current_idx + 1]
-                            else:
-                                # Max DN reached
-                                break
-                            
-                            current_hf = calc_hf(v, dn, l)
-                            changed = True
-                        
+            # Collect valid rows first so every head loss comes from one kernel call
+            rows = [] # (fid, v, dn, l, old_hf)
+            for feat in features:
+                try:
+                    attrs = feat.attributes()
+                    v = float(attrs[idx_v]) if attrs[idx_v] else 0.0
+                    dn = float(attrs[idx_dn]) if attrs[idx_dn] else 0.0
+                    l = float(attrs[idx_l]) if attrs[idx_l] else 0.0
+                    
+                    if v <= 0 or dn <= 0 or l <= 0:
+                        continue
+                    
+                    old_hf = attrs[idx_hf]
+                    if old_hf is not None:
+                        old_hf = float(old_hf)
+                    rows.append((feat.id(), v, dn, l, old_hf))
+                except (ValueError, TypeError):
+                    errors += 1
+            
+            if rows:
+                v_arr = np.array([r[1] for r in rows])
+                dn_arr = np.array([r[2] for r in rows])
+                l_arr = np.array([r[3] for r in rows])
+                dns = np.asarray(VALID_DNS)
+                
+                # HF at the current DN and at every valid DN (rows x DNs)
+                current_hf, _ = hazen_williams(v_arr, dn_arr, l_arr)
+                table_hf, _ = hazen_williams(v_arr[:, None], dns[None, :], l_arr[:, None])
+                
+                # Optimization logic: snap to the first valid DN >= current (or the largest),
+                # then step up until HF fits the limit or the largest DN is reached
+                start_idx = np.minimum(np.searchsorted(dns, dn_arr, side='left'), len(dns) - 1)
+                fits = (table_hf <= limit_hf) & (np.arange(len(dns))[None, :] >= start_idx[:, None])
+                first_fit = np.where(fits.any(axis=1), fits.argmax(axis=1), len(dns) - 1)
+                
+                exceeded = current_hf > limit_hf
+                new_dn = np.where(exceeded, dns[first_fit], dn_arr)
+                new_hf = np.where(exceeded, table_hf[np.arange(len(rows)), first_fit], current_hf)
+                
+                changed_rows = (exceeded & (new_dn != dn_arr)).tolist()
+                
+                with edit(layer):
+                    for (fid, _, _, _, old_hf), changed, dn, hf in zip(rows, changed_rows, new_dn.tolist(), new_hf.tolist()):
                         # Only update if changed or if HF field needs update
-                        old_hf = attrs[idx_hf]
-                        if changed or (old_hf is None) or (abs(float(old_hf) - current_hf) > 0.001):
-                            layer.changeAttributeValue(feat.id(), idx_dn, float(dn))
-                            layer.changeAttributeValue(feat.id(), idx_hf, float(current_hf))
+                        if changed or (old_hf is None) or (abs(old_hf - hf) > 0.001):
+                            layer.changeAttributeValue(fid, idx_dn, float(dn))
+                            layer.changeAttributeValue(fid, idx_hf, float(hf))
                             updated_count += 1
-                            
-                    except (ValueError, TypeError):
-                        errors += 1
 
             return f"{count_msg} Otimização concluída. {updated_count} feições atualizadas."
         except Exception as e:
@@ -0,0 +1,174 @@
+import time
+import numpy as np
+from .constants import VALID_DNS, PIPE_COSTS
+from .hazen_williams import hazen_williams
+
+
+def _prune(req, cost):
+    """
+    Keeps the Pareto-optimal (required head, cost) pairs, sorted by required head
+    ascending (so cost strictly descending). Returns the kept positions.
+    """
+    order = np.lexsort((cost, req))
+    c = cost[order]
+    best_before = np.minimum.accumulate(np.concatenate(([np.inf], c[:-1])))
+    return order[c < best_before]
+
+
+class TreeDPOptimizer:
+    """
+    Exact minimum-cost diameter selection for branched networks.
+
+    Bottom-up over the tree, every node keeps the Pareto frontier of
+    (head required at the node, cost of its subtree): the head needed so that
+    every valve/emitter below gets min_pressure, against the pipe cost to get
+    there. A link adds its head loss and cost for each DN; sibling subtrees
+    combine as (max of heads, sum of costs). Dominated pairs are pruned at each
+    step. At the source the cheapest pair whose head is available is optimal.
+
+    Links that GeneticOptimizer would not optimize (hoses) keep their diameter.
+    Flows are fixed (already accumulated by the solver), as in the GA.
+    """
+
+    def __init__(self, solver, links=None):
+        self.solver = solver
+        self.network = solver.network
+        if links is None:
+            links = [link for link in self.network.links.values() if link.type != 'hose']
+            if not links:
+                links = list(self.network.links.values())
+        self.optimizable_links = links
+        self.stats = {} # cost / feasible / elapsed / max_frontier of the last optimize()
+
+    def optimize(self):
+        t_start = time.perf_counter()
+        solver = self.solver
+        topo = solver.topology
+        n_links = topo.num_links
+
+        # Options per link: (head loss, cost) for every DN, or the fixed diameter
+        dns = np.asarray(VALID_DNS)
+        unit_costs = np.array([PIPE_COSTS.get(dn, 1.0) for dn in VALID_DNS])
+        decision = np.zeros(n_links, dtype=bool)
+        decision[[topo.link_index[link.id] for link in self.optimizable_links]] = True
+        table_loss, _ = hazen_williams(topo.flow[:, None], dns[None, :], topo.length[:, None])
+        table_cost = topo.length[:, None] * unit_costs[None, :]
+        fixed_loss, _ = hazen_williams(topo.flow, topo.diameter, topo.length)
+
+        own_req = np.where(
+            topo.is_constrained, topo.elevation + solver.min_pressure, -np.inf
+        )
+
+        # Highest head any node can get: the source head minus the smallest possible
+        # loss on the way down. Pairs requiring more can never be met and are dropped
+        # (the lowest one is always kept, to report the least violation).
+        min_loss = np.where(decision, table_loss.min(axis=1), fixed_loss)
+        cap = np.full(topo.num_nodes, np.inf)
+        for v in topo.order.tolist():
+            l = topo.parent_link[v]
+            if l < 0:
+                cap[v] = topo.pressure[v] + topo.elevation[v] + 1e-9
+            else:
+                cap[v] = cap[topo.parent_node[v]] - min_loss[l]
+
+        def reachable(req, limit):
+            keep = req <= limit
+            keep[0] = True
+            return np.flatnonzero(keep)
+
+        # Per node: frontier (req, cost) and the recipe to rebuild the choices:
+        # list of (child link, link-frontier backpointers, merge backpointers)
+        frontier = {}
+        recipe = {}
+        max_frontier = 1
+        parent_link = topo.parent_link
+        child_ptr = topo.child_ptr
+        child_link = topo.child_link
+        link_end = topo.link_end
+
+        for v in reversed(topo.order.tolist()):
+            req = np.array([-np.inf])
+            cost = np.array([0.0])
+            steps = []
+            for k in range(child_ptr[v], child_ptr[v + 1]):
+                l = int(child_link[k])
+                c_req, c_cost = frontier.pop(int(link_end[l]))
+
+                # Through the link: every child pair with every option
+                if decision[l]:
+                    l_req = (c_req[:, None] + table_loss[l][None, :]).ravel()
+                    l_cost = (c_cost[:, None] + table_cost[l][None, :]).ravel()
+                    n_opt = len(dns)
+                else:
+                    l_req = c_req + fixed_loss[l]
+                    l_cost = c_cost.copy()
+                    n_opt = 1
+                keep = _prune(l_req, l_cost)
+                keep = keep[reachable(l_req[keep], cap[v])]
+                l_req, l_cost = l_req[keep], l_cost[keep]
+                link_back = (keep // n_opt, keep % n_opt if decision[l] else np.full(len(keep), -1))
+
+                # Combine with the siblings already merged: for every head threshold,
+                # the cheapest pair of each side that fits under it
+                thresholds = np.union1d(req, l_req)
+                ia = np.searchsorted(req, thresholds, side='right') - 1
+                ib = np.searchsorted(l_req, thresholds, side='right') - 1
+                ok = (ia >= 0) & (ib >= 0)
+                ia, ib = ia[ok], ib[ok]
+                m_req = np.maximum(req[ia], l_req[ib])
+                m_cost = cost[ia] + l_cost[ib]
+                keep = _prune(m_req, m_cost)
+                keep = keep[reachable(m_req[keep], cap[v])]
+                req, cost = m_req[keep], m_cost[keep]
+                steps.append((l, link_back, (ia[keep], ib[keep])))
+
+            # The node's own pressure requirement
+            req = np.maximum(req, own_req[v])
+            keep = _prune(req, cost)
+            keep = keep[reachable(req[keep], cap[v])]
+            req, cost = req[keep], cost[keep]
+            recipe[v] = (steps, keep)
+            frontier[v] = (req, cost)
+            max_frontier = max(max_frontier, len(req))
+
+        # At each source: cheapest pair whose required head is available
+        feasible = True
+        total_cost = 0.0
+        chosen = topo.diameter.copy()
+        stack = []
+        for root in topo.order[parent_link[topo.order] < 0].tolist():
+            req, cost = frontier.pop(root)
+            available = topo.pressure[root] + topo.elevation[root]
+            fits = np.flatnonzero(req <= available + 1e-9)
+            if len(fits):
+                pick = int(fits[np.argmin(cost[fits])])
+            else:
+                feasible = False
+                pick = 0 # Lowest required head: the least violation
+            total_cost += float(cost[pick])
+            stack.append((root, pick))
+
+        # Top-down: unwind the recipes to the DN of every decision link
+        while stack:
+            v, idx = stack.pop()
+            steps, own_keep = recipe.pop(v)
+            idx = int(own_keep[idx])
+            for l, (child_idx, dn_idx), (ia, ib) in reversed(steps):
+                j = int(ib[idx])
+                idx = int(ia[idx])
+                if dn_idx[j] >= 0:
+                    chosen[l] = dns[dn_idx[j]]
+                stack.append((int(link_end[l]), int(child_idx[j])))
+
+        # Apply and recompute the network state
+        topo.diameter = np.where(decision, chosen, topo.diameter)
+        solver._update_head_losses()
+        topo.store_links()
+        solver._calculate_pressure()
+
+        self.stats = {
+            'cost': total_cost,
+            'feasible': feasible,
+            'elapsed': time.perf_counter() - t_start,
+            'max_frontier': max_frontier,
+        }
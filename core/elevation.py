@@ -31,9 +31,23 @@ class ElevationManager:
         else:
             pt_transformed = point
             
+        return self._identify(dem_layer.dataProvider(), pt_transformed)
+
+    def sampler(self, dem_layer: QgsRasterLayer):
+        """
+        f(point) -> elevation for points already in the DEM CRS, or None without a
+        valid DEM. It reads a copy of the DEM provider: made on the main thread, it
+        can then be used from one background task (providers are not thread safe).
+        """
+        if not dem_layer or not dem_layer.isValid():
+            return None
+        provider = dem_layer.dataProvider().clone()
+        return lambda point: self._identify(provider, point)
+
+    def _identify(self, provider, point: QgsPointXY) -> float:
         # Sample
-        ident = dem_layer.dataProvider().identify(
-            pt_transformed, 
+        ident = provider.identify(
+            point, 
             QgsRasterLayer.IdentifyFormatValue
         )
         
@@ -0,0 +1,142 @@
+import numpy as np
+from .constants import VALID_DNS, PIPE_COSTS
+from .hazen_williams import hazen_williams
+
+PENALTY_WEIGHT = 1000.0
+
+
+class FitnessModel:
+    """
+    Array snapshot of a solved tree for scoring GA genomes without touching the
+    network objects.
+
+    Flows are fixed (they do not depend on the diameters), so the head loss of
+    every optimizable link for every DN is tabulated once. A genome picks one
+    column per link; pressures at the constrained nodes (valves and emitters)
+    are then the static pressure minus a sparse path-incidence product.
+
+    Only numpy/scipy arrays are kept, so the model can be pickled to worker
+    processes.
+    """
+
+    def __init__(self, solver, links, link_gene=None):
+        topo = solver.topology
+        self.min_pressure = solver.min_pressure
+        self.gene_links = np.array([topo.link_index[link.id] for link in links], dtype=np.int64)
+        n_genes = len(self.gene_links)
+        # Gene of every link (several links may share one gene); one gene per link by default
+        self.link_gene = np.arange(n_genes) if link_gene is None else np.asarray(link_gene, dtype=np.int64)
+        self.num_genes = int(self.link_gene.max()) + 1 if n_genes else 0
+        self.gene_members = np.argsort(self.link_gene, kind='stable') # links of gene g: gene_members[gene_ptr[g]:gene_ptr[g + 1]]
+        self.gene_ptr = np.zeros(self.num_genes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.link_gene, minlength=self.num_genes), out=self.gene_ptr[1:])
+
+        dns = np.asarray(VALID_DNS)
+        flow = topo.flow[self.gene_links][:, None]
+        length = topo.length[self.gene_links][:, None]
+        self.head_loss_table, _ = hazen_williams(flow, dns[None, :], length) # genes x DN
+        self.cost_table = length * np.array([PIPE_COSTS.get(dn, 1.0) for dn in VALID_DNS])[None, :]
+
+        # Links outside the genome keep their current head loss
+        fixed = np.ones(topo.num_links, dtype=bool)
+        fixed[self.gene_links] = False
+        fixed_loss, _ = hazen_williams(topo.flow, topo.diameter, topo.length)
+        fixed_loss = np.where(fixed, fixed_loss, 0.0)
+
+        # Constrained nodes in DFS preorder (nodes outside the tree last), so the
+        # constrained nodes below any link form one contiguous slice
+        constrained = np.flatnonzero(topo.is_constrained)
+        constrained = constrained[np.lexsort((topo.tin[constrained], topo.tin[constrained] < 0))]
+        P = topo.path_matrix()[constrained]
+        root = topo.root_of()[constrained]
+        in_tree = root >= 0
+        
+        tin_sorted = topo.tin[constrained[in_tree]]
+        child = topo.link_end[self.gene_links]
+        is_tree = (child >= 0) & (topo.parent_link[np.maximum(child, 0)] == self.gene_links)
+        self.slice_start = np.where(is_tree, np.searchsorted(tin_sorted, topo.tin[child]), 0)
+        self.slice_end = np.where(is_tree, np.searchsorted(tin_sorted, topo.tout[child]), 0)
+
+        # Pressure with no loss on the genome links (nodes outside the tree keep theirs)
+        static = topo.pressure[constrained].copy()
+        static[in_tree] = (topo.pressure[root[in_tree]] + topo.elevation[root[in_tree]]
+                           - topo.elevation[constrained[in_tree]])
+        self.base_pressure = static - P @ fixed_loss
+        self.path = P[:, self.gene_links].tocsr() # constrained nodes x genes
+        self.path_by_link = self.path.tocsc() # same, column access for slack()
+        self.rows = np.arange(n_genes)
+
+    def _expand(self, population) -> np.ndarray:
+        # Genomes (one DN index per gene) -> DN index per link
+        genes = np.asarray(population, dtype=np.int64).reshape(-1, self.num_genes)
+        return genes[:, self.link_gene]
+
+    def pressures(self, population) -> np.ndarray:
+        """Pressures at the constrained nodes, one column per genome."""
+        genes = self._expand(population)
+        head_loss = self.head_loss_table[self.rows, genes] # pop x genes
+        return self.base_pressure[:, None] - self.path @ head_loss.T
+
+    def slack(self, pressures) -> np.ndarray:
+        """
+        Pressure margin over min_pressure of the worst constrained node below each
+        genome link (inf where no constrained node is below). pressures: one genome's, as from states().
+        """
+        P = self.path_by_link
+        margin = np.full(P.shape[1], np.inf)
+        nonempty = np.diff(P.indptr) > 0
+        if P.nnz:
+            margin[nonempty] = np.minimum.reduceat(pressures[P.indices], P.indptr[:-1][nonempty])
+        return margin - self.min_pressure
+
+    def _penalty(self, pressures, axis=None):
+        deficit = np.maximum(self.min_pressure - pressures, 0.0)
+        return (deficit * deficit).sum(axis=axis) * PENALTY_WEIGHT
+
+    def evaluate(self, population) -> np.ndarray:
+        """Cost + quadratic pressure penalty for every genome (rows of DN indices)."""
+        cost, penalty, _ = self.states(population)
+        return cost + penalty
+
+    def states(self, population):
+        """
+        Full evaluation keeping what delta() needs.
+        Returns (cost, penalty, pressures) with pressures as genomes x constrained nodes.
+        """
+        genes = self._expand(population)
+        cost = self.cost_table[self.rows, genes].sum(axis=1)
+        head_loss = self.head_loss_table[self.rows, genes]
+        pressures = (self.base_pressure[:, None] - self.path @ head_loss.T).T
+        return cost, self._penalty(pressures, axis=1), pressures
+
+    def delta(self, parent, parent_state, child):
+        """
+        Evaluates child from a scored parent: the cost changes by the difference of
+        the links of the changed genes and only the constrained nodes below each
+        such link (one contiguous slice each) get their pressure shifted.
+        parent_state is (cost, penalty, pressures) of the parent, as from states().
+        Returns the child's (cost, penalty, pressures); the parent's arrays are not modified.
+        """
+        parent = np.asarray(parent)
+        child = np.asarray(child)
+        cost, penalty, pressures = parent_state
+        pressures = pressures.copy()
+        
+        changed_genes = np.flatnonzero(parent != child)
+        if len(changed_genes) == 0:
+            return cost, penalty, pressures
+        changed = np.concatenate([self.gene_members[self.gene_ptr[g]:self.gene_ptr[g + 1]] for g in changed_genes.tolist()])
+        old = parent[self.link_gene[changed]].astype(np.int64)
+        new = child[self.link_gene[changed]].astype(np.int64)
+        cost = cost + (self.cost_table[changed, new] - self.cost_table[changed, old]).sum()
+        shifts = self.head_loss_table[changed, new] - self.head_loss_table[changed, old]
+        
+        for l, shift in zip(changed.tolist(), shifts.tolist()):
+            lo, hi = self.slice_start[l], self.slice_end[l]
+            if shift == 0.0 or lo == hi:
+                continue
+            segment = pressures[lo:hi]
+            penalty -= self._penalty(segment)
+            segment -= shift
+            penalty += self._penalty(segment)
+        return cost, penalty, pressures
@@ -0,0 +1,302 @@
+import math
+from typing import Iterable
+import numpy as np
+
+
+class Point:
+    """
+    Plain 2D point used by the hydraulic core instead of QgsPointXY.
+    Mirrors the QgsPointXY methods the core relies on (x, y, sqrDist), so
+    QGIS points and these can be mixed in comparisons.
+    """
+    __slots__ = ('_x', '_y')
+
+    def __init__(self, x: float, y: float):
+        self._x = float(x)
+        self._y = float(y)
+
+    def x(self) -> float:
+        return self._x
+
+    def y(self) -> float:
+        return self._y
+
+    def sqrDist(self, other) -> float:
+        return (self._x - other.x()) ** 2 + (self._y - other.y()) ** 2
+
+    def distance(self, other) -> float:
+        return math.sqrt(self.sqrDist(other))
+
+    def __eq__(self, other):
+        return isinstance(other, Point) and self._x == other._x and self._y == other._y
+
+    def __hash__(self):
+        return hash((self._x, self._y))
+
+    def __repr__(self):
+        return f"Point({self._x}, {self._y})"
+
+    def __getstate__(self):
+        return (self._x, self._y)
+
+    def __setstate__(self, state):
+        self._x, self._y = state
+
+
+class LineGeometry:
+    """
+    Polyline stored as an (n, 2) coordinate array. Picklable and QGIS-free;
+    NetworkBuilder converts to and from QgsGeometry at the layer boundary.
+    """
+    __slots__ = ('coords',)
+
+    def __init__(self, coords):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+
+    @staticmethod
+    def fromPolylineXY(points: Iterable) -> 'LineGeometry':
+        """Builds from anything with x()/y() (Point or QgsPointXY)."""
+        return LineGeometry([(p.x(), p.y()) for p in points])
+
+    def asPolyline(self) -> list:
+        return [Point(x, y) for x, y in self.coords.tolist()]
+
+    def isMultipart(self) -> bool:
+        return False
+
+    def length(self) -> float:
+        if len(self.coords) < 2:
+            return 0.0
+        return float(np.hypot(*np.diff(self.coords, axis=0).T).sum())
+
+    def __getstate__(self):
+        return self.coords
+
+    def __setstate__(self, state):
+        self.coords = state
+
+    def __repr__(self):
+        return f"LineGeometry({self.coords.tolist()})"
+
+
+class GridIndex:
+    """
+    Uniform grid hash of points for lookups within a small radius: every
+    point goes in the bucket of its cell, a query only visits the cells the
+    radius can reach. O(1) on average when the cell size is about the radius.
+    """
+    __slots__ = ('cell_size', 'cells', 'count')
+
+    def __init__(self, cell_size: float):
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.cells = {} # (i, j) -> [(x, y, item)]
+        self.count = 0
+
+    def _cell(self, x: float, y: float):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, point, item):
+        x, y = point.x(), point.y()
+        self.cells.setdefault(self._cell(x, y), []).append((x, y, item))
+        self.count += 1
+
+    def nearest(self, point, radius: float):
+        """Item closest to point at a distance below radius, or None."""
+        x, y = point.x(), point.y()
+        i, j = self._cell(x, y)
+        reach = max(1, math.ceil(radius / self.cell_size))
+        best, best_d2 = None, radius * radius
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                for px, py, item in self.cells.get((i + di, j + dj), ()):
+                    d2 = (px - x) ** 2 + (py - y) ** 2
+                    if d2 < best_d2:
+                        best, best_d2 = item, d2
+        return best
+
+    def __len__(self):
+        return self.count
+
+
+class PointGrid:
+    """
+    Static grid over an (n, 2) point array, for many queries against points
+    that no longer change: point indices sorted by cell, one range per cell.
+    """
+    __slots__ = ('xy', 'cell_size', 'order', 'ranges')
+
+    def __init__(self, xy, cell_size: float):
+        self.xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        keys = self._keys(np.floor(self.xy / self.cell_size).astype(np.int64))
+        self.order = np.argsort(keys, kind='stable')
+        keys, starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.ranges = {k: (s, s + c) for k, s, c in zip(keys.tolist(), starts.tolist(), counts.tolist())}
+
+    @staticmethod
+    def _keys(cells):
+        # (i, j) cell -> one int64 (|i|, |j| < 2**31)
+        return cells[..., 0] * (1 << 32) + (cells[..., 1] & 0xFFFFFFFF)
+
+    def near_polyline(self, coords, radius: float):
+        """
+        Candidate (segment, point index) pairs: every point within radius of
+        segment k of the polyline is paired with k (plus some farther ones).
+        """
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        # Samples at most one cell apart: a point within radius of the segment is
+        # within radius + cell / 2 of a sample, so `reach` cells around them cover it
+        reach = int(math.ceil(radius / self.cell_size + 0.5))
+        span = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(span, span), axis=-1).reshape(-1, 2)
+        seg_parts, point_parts = [], []
+        for k in range(len(coords) - 1):
+            a, b = coords[k], coords[k + 1]
+            steps = int(np.hypot(*(b - a)) / self.cell_size) + 1
+            samples = a + (b - a) * np.linspace(0.0, 1.0, steps + 1)[:, None]
+            cells = np.floor(samples / self.cell_size).astype(np.int64)
+            keys = np.unique(self._keys(cells[:, None, :] + offsets[None, :, :]))
+            found = [self.order[r[0]:r[1]] for r in map(self.ranges.get, keys.tolist()) if r is not None]
+            if found:
+                points = np.concatenate(found)
+                seg_parts.append(np.full(len(points), k, dtype=np.int64))
+                point_parts.append(points)
+        if not seg_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(seg_parts), np.concatenate(point_parts)
+
+
+def project_to_polyline(coords, segments, xy):
+    """
+    For pairs (segment k of the polyline, point): distance from the point to the
+    segment and distance along the polyline to the projection (as lineLocatePoint).
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    a = coords[segments]
+    d = coords[segments + 1] - a
+    len2 = (d * d).sum(axis=1)
+    t = np.clip(((xy - a) * d).sum(axis=1) / np.where(len2 > 0, len2, 1.0), 0.0, 1.0)
+    distance = np.hypot(*(xy - (a + t[:, None] * d)).T)
+    start = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))))
+    return distance, start[segments] + t * np.sqrt(len2)
+
+
+def cluster_points(xy, tolerance: float) -> np.ndarray:
+    """
+    Groups points closer than tolerance (transitively), in linear time: a grid
+    of one-tolerance cells, so close points always share a cell or are in
+    neighbouring ones; the close pairs of each cell and its neighbours are then
+    joined as in a union-find (connected components of the pair graph).
+    Returns the label of every point: the index of the first point of its group.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    n = len(xy)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = np.floor(xy / (tolerance if tolerance > 0 else 1.0)).astype(np.int64)
+    keys = PointGrid._keys(cells)
+    order = np.argsort(keys, kind='stable')
+    cell_keys, start, count = np.unique(keys[order], return_index=True, return_counts=True)
+    cell_ij = cells[order[start]]
+
+    rows, cols = [], []
+    # Each cell with itself and four neighbours: every neighbouring pair of cells once
+    for offset in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        target = PointGrid._keys(cell_ij + np.array(offset))
+        pos = np.minimum(np.searchsorted(cell_keys, target), len(cell_keys) - 1)
+        a = np.flatnonzero(cell_keys[pos] == target)
+        b = pos[a]
+        # Every point of cell a with every point of cell b
+        sizes = count[a] * count[b]
+        pair = np.repeat(np.arange(len(a)), sizes)
+        within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        p = order[start[a][pair] + within // count[b][pair]]
+        q = order[start[b][pair] + within % count[b][pair]]
+        if offset == (0, 0):
+            p, q = p[p < q], q[p < q]
+        close = ((xy[p] - xy[q]) ** 2).sum(axis=1) < tolerance * tolerance
+        rows.append(p[close])
+        cols.append(q[close])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+    first = np.full(component.max() + 1, n, dtype=np.int64)
+    np.minimum.at(first, component, np.arange(n))
+    return first[component]
+
+
+def segment_intersections(starts, ends, owners, cell_size: float) -> np.ndarray:
+    """
+    Points where segments of different owners (lines) cross or touch.
+    Segments are bucketed in the grid cells they pass through (not their bounding
+    boxes: a long diagonal among short segments stays linear in its length), so
+    only pairs sharing a cell are tested, all in one vectorized pass: about
+    O((n + k) log n) when the cell size is close to the typical segment length.
+    Collinear overlaps are not reported. Returns a (k, 2) array.
+    """
+    a = np.asarray(starts, dtype=float).reshape(-1, 2)
+    b = np.asarray(ends, dtype=float).reshape(-1, 2)
+    owners = np.asarray(owners)
+    n = len(a)
+    if n < 2:
+        return np.zeros((0, 2))
+    cell_size = float(cell_size) if cell_size > 0 else 1.0
+    lo = np.floor(np.minimum(a, b) / cell_size).astype(np.int64)
+    hi = np.floor(np.maximum(a, b) / cell_size).astype(np.int64)
+
+    # Breakpoints of each segment: its ends and where it crosses a grid line.
+    # Every piece between two breakpoints lies in one cell, next to both of them
+    pts, segs = [a, b], [np.arange(n), np.arange(n)]
+    for axis in (0, 1):
+        lines = hi[:, axis] - lo[:, axis]
+        seg = np.repeat(np.arange(n), lines)
+        k = lo[seg, axis] + 1 + np.arange(lines.sum()) - np.repeat(np.cumsum(lines) - lines, lines)
+        at = k * cell_size
+        t = (at - a[seg, axis]) / (b[seg, axis] - a[seg, axis])
+        pt = a[seg] + t[:, None] * (b[seg] - a[seg])
+        pt[:, axis] = at
+        pts.append(pt)
+        segs.append(seg)
+    pts, seg = np.concatenate(pts), np.concatenate(segs)
+    # (cell, segment) for the cells around every breakpoint: a nudge both ways on
+    # each axis reaches all the cells meeting there (one, two, or four at a corner)
+    h = 1e-6 * cell_size
+    cells = np.concatenate([np.floor((pts + (dx, dy)) / cell_size)
+                            for dx in (-h, h) for dy in (-h, h)]).astype(np.int64)
+    seg = np.tile(seg, 4)
+    keys = PointGrid._keys(cells)
+    order = np.lexsort((seg, keys))
+    keys, seg = keys[order], seg[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (seg[1:] != seg[:-1])
+    keys, seg = keys[first], seg[first]
+    _, start, count = np.unique(keys, return_index=True, return_counts=True)
+
+    # Every pair of segments in each cell, once
+    busy = count > 1
+    start, count = start[busy], count[busy]
+    sizes = count * count
+    group = np.repeat(np.arange(len(count)), sizes)
+    within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    p = seg[start[group] + within // count[group]]
+    q = seg[start[group] + within % count[group]]
+    keep = (p < q) & (owners[p] != owners[q])
+    pairs = np.unique(p[keep] * n + q[keep])
+    p, q = pairs // n, pairs % n
+
+    # p + t r = q + u s, with 0 <= t, u <= 1
+    r = b[p] - a[p]
+    s = b[q] - a[q]
+    d = a[q] - a[p]
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    parallel = np.abs(denom) <= 1e-12 * np.hypot(*r.T) * np.hypot(*s.T)
+    denom = np.where(parallel, 1.0, denom)
+    t = (d[:, 0] * s[:, 1] - d[:, 1] * s[:, 0]) / denom
+    u = (d[:, 0] * r[:, 1] - d[:, 1] * r[:, 0]) / denom
+    eps = 1e-9
+    hit = ~parallel & (t >= -eps) & (t <= 1 + eps) & (u >= -eps) & (u <= 1 + eps)
+    return a[p[hit]] + np.clip(t[hit], 0.0, 1.0)[:, None] * r[hit]
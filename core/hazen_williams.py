@@ -0,0 +1,22 @@
+import numpy as np
+from .constants import DEFAULT_HAZEN_C
+
+
+def hazen_williams(flow, diameter, length, c=DEFAULT_HAZEN_C):
+    """
+    Vectorized Hazen-Williams head loss for any number of pipes at once.
+
+    flow in m3/h, diameter in mm, length in m and the C factor may be scalars or
+    arrays (NumPy broadcasting rules apply).
+    Returns (head_loss in mca, velocity in m/s) as arrays. Both are zero where the
+    flow or the diameter is not positive.
+    """
+    q = np.asarray(flow, dtype=float) / 3600.0
+    d = np.asarray(diameter, dtype=float) / 1000.0
+    valid = (q > 0) & (d > 0)
+    q = np.where(valid, q, 0.0)
+    d = np.where(valid, d, 1.0)
+
+    head_loss = np.where(valid, 10.67 * np.asarray(length, dtype=float) * (q ** 1.852) / ((np.asarray(c, dtype=float) ** 1.852) * (d ** 4.87)), 0.0)
+    velocity = np.where(valid, q / (np.pi * (d ** 2) / 4), 0.0)
+    return head_loss, velocity
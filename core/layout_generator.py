@@ -4,6 +4,8 @@ from qgis.core import (
     QgsGeometry, QgsPointXY, QgsVectorLayer, QgsFeature, QgsField, QgsWkbTypes, QgsRectangle
 )
 from qgis.PyQt.QtCore import QVariant
+import numpy as np
+from .hazen_williams import hazen_williams
 from .constants import DEFAULT_HAZEN_C
 
 class LayoutGenerator:
@@ -34,48 +36,25 @@ class LayoutGenerator:
             max_pressure_variation_percent: Max allowed pressure variation as % of service pressure.
         """
         max_delta_p = self.service_pressure * (max_pressure_variation_percent / 100.0)
+        max_emitters = 2000 # Safety limit
         
-        # Hazen-Williams Constants
-        c = self.hose_roughness
-        d_m = self.hose_diameter / 1000.0
-        # Pre-calculate constant part of HW formula: J = K * Q^1.852
-        # J = 10.67 * Q^1.852 * D^-4.87 * C^-1.852
-        # J = (10.67 * D^-4.87 * C^-1.852) * Q^1.852
-        k_hw = 10.67 * (d_m ** -4.87) * (c ** -1.852)
+        # Segment k (k >= 2) carries the flow of the (n - k + 1) emitters downstream of it.
+        # Over k = 2..n those counts are exactly 1..n-1, so the segment head losses do not
+        # depend on n: Delta P(n) is the running sum of HF(j * q) for j = 1..n-1.
+        # All candidate segments are evaluated in one kernel call.
+        emitters_downstream = np.arange(1, max_emitters + 1)
+        q_segment_m3h = emitters_downstream * self.emitter_flow / 1000.0 # L/h -> m3/h
+        hf, _ = hazen_williams(q_segment_m3h, self.hose_diameter, self.emitter_spacing, self.hose_roughness)
         
-        n = 1
-        while True:
-            # Check if n emitters are valid
-            # We calculate the pressure drop from the 1st emitter to the n-th emitter.
-            # This corresponds to the sum of HF for segments 2 to n.
-            # Segment 1 is from inlet to 1st emitter (affects both P1 and Pn equally).
-            
-            current_delta_p = 0.0
-            
-            # Optimization: We could just add the new segment for n to the previous delta_p?
-            # When we go from n to n+1:
-            # The flow in ALL existing segments increases.
-            # So we must recalculate everything or use a smarter update.
-            # Given n is likely < 1000, a full recalculation is fast enough (O(n^2) total complexity).
-            
-            for k in range(2, n + 1):
-                # Flow in segment k
-                # It supplies emitters k to n. Count = n - k + 1
-                emitters_downstream = n - k + 1
-                q_segment_l_h = emitters_downstream * self.emitter_flow
-                q_segment_si = q_segment_l_h / 1000.0 / 3600.0 # L/h -> m3/h -> m3/s
-                
-                if q_segment_si > 0:
-                    j = k_hw * (q_segment_si ** 1.852)
-                    hf = j * self.emitter_spacing
-                    current_delta_p += hf
-            
-            if current_delta_p > max_delta_p:
-                return max(1, n - 1)
+        # delta_p[n - 1] = pressure difference between the 1st and the n-th emitter
+        delta_p = np.concatenate(([0.0], np.cumsum(hf)))
+        
+        exceeded = np.flatnonzero(delta_p[:max_emitters] > max_delta_p)
+        if exceeded.size == 0:
+            return max_emitters
             
-            n += 1
-            if n > 2000: # Safety limit
-                return 2000
+        n = int(exceeded[0]) + 1
+        return max(1, n - 1)
 
     def generate_global_emitters(self, area_geom: QgsGeometry) -> List[QgsGeometry]:
         """
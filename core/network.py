@@ -1,31 +1,58 @@
 import math
 from typing import List, Dict, Optional, Tuple
-from qgis.core import QgsPointXY, QgsGeometry
+from .geometry import Point, LineGeometry
 
 class HydraulicNode:
-    def __init__(self, node_id: str, point: QgsPointXY, node_type: str):
+    __slots__ = ('id', 'point', 'type', 'elevation', 'base_demand', 'emitter_count', 'pressure',
+                 'connected_links', 'downstream_links', 'upstream_link')
+
+    def __init__(self, node_id: str, point: Point, node_type: str):
         self.id = node_id
         self.point = point
         self.type = node_type  # 'emitter', 'valve', 'source', 'junction'
         self.elevation = 0.0
         self.base_demand = 0.0  # Vazão consumida neste nó (ex: emissor)
+        self.emitter_count = 1  # Emissores representados pelo nó (rede reduzida)
         self.pressure = 0.0
         self.connected_links = [] # Todos os links conectados (independente da direção)
         self.downstream_links = [] # Links saindo deste nó (após definir direção)
         self.upstream_link = None  # Link chegando neste nó (após definir direção)
 
 class HydraulicLink:
-    def __init__(self, link_id: str, geometry: QgsGeometry, link_type: str):
+    __slots__ = ('id', '_geometry', 'type', 'start_node', 'end_node', 'length',
+                 'diameter', 'flow', 'head_loss', 'velocity', 'feature_id', 'group', 'stored_diameter')
+
+    def __init__(self, link_id: str, geometry: Optional[LineGeometry], link_type: str, length: Optional[float] = None):
         self.id = link_id
-        self.geometry = geometry
+        # Only kept when it carries more than the two end points (see geometry)
+        self._geometry = geometry
         self.type = link_type  # 'hose', 'lateral', 'derivation', 'main'
         self.start_node: Optional[HydraulicNode] = None
         self.end_node: Optional[HydraulicNode] = None
-        self.length = geometry.length()
+        if length is not None:
+            self.length = length
+        else:
+            self.length = geometry.length() if geometry is not None else 0.0 # Straight links: set by connect_link
         self.diameter = 0.0  # mm
         self.flow = 0.0      # m3/h
         self.head_loss = 0.0 # mca
         self.velocity = 0.0  # m/s
+        self.feature_id = None # Feição de origem (todos os trechos dela têm o mesmo DN)
+        self.group = None      # Grupo escolhido pelo usuário (ex: setor), compartilha o DN
+        self.stored_diameter = 0.0 # DN gravado na camada por um cálculo anterior (mm)
+
+    @property
+    def geometry(self) -> Optional[LineGeometry]:
+        """Stored geometry, or the straight segment between the end nodes (built on demand)."""
+        if self._geometry is not None:
+            return self._geometry
+        if self.start_node is None or self.end_node is None:
+            return None
+        return LineGeometry.fromPolylineXY([self.start_node.point, self.end_node.point])
+
+    @geometry.setter
+    def geometry(self, geometry: Optional[LineGeometry]):
+        self._geometry = geometry
 
 class HydraulicNetwork:
     def __init__(self):
@@ -54,6 +81,9 @@ class HydraulicNetwork:
         
         start_node.connected_links.append(link)
         end_node.connected_links.append(link)
+        
+        if link._geometry is None and link.length == 0.0:
+            link.length = math.sqrt(start_node.point.sqrDist(end_node.point))
 
     def clear(self):
         self.nodes.clear()
@@ -2,7 +2,11 @@ from qgis.core import (
     QgsVectorLayer, QgsSpatialIndex, QgsFeatureRequest, QgsGeometry, 
     QgsPointXY, QgsWkbTypes
 )
+import numpy as np
 from .network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from .geometry import (
+    Point, LineGeometry, GridIndex, PointGrid, project_to_polyline, cluster_points, segment_intersections
+)
 from .elevation import ElevationManager
 from qgis.core import QgsRasterLayer
 
@@ -11,44 +15,187 @@ class NetworkBuilder:
         self.network = network
         self.tolerance = 0.1 # Tolerance for snapping (meters)
         self.elevation_manager = ElevationManager()
-        self.dem_layer = None
+        self.elevation = None # f(QgsPointXY) -> elevation of the current build, from the DEM
+        self.group_field = None # Optional line attribute whose segments share one diameter (e.g. sector)
+        self.node_index = GridIndex(self.tolerance) # Nodes added by this builder, for _find_node_at
+        self._line_grid = None # PointGrid of all nodes for _nodes_on_line, with its node list
+        self._line_grid_nodes = []
+        self.snap_stats = {} # points / unique / merged / snapped of the last _deduplicate_points, to tune tolerance
+        # Lines crossing each other get a junction (tee) at the crossing. Only when no
+        # junctions are supplied: with them, crossings are pipes passing over each other
+        self.split_crossings = True
+        self.crossing_count = 0 # Intersection points found by the last build
+
+    # --- Adapters between QGIS geometries and the QGIS-free core geometry ---
+
+    @staticmethod
+    def to_point(point) -> Point:
+        return Point(point.x(), point.y())
+
+    @staticmethod
+    def to_qgs_point(point) -> QgsPointXY:
+        return QgsPointXY(point.x(), point.y())
+
+    @staticmethod
+    def to_line(geometry: QgsGeometry) -> LineGeometry:
+        return LineGeometry.fromPolylineXY(geometry.asPolyline())
+
+    @staticmethod
+    def to_qgs_geometry(line: LineGeometry) -> QgsGeometry:
+        return QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in line.coords.tolist()])
+
+    # Input keys -> link / node types
+    LINE_TYPES = (('hoses', 'hose'), ('laterals', 'lateral'), ('derivations', 'derivation'), ('main', 'main'))
+    POINT_TYPES = (('source', 'source'), ('valves', 'valve'), ('emitters', 'emitter'))
 
     def build(self, layers: dict, dem_layer: QgsRasterLayer = None):
         """
         Builds the network graph from the provided layers.
-        layers: dict with keys 'hoses', 'laterals', 'derivations', 'main', 'valves', 'source'
+        layers: dict with keys 'hoses', 'laterals', 'derivations', 'main', 'valves', 'source',
+        'emitters' and 'junctions' (points where lines connect, see build_from_geometries)
         dem_layer: Optional DEM raster for elevation
         """
-        self.dem_layer = dem_layer
-        
-        # 1. Add Fixed Nodes (Source, Valves)
-        if 'source' in layers and layers['source']:
-            self._add_point_nodes(layers['source'], 'source')
-            
-        if 'valves' in layers and layers['valves']:
-            self._add_point_nodes(layers['valves'], 'valve')
-            
-        if 'emitters' in layers and layers['emitters']:
-            # Emitters need special handling to read flow/demand if available
-            # Or we assign default demand later.
-            # For now, let's add them as nodes.
-            self._add_point_nodes(layers['emitters'], 'emitter')
+        self.build_from_features(self.read_layers(layers), self.elevation_manager.sampler(dem_layer))
+
+    def read_layers(self, layers: dict) -> dict:
+        """
+        Copies the features of the layers (as in build()) into plain data, so the
+        build itself can run in a background task without touching the layers.
+        Returns {'points': [(node_id, Point, node_type, demand)], 'junctions': [Point],
+                 'lines': [(LineGeometry, type, feature id, group, stored DN)]}
+        """
+        # 1. Fixed Nodes (Source, Valves)
+        # Emitters read their flow/demand field if available
+        points = []
+        for key, node_type in self.POINT_TYPES:
+            if key in layers and layers[key]:
+                self._read_point_features(layers[key], node_type, points)
             
         # 2. Collect all lines and their types
-        lines = [] # list of (geometry, type, original_id)
-        if 'hoses' in layers and layers['hoses']:
-            self._collect_lines(layers['hoses'], 'hose', lines)
-        if 'laterals' in layers and layers['laterals']:
-            self._collect_lines(layers['laterals'], 'lateral', lines)
-        if 'derivations' in layers and layers['derivations']:
-            self._collect_lines(layers['derivations'], 'derivation', lines)
-        if 'main' in layers and layers['main']:
-            self._collect_lines(layers['main'], 'main', lines)
-            
+        lines = [] # list of (geometry, type, original_id, group, stored_dn)
+        for key, l_type in self.LINE_TYPES:
+            if key in layers and layers[key]:
+                self._collect_lines(layers[key], l_type, lines)
+        
+        junctions = []
+        if 'junctions' in layers and layers['junctions']:
+            for feat in layers['junctions'].getFeatures():
+                geom = feat.geometry()
+                if geom and not QgsWkbTypes.isMultiType(geom.wkbType()):
+                    junctions.append(self.to_point(geom.asPoint()))
+        
+        return {'points': points, 'lines': self._explode(lines), 'junctions': junctions}
+
+    def geometry_features(self, lines: dict, points: dict = None, junctions=None) -> dict:
+        """
+        In-memory geometries as read_layers() data (no attributes: no demand, group or DN).
+        lines: {'hoses' | 'laterals' | 'derivations' | 'main': list of lines}, each a
+            QgsGeometry, a LineGeometry or an (n, 2) coordinate sequence, numbered from 1
+        points: {'source' | 'valves' | 'emitters': points (x()/y()) or an (n, 2) array},
+            named '<type>_g<n>' so they never clash with '<type>_<feature id>' layer nodes
+        junctions: points where lines connect, see build_from_geometries
+        """
+        points = points or {}
+        point_list = []
+        for key, node_type in self.POINT_TYPES:
+            for i, pt in enumerate(self._as_points(points.get(key, ()))):
+                # 'g' keeps these apart from layer nodes, named by feature id
+                point_list.append((f"{node_type}_g{i + 1}", pt, node_type, 0.0))
+        
+        line_list = []
+        for key, l_type in self.LINE_TYPES:
+            for i, geom in enumerate(lines.get(key, ())):
+                geom = geom if hasattr(geom, 'isMultipart') else LineGeometry(geom)
+                line_list.append((geom, l_type, i + 1, None, 0.0))
+        
+        junction_list = self._as_points(junctions if junctions is not None else ())
+        return {'points': point_list, 'lines': self._explode(line_list), 'junctions': junction_list}
+
+    def build_from_geometries(self, lines: dict, points: dict = None, junctions=None, elevation=None):
+        """
+        Builds the network graph from in-memory geometries, with no layer round trip.
+        lines, points: see geometry_features
+        junctions: points where lines connect. They become nodes as given
+            (authoritative split points), before the endpoints are snapped to them.
+        elevation: optional f(QgsPointXY) -> elevation, see ElevationManager.sampler
+        """
+        self.build_from_features(self.geometry_features(lines, points, junctions), elevation)
+
+    def build_from_features(self, features: dict, elevation=None):
+        """
+        Builds the network graph from read_layers() / geometry_features() data,
+        e.g. read on the main thread for a background build.
+        elevation: optional f(QgsPointXY) -> elevation, see ElevationManager.sampler
+        """
+        self._start(elevation)
+        
+        for node_id, pt, node_type, demand in features.get('points', ()):
+            node = self._new_node(node_id, pt, node_type)
+            node.base_demand = demand # Assign demand
+            self._add_node(node)
+        
+        self._build_graph(list(features.get('lines', ())), list(features.get('junctions', ())))
+
+    def _start(self, elevation):
+        self.elevation = elevation
+        self._line_grid = None # Built again from this build's nodes
+        self._line_grid_nodes = []
+        self.node_index = GridIndex(self.tolerance)
+        for node in self.network.nodes.values():
+            self.node_index.insert(node.point, node)
+
+    def _as_points(self, points) -> list:
+        if isinstance(points, np.ndarray):
+            return [Point(x, y) for x, y in points.reshape(-1, 2).tolist()]
+        return [self.to_point(pt) for pt in points]
+
+    def _new_node(self, node_id, point, node_type) -> HydraulicNode:
+        node = HydraulicNode(node_id, self.to_point(point), node_type)
+        # Sample Elevation
+        if self.elevation:
+            node.elevation = self.elevation(self.to_qgs_point(point))
+        return node
+
+    def _explode(self, lines) -> list:
+        """One LineGeometry per part; every part keeps its feature's type, id, group and DN."""
+        single = []
+        for geom, l_type, orig_id, group, stored_dn in lines:
+            if isinstance(geom, LineGeometry):
+                parts = [geom]
+            elif geom.isMultipart():
+                parts = [LineGeometry.fromPolylineXY(part) for part in geom.asMultiPolyline()]
+            else:
+                parts = [self.to_line(geom)]
+            for part in parts:
+                if len(part.coords) >= 2:
+                    single.append((part, l_type, orig_id, group, stored_dn))
+        return single
+
+    def _crossings(self, lines) -> list:
+        """Points where segments of two different lines cross or touch (tees and crossings)."""
+        coords = [geom.coords for geom, _, _, _, _ in lines]
+        if not coords:
+            return []
+        owner = np.repeat(np.arange(len(coords)), [len(c) - 1 for c in coords])
+        starts = np.concatenate([c[:-1] for c in coords])
+        ends = np.concatenate([c[1:] for c in coords])
+        # Cells about one typical segment long: few cells per segment, few segments per cell
+        cell_size = max(float(np.median(np.hypot(*(ends - starts).T))), 4 * self.tolerance)
+        return [Point(x, y) for x, y in segment_intersections(starts, ends, owner, cell_size).tolist()]
+
+    def _build_graph(self, lines, junctions=()):
         # 3. Build Graph Geometry
         # We need to find all intersection points and endpoints to define nodes
         # Then split lines at these nodes to define links
         
+        # Multipart features become one line per part (same feature, same provenance)
+        lines = self._explode(lines)
+        
+        # Supplied junctions are nodes as given: no rediscovery, endpoints snap to them
+        for pt in junctions:
+            if not self._find_node_at(pt):
+                self._add_node(self._new_node(f"junc_{pt.x():.3f}_{pt.y():.3f}", pt, 'junction'))
+        
         # A. Collect Potential Node Points
         points = []
         
@@ -57,18 +204,17 @@ class NetworkBuilder:
             points.append(node.point)
             
         # Add endpoints of all lines
-        for geom, _, _ in lines:
-            if geom.isMultipart():
-                parts = geom.asMultiPolyline()
-                for part in parts:
-                    if part:
-                        points.append(QgsPointXY(part[0]))
-                        points.append(QgsPointXY(part[-1]))
-            else:
-                line = geom.asPolyline()
-                if line:
-                    points.append(QgsPointXY(line[0]))
-                    points.append(QgsPointXY(line[-1]))
+        for geom, _, _, _, _ in lines:
+            (x0, y0), (x1, y1) = geom.coords[0].tolist(), geom.coords[-1].tolist()
+            points.append(Point(x0, y0))
+            points.append(Point(x1, y1))
+        
+        # Add crossings between lines (interior crossings have no endpoint there).
+        # Supplied junctions are the complete set of connections: a main laid over
+        # another sector's hoses does not feed them where it crosses
+        crossings = self._crossings(lines) if self.split_crossings and not junctions else []
+        self.crossing_count = len(crossings)
+        points.extend(crossings)
                     
         # B. Deduplicate Points (Snap)
         unique_nodes = self._deduplicate_points(points)
@@ -79,70 +225,96 @@ class NetworkBuilder:
             existing_node = self._find_node_at(pt)
             if not existing_node:
                 node_id = f"junc_{pt.x():.3f}_{pt.y():.3f}"
-                node = HydraulicNode(node_id, pt, 'junction')
+                self._add_node(self._new_node(node_id, pt, 'junction'))
                 
-                # Sample Elevation
-                if self.dem_layer:
-                    node.elevation = self.elevation_manager.sample_elevation(pt, self.dem_layer, self.dem_layer.crs())
-                    
-                self.network.add_node(node)
-                
-        # C. Create Links (Split lines at nodes)
-        for geom, l_type, orig_id in lines:
-            self._process_line_segments(geom, l_type, orig_id)
+        # C. Create Links (Split lines at nodes); link numbering runs on across the parts of a feature
+        next_index = {}
+        for geom, l_type, orig_id, group, stored_dn in lines:
+            key = (l_type, orig_id)
+            next_index[key] = self._process_line_segments(geom, l_type, orig_id, group, stored_dn, next_index.get(key, 0))
 
     def _collect_lines(self, layer, l_type, lines_list):
+        idx_group = layer.fields().indexFromName(self.group_field) if self.group_field else -1
+        # Diameter written by a previous optimization (warm start)
+        idx_dn = layer.fields().indexFromName('Diametro')
         for feat in layer.getFeatures():
             if feat.geometry():
-                lines_list.append((feat.geometry(), l_type, feat.id()))
+                group = None
+                if idx_group != -1:
+                    val = feat.attributes()[idx_group]
+                    if val is not None and val != '':
+                        group = f"{l_type}:{val}"
+                stored_dn = 0.0
+                if idx_dn != -1:
+                    try:
+                        stored_dn = float(feat.attributes()[idx_dn] or 0.0)
+                    except (TypeError, ValueError): pass
+                lines_list.append((feat.geometry(), l_type, feat.id(), group, stored_dn))
 
     def _deduplicate_points(self, points):
-        """Merges points closer than tolerance."""
+        """Merges points closer than tolerance (transitively); the first point of each group stays."""
+        xy = np.array([(pt.x(), pt.y()) for pt in points], dtype=float).reshape(-1, 2)
+        labels = cluster_points(xy, self.tolerance)
         unique = {} # "x_y" -> QgsPointXY
-        for pt in points:
-            # Simple grid snapping for deduplication
-            # For better precision, use a spatial index or KD-tree
-            key = f"{round(pt.x(), 2)}_{round(pt.y(), 2)}"
-            if key not in unique:
-                unique[key] = pt
+        for i in np.unique(labels).tolist():
+            pt = points[i]
+            unique[f"{pt.x()}_{pt.y()}"] = pt
+        # merged counts shared endpoints too; snapped only the points that actually moved
+        self.snap_stats = {
+            'points': len(points),
+            'unique': len(unique),
+            'merged': len(points) - len(unique),
+            'snapped': int(np.count_nonzero((xy != xy[labels]).any(axis=1))),
+        }
         return unique
 
+    def _add_node(self, node: HydraulicNode):
+        self.network.add_node(node)
+        self.node_index.insert(node.point, node)
+
     def _find_node_at(self, point):
-        # Linear search is slow, should use spatial index in Network
-        # For now, iterating
-        for node in self.network.nodes.values():
-            if node.point.sqrDist(point) < (self.tolerance * self.tolerance):
-                return node
-        return None
+        # Closest node within tolerance (grid cells of one tolerance: O(1) on average)
+        return self.node_index.nearest(point, self.tolerance)
 
-    def _process_line_segments(self, geometry, l_type, orig_id):
-        # Find all nodes that lie on this geometry
-        nodes_on_line = []
-        for node in self.network.nodes.values():
-            # Buffer point slightly to check intersection/contains
-            # Or use distance
-            if geometry.distance(QgsGeometry.fromPointXY(node.point)) < self.tolerance:
-                nodes_on_line.append(node)
-        
-        # Sort nodes by distance from start of line
-        # Assuming single line for simplicity
-        if geometry.isMultipart():
-            return # TODO: Handle multipart
-            
-        line_geom = geometry.asPolyline()
-        if not line_geom: return
+    def _node_grid(self) -> PointGrid:
+        # Nodes do not change while links are created: one grid for all lines
+        if self._line_grid is None or len(self._line_grid_nodes) != len(self.network.nodes):
+            self._line_grid_nodes = list(self.network.nodes.values())
+            xy = [(node.point.x(), node.point.y()) for node in self._line_grid_nodes]
+            self._line_grid = PointGrid(xy, max(4 * self.tolerance, 1.0))
+        return self._line_grid
+
+    def _nodes_on_line(self, coords):
+        """
+        Nodes within tolerance of the polyline, as (distance along the line, node)
+        sorted along it: grid candidates near each segment, then one vectorized
+        point-to-segment distance and projection.
+        """
+        grid = self._node_grid()
+        segments, candidates = grid.near_polyline(coords, self.tolerance)
+        if len(candidates) == 0:
+            return []
+        distance, along = project_to_polyline(coords, segments, grid.xy[candidates])
+        on_line = distance < self.tolerance
+        candidates, distance, along = candidates[on_line], distance[on_line], along[on_line]
         
-        start_pt = line_geom[0]
+        # A node near several segments (at a vertex) counts once, at its closest one
+        order = np.lexsort((distance, candidates))
+        order = order[np.unique(candidates[order], return_index=True)[1]]
+        # Along the line; ties in node order
+        order = order[np.lexsort((candidates[order], along[order]))]
+        return [(float(along[i]), self._line_grid_nodes[candidates[i]]) for i in order.tolist()]
+
+    def _process_line_segments(self, geometry: LineGeometry, l_type, orig_id, group=None, stored_dn=0.0, first_index=0):
+        """
+        Creates the links of one single-part line (see _explode) between the nodes on it.
+        Returns the next free link index.
+        """
+        coords = geometry.coords
+        if len(coords) == 0: return first_index
         
-        # Calculate distance of each node from start
-        nodes_with_dist = []
-        for node in nodes_on_line:
-            dist = QgsGeometry.fromPolylineXY([start_pt, node.point]).length() # Approximation
-            # Better: project point to line and get distance along line
-            dist = geometry.lineLocatePoint(QgsGeometry.fromPointXY(node.point))
-            nodes_with_dist.append((dist, node))
-            
-        nodes_with_dist.sort(key=lambda x: x[0])
+        # Nodes that lie on this geometry, sorted by distance from the start of the line
+        nodes_with_dist = self._nodes_on_line(coords)
         
         # Create links between consecutive nodes
         for i in range(len(nodes_with_dist) - 1):
@@ -152,16 +324,18 @@ class NetworkBuilder:
             if u_node == v_node: continue
             
             # Create Link
-            link_id = f"{l_type}_{orig_id}_{i}"
-            # Geometry is segment between u and v
-            # Construct simple line for now
-            segment_geom = QgsGeometry.fromPolylineXY([u_node.point, v_node.point])
-            
-            link = HydraulicLink(link_id, segment_geom, l_type)
+            link_id = f"{l_type}_{orig_id}_{first_index + i}"
+            # Geometry is the straight segment between u and v: the link builds it
+            # from the node points on demand (length is set by connect_link)
+            link = HydraulicLink(link_id, None, l_type)
+            link.feature_id = f"{l_type}_{orig_id}"
+            link.group = group
+            link.stored_diameter = stored_dn
             self.network.add_link(link)
             self.network.connect_link(link_id, u_node.id, v_node.id)
+        return first_index + max(len(nodes_with_dist) - 1, 0)
 
-    def _add_point_nodes(self, layer: QgsVectorLayer, node_type: str):
+    def _read_point_features(self, layer: QgsVectorLayer, node_type: str, points_list):
         # Try to find flow/demand field
         idx_flow = -1
         if node_type == 'emitter':
@@ -184,25 +358,9 @@ class NetworkBuilder:
                 except: pass
             
             if QgsWkbTypes.isMultiType(geom.wkbType()):
-                points = geom.asMultiPoint()
-                for pt in points:
+                for pt in geom.asMultiPoint():
                     node_id = f"{node_type}_{feat.id()}_{pt.x():.2f}"
-                    node = HydraulicNode(node_id, pt, node_type)
-                    node.base_demand = demand # Assign demand
-                    
-                    # Sample Elevation
-                    if self.dem_layer:
-                        node.elevation = self.elevation_manager.sample_elevation(pt, self.dem_layer, self.dem_layer.crs())
-                        
-                    self.network.add_node(node)
+                    points_list.append((node_id, self.to_point(pt), node_type, demand))
             else:
-                pt = geom.asPoint()
                 node_id = f"{node_type}_{feat.id()}"
-                node = HydraulicNode(node_id, pt, node_type)
-                node.base_demand = demand # Assign demand
-                
-                # Sample Elevation
-                if self.dem_layer:
-                    node.elevation = self.elevation_manager.sample_elevation(pt, self.dem_layer, self.dem_layer.crs())
-                    
-                self.network.add_node(node)
+                points_list.append((node_id, self.to_point(geom.asPoint()), node_type, demand))
@@ -1,16 +1,112 @@
 import random
 import copy
-from typing import List, Dict, Callable
-from .constants import VALID_DNS, PIPE_COSTS
+import time
+import queue
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from .constants import VALID_DNS
+from .fitness import FitnessModel
+
+# Worker-process state: the FitnessModel shipped once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(model: FitnessModel):
+    global _worker_model
+    _worker_model = model
+
+
+def _score_chunk(genomes) -> List[float]:
+    # Pure function of the genomes: no RNG and no shared state in the workers
+    return _worker_model.evaluate(genomes).tolist()
+
+
+def _run_island(island, seeds, inbox, outbox, results, index, cancel):
+    # One island process: evolves its own population, exchanging migrants in a ring
+    closed = False
+    island.is_canceled = cancel.is_set
+    island.progress_callback = lambda *report: results.put(('progress', index, report))
+    
+    def migrate(emigrants):
+        nonlocal closed
+        outbox.put(emigrants)
+        if closed:
+            return []
+        try:
+            immigrants = inbox.get(timeout=island.migration_timeout)
+        except queue.Empty:
+            immigrants = None
+        if immigrants is None: # Previous island finished (or is gone)
+            closed = True
+            return []
+        return immigrants
+    
+    try:
+        best_solution = island._evolve(seeds, migrate)
+    finally:
+        outbox.put(None)
+    results.put(('done', index, (best_solution, island.run_stats, island.cache_stats, island.operator_stats)))
+
 
 class GeneticOptimizer:
-    def __init__(self, solver, population_size=50, generations=100, mutation_rate=0.1):
+    def __init__(self, solver, population_size=50, generations=100, mutation_rate=0.1, workers=1, seed=None, islands=1):
         self.solver = solver
         self.network = solver.network
         self.population_size = population_size
         self.generations = generations
         self.mutation_rate = mutation_rate
         self.elitism_count = 2
+        self.model = None # FitnessModel, built when the search starts
+        
+        # Parallel scoring: worker processes only evaluate genomes. Selection,
+        # crossover and mutation stay in this process with a seeded RNG, so a run
+        # gives the same result for any worker count.
+        self.workers = workers
+        self.parallel_min_work = 200000 # population x genes below which scoring stays serial
+        self.rng = random.Random(seed)
+        self._executor = None
+        
+        # LRU fitness cache keyed by the genome bytes (DN indices fit in a byte)
+        self.cache_size = 20000
+        self._cache = OrderedDict()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'delta': 0} # of the last optimize()
+        
+        # Warm start: part of the first population comes from known designs
+        # (initial sizing, greedy sizer, diameters stored by a previous run)
+        self.warm_start = True
+        self.warm_start_fraction = 0.2
+        
+        # Stopping rules (besides the generation count)
+        self.stagnation_generations = 20 # stop after K generations without improvement
+        self.time_budget = None # seconds
+        self.target_gap = None # stop within this relative gap of the all-minimum-DN cost
+        self.run_stats = {} # generations / elapsed / stop_reason / lower_bound of the last optimize()
+        
+        # Island model: independent populations in separate processes, each with its
+        # own mutation rate, passing their best individuals around a ring
+        self.islands = islands
+        self.migration_interval = 10 # generations between exchanges
+        self.migration_size = 2 # individuals sent to the next island
+        self.migration_timeout = 300.0 # seconds to wait for the previous island
+        
+        # Progress and cancellation, once per generation
+        self.progress_callback = None # f(generation, generations, best_cost, deficit), deficit = worst pressure shortfall (m)
+        self.is_canceled = None # callable; True stops the run, keeping the best solution so far
+        
+        # Delta evaluation: a child differing from a scored parent in at most this
+        # fraction of the genes (or 4 genes) is scored by updating the parent's pressures
+        self.delta_max_fraction = 0.01
+        self._states = {} # genome key -> FitnessModel state of the current generation
+        
+        # Mutation operators, picked per child with weights that follow their success
+        # rate (child better than its first parent), each moving genes by one DN:
+        # +-1 DN steps, upsizing on the critical path and downsizing where pressure is left over
+        self.directed_mutation = True # False: uniform random DNs only
+        self.operator_floor = 0.05 # minimum weight, so no operator dies out
+        self.operator_stats = {} # operator -> [tries, successes] of the last optimize()
         
         # Identify optimizable links (pipes, not hoses if fixed)
         # For now, we optimize all links that are not 'hose' or we can optimize everything.
@@ -23,24 +119,91 @@ class GeneticOptimizer:
         if not self.optimizable_links:
             # Fallback: if no pipes, maybe everything is a hose?
             self.optimizable_links = list(self.network.links.values())
+        
+        # One gene per group of links sharing a diameter: the user grouping field
+        # if set, else the source feature, else the link alone
+        gene_of = {}
+        self.link_gene = []
+        self.gene_links = []
+        for link in self.optimizable_links:
+            key = link.group if link.group is not None else (link.feature_id if link.feature_id is not None else link.id)
+            if key not in gene_of:
+                gene_of[key] = len(self.gene_links)
+                self.gene_links.append([])
+            self.link_gene.append(gene_of[key])
+            self.gene_links[gene_of[key]].append(link)
+        self.num_genes = len(self.gene_links)
+
+    def __getstate__(self):
+        # Islands get the arrays only: no network objects, pool or cache
+        state = self.__dict__.copy()
+        for name in ('solver', 'network', 'optimizable_links', 'gene_links', '_executor',
+                     'progress_callback', 'is_canceled'):
+            state[name] = None
+        state['_cache'] = OrderedDict()
+        state['_states'] = {}
+        return state
 
     def optimize(self):
         """Runs the genetic algorithm to find the best diameter configuration."""
         if not self.optimizable_links:
             return
 
+        self.model = FitnessModel(self.solver, self.optimizable_links, self.link_gene)
+        self._cache.clear()
+        self._states = {}
+        self.cache_stats = {'hits': 0, 'misses': 0, 'delta': 0}
+        self.operator_stats = {op: [0, 0] for op in self._operators()}
+        if self.islands > 1:
+            best_solution = self._evolve_islands()
+        else:
+            self._start_workers()
+            try:
+                best_solution = self._evolve()
+            finally:
+                self._stop_workers()
+
+        # Apply best solution
+        if best_solution:
+            self._apply_solution(best_solution)
+            # Final calculation to ensure network state is consistent
+            self._recalculate_hydraulics()
+
+    def _evolve(self, seeds=None, migrate=None) -> List[int]:
+        """
+        Runs the generations. migrate (island mode) receives this population's best
+        (fitness, individual) pairs every migration_interval generations and returns
+        the ones coming from the previous island, which replace the worst.
+        """
+        t_start = time.perf_counter()
+        
         # 1. Initialize Population
-        population = self._initialize_population()
+        population = self._initialize_population(seeds)
         
         best_solution = None
         best_fitness = float('inf')
+        elites = [] # (fitness, individual) carried over, already scored
+        parents = None # genome keys of the two parents of every child, for delta evaluation
+        origins = None # (operator, first parent's fitness) of every child
+        
+        # No design can cost less than every link at the cheapest DN with no penalty
+        lower_bound = float(self.model.cost_table.min(axis=1).sum())
+        last_improvement = 0
+        stop_reason = 'generations'
+        gen = -1
+        report = None
         
         for gen in range(self.generations):
-            # Evaluate Fitness
-            fitness_scores = []
-            for individual in population:
-                fitness = self._evaluate_fitness(individual)
+            previous_best = best_fitness
+            # Evaluate Fitness (whole population at once, elites keep their score)
+            fitness_scores = list(elites)
+            children = population[len(elites):]
+            for i, (fitness, individual) in enumerate(zip(self._evaluate_population(children, parents), children)):
                 fitness_scores.append((fitness, individual))
+                if origins:
+                    operator, parent_fitness = origins[i]
+                    self.operator_stats[operator][0] += 1
+                    self.operator_stats[operator][1] += fitness < parent_fitness
                 
                 if fitness < best_fitness:
                     best_fitness = fitness
@@ -49,102 +212,368 @@ class GeneticOptimizer:
             # Sort by fitness (lower is better)
             fitness_scores.sort(key=lambda x: x[0])
             
+            # Migration: scores travel with the genomes (all islands share the model)
+            if migrate is not None and (gen + 1) % self.migration_interval == 0:
+                immigrants = migrate([(f, list(x)) for f, x in fitness_scores[:self.migration_size]])
+                immigrants = immigrants[:len(fitness_scores) - self.elitism_count]
+                if immigrants:
+                    fitness_scores[len(fitness_scores) - len(immigrants):] = immigrants
+                    fitness_scores.sort(key=lambda x: x[0])
+                    for fitness, individual in immigrants:
+                        self._cache[bytes(individual)] = fitness
+                        if fitness < best_fitness:
+                            best_fitness = fitness
+                            best_solution = individual
+            
+            # Stopping rules
+            if best_fitness < previous_best:
+                last_improvement = gen
+            if self.target_gap is not None and best_fitness <= lower_bound * (1.0 + self.target_gap):
+                stop_reason = 'gap'
+            elif gen - last_improvement >= self.stagnation_generations:
+                stop_reason = 'stagnation'
+            elif self.time_budget is not None and time.perf_counter() - t_start >= self.time_budget:
+                stop_reason = 'time'
+            elif self.is_canceled is not None and self.is_canceled():
+                stop_reason = 'canceled'
+            if self.progress_callback is not None:
+                if report is None or best_fitness < previous_best:
+                    report = self._report(best_solution)
+                self.progress_callback(gen + 1, self.generations, *report)
+            if stop_reason != 'generations' or gen == self.generations - 1:
+                break
+            
+            # Only this generation can be parents: drop older delta states
+            keys = {id(x[1]): bytes(x[1]) for x in fitness_scores}
+            scores = {id(x[1]): x[0] for x in fitness_scores}
+            self._states = {key: self._states[key] for key in keys.values() if key in self._states}
+            
             # Elitism
-            new_population = [x[1] for x in fitness_scores[:self.elitism_count]]
+            elites = fitness_scores[:self.elitism_count]
+            new_population = [x[1] for x in elites]
+            parents = []
+            origins = []
             
             # Selection & Reproduction
-            while len(new_population) < self.population_size:
+            offspring = []
+            while len(new_population) + len(offspring) < self.population_size:
                 parent1 = self._tournament_selection(fitness_scores)
                 parent2 = self._tournament_selection(fitness_scores)
                 
                 child = self._crossover(parent1, parent2)
-                child = self._mutate(child)
-                new_population.append(child)
+                offspring.append((self._choose_operator(), child, parent1))
+                parents.append((keys[id(parent1)], keys[id(parent2)]))
+            self._load_states([(parent, keys[id(parent)]) for operator, _, parent in offspring
+                               if operator in ('upsize', 'downsize')])
+            for operator, child, parent in offspring:
+                new_population.append(self._vary(operator, child, parent, keys[id(parent)]))
+                origins.append((operator, scores[id(parent)]))
                 
             population = new_population
             
             # Optional: Print progress
             # print(f"Gen {gen}: Best Fitness = {best_fitness}")
 
-        # Apply best solution
-        if best_solution:
-            self._apply_solution(best_solution)
-            # Final calculation to ensure network state is consistent
-            self._recalculate_hydraulics()
+        self.run_stats = {
+            'generations': gen + 1,
+            'elapsed': time.perf_counter() - t_start,
+            'stop_reason': stop_reason,
+            'best_fitness': best_fitness,
+            'lower_bound': lower_bound,
+        }
+        return best_solution
+
+    def _evolve_islands(self) -> List[int]:
+        """
+        Runs one _evolve per island process and returns the best individual found.
+        Mutation rates spread from half to twice mutation_rate across the islands.
+        Falls back to a single population if processes cannot be started.
+        """
+        t_start = time.perf_counter()
+        n = self.islands
+        seeds = self._seed_genomes() if self.warm_start else []
+        rates = self.mutation_rate * 2.0 ** np.linspace(-1.0, 1.0, n)
+        
+        context = multiprocessing.get_context()
+        inboxes = [context.Queue() for _ in range(n)]
+        results = context.Queue()
+        cancel = context.Event()
+        processes = []
+        try:
+            for i in range(n):
+                island = copy.copy(self)
+                island.islands = 1
+                island.workers = 1
+                island.mutation_rate = float(rates[i])
+                island.rng = random.Random(self.rng.getrandbits(64))
+                process = context.Process(
+                    target=_run_island,
+                    args=(island, seeds, inboxes[i], inboxes[(i + 1) % n], results, i, cancel),
+                    daemon=True,
+                )
+                process.start()
+                processes.append(process)
+        except (OSError, ValueError, NotImplementedError):
+            # No process support (e.g. restricted embedded interpreter)
+            for process in processes:
+                process.terminate()
+            return self._evolve(seeds)
+        
+        outcomes = {}
+        reports = {} # island -> latest (generation, generations, best_cost, deficit)
+        try:
+            while len(outcomes) < n:
+                if self.is_canceled is not None and self.is_canceled():
+                    cancel.set()
+                try:
+                    kind, index, payload = results.get(timeout=0.5)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        break
+                    continue
+                if kind == 'done':
+                    outcomes[index] = payload
+                elif self.progress_callback is not None:
+                    # Furthest generation, best design over all islands (feasibility first)
+                    reports[index] = payload
+                    best = min(reports.values(), key=lambda r: (r[3], r[2]))
+                    generation = max(r[0] for r in reports.values())
+                    self.progress_callback(generation, self.generations, best[2], best[3])
+        finally:
+            for process in processes:
+                process.join(timeout=1.0)
+                if process.is_alive():
+                    process.terminate()
+        if not outcomes:
+            raise RuntimeError("Nenhuma ilha do algoritmo genético terminou.")
+        
+        best = min(outcomes, key=lambda i: outcomes[i][1]['best_fitness'])
+        for _, _, cache_stats, operator_stats in outcomes.values():
+            for name, value in cache_stats.items():
+                self.cache_stats[name] += value
+            for name, (tries, wins) in operator_stats.items():
+                self.operator_stats[name][0] += tries
+                self.operator_stats[name][1] += wins
+        self.run_stats = dict(outcomes[best][1])
+        self.run_stats['elapsed'] = time.perf_counter() - t_start
+        self.run_stats['generations'] = max(o[1]['generations'] for o in outcomes.values())
+        self.run_stats['islands'] = [
+            {'mutation_rate': float(rates[i]), 'best_fitness': o[1]['best_fitness'],
+             'generations': o[1]['generations'], 'stop_reason': o[1]['stop_reason']}
+            for i, o in sorted(outcomes.items())
+        ]
+        return outcomes[best][0]
+
+    def _report(self, individual):
+        """(cost, worst pressure deficit in m) of a genome, for progress reports."""
+        cost, _, pressures = self.model.states([individual])
+        deficit = np.max(self.model.min_pressure - pressures, initial=0.0)
+        return float(cost[0]), float(deficit)
 
-    def _initialize_population(self) -> List[List[int]]:
-        """Creates random initial population."""
+    def _start_workers(self):
+        """Starts the process pool (large problems only), shipping the model once."""
+        self._executor = None
+        work = self.population_size * len(self.optimizable_links) # Scoring works per link
+        if self.workers <= 1 or work < self.parallel_min_work:
+            return
+        try:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.model,)
+            )
+        except (OSError, ValueError, NotImplementedError):
+            # No process support (e.g. restricted embedded interpreter): stay serial
+            self._executor = None
+
+    def _stop_workers(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _initialize_population(self, seeds=None) -> List[List[int]]:
+        """Creates the initial population: known designs and their mutants, then random genomes."""
         population = []
-        num_links = len(self.optimizable_links)
+        num_genes = self.num_genes
         num_options = len(VALID_DNS)
         
-        for _ in range(self.population_size):
+        if self.warm_start:
+            seeds = self._seed_genomes() if seeds is None else [list(seed) for seed in seeds]
+            warm = min(self.population_size, max(len(seeds), int(self.warm_start_fraction * self.population_size)))
+            population.extend(seeds[:warm])
+            while seeds and len(population) < warm:
+                population.append(self._mutate(list(seeds[len(population) % len(seeds)])))
+        
+        while len(population) < self.population_size:
             # Random gene: index of VALID_DNS
-            individual = [random.randint(0, num_options - 1) for _ in range(num_links)]
+            individual = [self.rng.randint(0, num_options - 1) for _ in range(num_genes)]
             population.append(individual)
             
         return population
 
-    def _evaluate_fitness(self, individual: List[int]) -> float:
-        """Calculates cost + penalty for an individual."""
-        # 1. Apply diameters
-        self._apply_solution(individual)
+    def _seed_genomes(self) -> List[List[int]]:
+        """Genomes of the current sizing, the greedy sizer and the stored previous solution."""
+        seeds = [self._genome_from(lambda link: link.diameter)]
+        seeds.append(self._greedy_genome())
+        if any(link.stored_diameter > 0 for link in self.optimizable_links):
+            seeds.append(self._genome_from(lambda link: link.stored_diameter or link.diameter))
         
-        # 2. Run Hydraulic Calculation
-        self._recalculate_hydraulics()
+        unique = []
+        for seed in seeds:
+            if seed not in unique:
+                unique.append(seed)
+        return unique
+
+    def _genome_from(self, diameter_of) -> List[int]:
+        """Maps diameters to genes: smallest VALID_DNS not below the largest DN of the gene's links."""
+        genome = []
+        for links in self.gene_links:
+            diameter = max(diameter_of(link) for link in links)
+            index = next((i for i, dn in enumerate(VALID_DNS) if dn >= diameter), len(VALID_DNS) - 1)
+            genome.append(index)
+        return genome
+
+    def _greedy_genome(self) -> List[int]:
+        """Runs the solver's greedy sizer from the current state, then restores that state."""
+        solver = self.solver
+        topo = solver.topology
+        saved = (topo.diameter.copy(), topo.head_loss.copy(), topo.velocity.copy(), topo.pressure.copy())
+        saved_stats = solver.sizing_stats
         
-        # 3. Calculate Cost
-        total_cost = 0.0
-        for link in self.optimizable_links:
-            dn = link.diameter
-            cost_per_m = PIPE_COSTS.get(dn, 1.0)
-            total_cost += link.length * cost_per_m
-            
-        # 4. Calculate Penalty (Pressure Violation)
-        penalty = 0.0
-        min_pressure_limit = self.solver.min_pressure
-        
-        # Check pressure at all relevant nodes (valves, emitters, junctions)
-        # We can iterate all nodes to be safe
-        for node in self.network.nodes.values():
-            # Only care about nodes that need pressure (emitters, valves)
-            # Or just ensure positive pressure everywhere?
-            # Let's enforce min_pressure at emitters/valves
-            if node.type in ['emitter', 'valve']:
-                if node.pressure < min_pressure_limit:
-                    diff = min_pressure_limit - node.pressure
-                    penalty += diff * diff * 1000 # Heavy quadratic penalty
-        
-        return total_cost + penalty
+        # A cancel stops the sizer too: its partial sizing is still a valid seed
+        solver.is_canceled = self.is_canceled
+        try:
+            solver._optimize_network()
+        finally:
+            solver.is_canceled = None
+        diameters = topo.diameter.copy()
+        
+        topo.diameter, topo.head_loss, topo.velocity, topo.pressure = saved
+        solver.sizing_stats = saved_stats
+        topo.store_links()
+        topo.store_pressures()
+        
+        index = topo.link_index
+        return self._genome_from(lambda link: diameters[index[link.id]])
+
+    def _evaluate_population(self, population: List[List[int]], parents=None) -> List[float]:
+        """
+        Calculates cost + penalty for every individual, scoring only unseen genomes.
+        parents: optional genome keys (bytes) of the two parents of each individual,
+        enabling delta evaluation.
+        """
+        cache = self._cache
+        scores = [None] * len(population)
+        pending = {} # genome key -> positions in population
+        for i, individual in enumerate(population):
+            key = bytes(individual)
+            if key in cache:
+                cache.move_to_end(key)
+                scores[i] = cache[key]
+                self.cache_stats['hits'] += 1
+            else:
+                pending.setdefault(key, []).append(i)
+        
+        if pending:
+            keys = list(pending)
+            self.cache_stats['misses'] += len(keys)
+            genomes = [population[p[0]] for p in pending.values()]
+            lineage = [parents[p[0]] for p in pending.values()] if parents else None
+            for key, fitness in zip(keys, self._score(genomes, lineage, keys)):
+                for i in pending[key]:
+                    scores[i] = fitness
+                self.cache_stats['hits'] += len(pending[key]) - 1 # Clones in the same batch
+                cache[key] = fitness
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return scores
+
+    def _score(self, population: List[List[int]], lineage=None, keys=None) -> List[float]:
+        """Cost + penalty with a few array operations (in the process pool if running)."""
+        if self.model is None:
+            # Flows are fixed during the search: tabulate once, reuse every generation
+            self.model = FitnessModel(self.solver, self.optimizable_links, self.link_gene)
+        if self._executor is None or len(population) < 2 * self.workers:
+            return self._score_serial(population, lineage, keys)
+        
+        # Contiguous chunks, one per worker; map keeps the order
+        size = -(-len(population) // self.workers)
+        chunks = [population[i:i + size] for i in range(0, len(population), size)]
+        scores = []
+        for chunk_scores in self._executor.map(_score_chunk, chunks):
+            scores.extend(chunk_scores)
+        return scores
+
+    def _score_serial(self, population: List[List[int]], lineage=None, keys=None) -> List[float]:
+        """
+        Scores in this process, keeping each genome's state for its children.
+        Genomes close to a scored parent use FitnessModel.delta; the rest go
+        through one batched full evaluation.
+        """
+        model = self.model
+        max_changes = max(4, self.delta_max_fraction * self.num_genes)
+        keys = keys or [bytes(individual) for individual in population]
+        scores = [None] * len(population)
+        full = []
+        for i, key in enumerate(keys):
+            child = np.frombuffer(key, dtype=np.uint8)
+            best = None
+            for parent_key in (lineage[i] if lineage else ()):
+                state = self._states.get(parent_key)
+                if state is None:
+                    continue
+                parent = np.frombuffer(parent_key, dtype=np.uint8)
+                changes = np.count_nonzero(parent != child)
+                if changes <= max_changes and (best is None or changes < best[0]):
+                    best = (changes, parent, state)
+            if best is None:
+                full.append(i)
+                continue
+            cost, penalty, pressures = model.delta(best[1], best[2], child)
+            self._states[key] = (cost, penalty, pressures)
+            scores[i] = float(cost + penalty)
+            self.cache_stats['delta'] += 1
+        
+        if full:
+            costs, penalties, pressures = model.states([population[i] for i in full])
+            for j, i in enumerate(full):
+                self._states[keys[i]] = (costs[j], penalties[j], pressures[j])
+                scores[i] = float(costs[j] + penalties[j])
+        return scores
+
+    def _evaluate_fitness(self, individual: List[int]) -> float:
+        """Calculates cost + penalty for an individual."""
+        return self._evaluate_population([individual])[0]
 
     def _apply_solution(self, individual: List[int]):
         """Applies the genotype (diameter indices) to the network links."""
-        for i, link in enumerate(self.optimizable_links):
-            dn_index = individual[i]
-            link.diameter = VALID_DNS[dn_index]
+        for i, links in enumerate(self.gene_links):
+            diameter = VALID_DNS[individual[i]]
+            for link in links:
+                link.diameter = diameter
 
     def _recalculate_hydraulics(self):
         """Triggers the solver to update head losses and pressures."""
         # We assume flow is already distributed (steady state flow)
         # So we only need to update head loss (depends on D) and Pressure (depends on HF)
         
-        for link in self.network.links.values():
-            self.solver._update_head_loss(link)
+        topology = self.solver.topology
+        topology.load_diameters()
+        self.solver._update_head_losses()
+        topology.store_links()
             
         self.solver._calculate_pressure()
 
     def _tournament_selection(self, fitness_scores, k=3):
         """Selects the best individual from k random samples."""
-        candidates = random.sample(fitness_scores, k)
+        candidates = self.rng.sample(fitness_scores, k)
         candidates.sort(key=lambda x: x[0])
         return candidates[0][1]
 
     def _crossover(self, parent1, parent2):
         """Single point crossover."""
         if len(parent1) < 2:
-            return parent1
+            return list(parent1) # Copy: _mutate works in place and parents may be elites
             
-        point = random.randint(1, len(parent1) - 1)
+        point = self.rng.randint(1, len(parent1) - 1)
         child = parent1[:point] + parent2[point:]
         return child
 
@@ -152,6 +581,119 @@ class GeneticOptimizer:
         """Randomly changes genes."""
         num_options = len(VALID_DNS)
         for i in range(len(individual)):
-            if random.random() < self.mutation_rate:
-                individual[i] = random.randint(0, num_options - 1)
+            if self.rng.random() < self.mutation_rate:
+                individual[i] = self.rng.randint(0, num_options - 1)
+        return individual
+
+    def _operators(self) -> List[str]:
+        return ['step', 'upsize', 'downsize'] if self.directed_mutation else ['uniform']
+
+    def _choose_operator(self) -> str:
+        """Picks a mutation operator, weighted by its smoothed success rate so far."""
+        operators = list(self.operator_stats) or self._operators()
+        if len(operators) == 1:
+            return operators[0]
+        weights = [max(self.operator_floor, (wins + 1) / (tries + 2))
+                   for tries, wins in (self.operator_stats[op] for op in operators)]
+        return self.rng.choices(operators, weights)[0]
+
+    def _load_states(self, parents):
+        """
+        Evaluates the states of (genome, key) parents scored in a worker or taken
+        from the cache, in one batch (same result for any worker count).
+        """
+        missing = {}
+        for parent, key in parents:
+            if key not in self._states:
+                missing.setdefault(key, parent)
+        if missing:
+            costs, penalties, pressures = self.model.states(list(missing.values()))
+            for j, key in enumerate(missing):
+                self._states[key] = (costs[j], penalties[j], pressures[j])
+
+    def _vary(self, operator, child, parent, parent_key):
+        """
+        Applies a mutation operator to child. The directed ones read the pressures
+        of parent (child is its crossover with another parent, mostly alike).
+        """
+        if operator == 'uniform':
+            return self._mutate(child)
+        if operator == 'step':
+            return self._step(child)
+        self._load_states([(parent, parent_key)])
+        pressures = self._states[parent_key][2]
+        if operator == 'upsize':
+            return self._upsize(child, pressures)
+        return self._downsize(child, pressures)
+
+    def _step(self, individual):
+        """Moves genes one DN up or down (at least one gene)."""
+        top = len(VALID_DNS) - 1
+        changed = False
+        for i in range(len(individual)):
+            if self.rng.random() < self.mutation_rate:
+                individual[i] = min(top, max(0, individual[i] + self.rng.choice((-1, 1))))
+                changed = True
+        if not changed and individual:
+            i = self.rng.randrange(len(individual))
+            individual[i] = min(top, max(0, individual[i] + self.rng.choice((-1, 1))))
+        return individual
+
+    def _upsize(self, individual, pressures):
+        """
+        One DN up for a gene on the path to the lowest-pressure node, picked with
+        weight = head loss saved per cost added. Parents without a pressure
+        violation get a downsize instead.
+        """
+        model = self.model
+        if len(pressures) == 0:
+            return self._step(individual)
+        if np.all(pressures >= model.min_pressure):
+            # Nothing to fix: trim where pressure is left over instead
+            return self._downsize(individual, pressures)
+        worst = int(np.argmin(pressures))
+        links = model.path.indices[model.path.indptr[worst]:model.path.indptr[worst + 1]]
+        genome = np.asarray(individual)
+        dn = genome[model.link_gene[links]]
+        links, dn = links[dn < len(VALID_DNS) - 1], dn[dn < len(VALID_DNS) - 1]
+        if len(links) == 0:
+            return self._step(individual)
+        gain = model.head_loss_table[links, dn] - model.head_loss_table[links, dn + 1]
+        extra = model.cost_table[links, dn + 1] - model.cost_table[links, dn]
+        genes = model.link_gene[links]
+        candidates = np.unique(genes)
+        weights = (np.bincount(genes, gain, model.num_genes)[candidates]
+                   / np.maximum(np.bincount(genes, extra, model.num_genes)[candidates], 1e-12))
+        gene = int(candidates[self.rng.choices(range(len(candidates)), weights.tolist())[0]]) if weights.sum() > 0 \
+            else int(self.rng.choice(candidates.tolist()))
+        individual[gene] += 1
+        return individual
+
+    def _downsize(self, individual, pressures):
+        """
+        One DN down for a gene whose extra head loss fits in the pressure slack
+        below its links, picked with weight = cost saved.
+        """
+        model = self.model
+        genome = np.asarray(individual)
+        dn = genome[model.link_gene]
+        links = np.flatnonzero(dn > 0)
+        if len(links) == 0:
+            return self._step(individual)
+        dn = dn[links]
+        genes = model.link_gene[links]
+        extra_loss = model.head_loss_table[links, dn - 1] - model.head_loss_table[links, dn]
+        saving = model.cost_table[links, dn] - model.cost_table[links, dn - 1]
+        slack = model.slack(pressures)[links]
+        # A gene fits if every link's slack covers the added loss of all the gene's links
+        total_loss = np.bincount(genes, extra_loss, model.num_genes)
+        tight = np.zeros(model.num_genes, dtype=bool)
+        tight[genes[slack < total_loss[genes]]] = True
+        candidates = np.setdiff1d(np.unique(genes), np.flatnonzero(tight))
+        if len(candidates) == 0:
+            return self._step(individual)
+        weights = np.bincount(genes, saving, model.num_genes)[candidates]
+        gene = int(candidates[self.rng.choices(range(len(candidates)), weights.tolist())[0]]) if weights.sum() > 0 \
+            else int(self.rng.choice(candidates.tolist()))
+        individual[gene] -= 1
         return individual
@@ -0,0 +1,164 @@
+import math
+from typing import Sequence
+
+
+class LazyMinSegmentTree:
+    """
+    Min segment tree over a fixed-size array with lazy range add.
+
+    Padding and unused slots hold +inf, so they never win a min query.
+    range_add, argmin and the threshold searches are O(log n); min is O(1).
+    """
+
+    def __init__(self, values: Sequence[float]):
+        n = max(1, len(values))
+        size = 1
+        while size < n:
+            size *= 2
+        self.n = len(values)
+        self.size = size
+        self.tree = [math.inf] * (2 * size)
+        self.lazy = [0.0] * size # Pending add for the whole subtree (internal nodes only)
+        self.tree[size:size + self.n] = [float(v) for v in values]
+        for i in range(size - 1, 0, -1):
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def _apply(self, i: int, delta: float):
+        self.tree[i] += delta
+        if i < self.size:
+            self.lazy[i] += delta
+
+    def _pull(self, i: int):
+        # Recompute the ancestors of slot i (their lazy add stays on them)
+        tree = self.tree
+        lazy = self.lazy
+        i >>= 1
+        while i >= 1:
+            a = tree[2 * i]
+            b = tree[2 * i + 1]
+            tree[i] = (a if a <= b else b) + lazy[i]
+            i >>= 1
+
+    def range_add(self, lo: int, hi: int, delta: float):
+        """Adds delta to every position in [lo, hi)."""
+        if lo >= hi or delta == 0.0:
+            return
+        lo += self.size
+        hi += self.size
+        l0, r0 = lo, hi - 1
+        while lo < hi:
+            if lo & 1:
+                self._apply(lo, delta)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                self._apply(hi, delta)
+            lo >>= 1
+            hi >>= 1
+        self._pull(l0)
+        if r0 != l0:
+            self._pull(r0)
+
+    def min(self) -> float:
+        return self.tree[1]
+
+    def argmin(self) -> int:
+        """Leftmost position holding the minimum (-1 if the tree is empty)."""
+        if self.n == 0:
+            return -1
+        tree = self.tree
+        i = 1
+        while i < self.size:
+            i = 2 * i if tree[2 * i] <= tree[2 * i + 1] else 2 * i + 1
+        return i - self.size
+
+    def get(self, pos: int) -> float:
+        """Current value at one position."""
+        i = pos + self.size
+        v = self.tree[i]
+        i >>= 1
+        while i >= 1:
+            v += self.lazy[i]
+            i >>= 1
+        return v
+
+    def find_first_below(self, threshold: float, lo: int = 0, hi: int = None) -> int:
+        """Leftmost position in [lo, hi) whose value is < threshold (-1 if none)."""
+        return self._find_below(threshold, lo, self.n if hi is None else hi, leftmost=True)
+
+    def find_last_below(self, threshold: float, lo: int = 0, hi: int = None) -> int:
+        """Rightmost position in [lo, hi) whose value is < threshold (-1 if none)."""
+        return self._find_below(threshold, lo, self.n if hi is None else hi, leftmost=False)
+
+    def _find_below(self, threshold, lo, hi, leftmost):
+        tree = self.tree
+        lazy = self.lazy
+        size = self.size
+        # Explicit stack of (slot, slot range, add from the ancestors); depth is O(log n)
+        stack = [(1, 0, size, 0.0)]
+        while stack:
+            i, nl, nr, acc = stack.pop()
+            if nr <= lo or hi <= nl or tree[i] + acc >= threshold:
+                continue
+            if i >= size:
+                return i - size
+            acc += lazy[i]
+            mid = (nl + nr) // 2
+            left = (2 * i, nl, mid, acc)
+            right = (2 * i + 1, mid, nr, acc)
+            # The child popped first is searched first
+            if leftmost:
+                stack.append(right)
+                stack.append(left)
+            else:
+                stack.append(left)
+                stack.append(right)
+        return -1
+
+    def values(self) -> list:
+        """Materializes the current value of every position."""
+        return [self.get(pos) for pos in range(self.n)]
+
+
+class MaxCoverTree:
+    """
+    Largest value assigned to any range covering a position.
+
+    assign_max(lo, hi, v) raises every position in [lo, hi) to at least v; get(pos)
+    reads one position. Both are O(log n) with no lazy propagation: an assignment
+    sits on the O(log n) slots spanning its range, a read takes the max of its slot's ancestors.
+    """
+
+    def __init__(self, n: int, fill: float = -1):
+        size = 1
+        while size < max(1, n):
+            size *= 2
+        self.size = size
+        self.tree = [fill] * (2 * size)
+
+    def assign_max(self, lo: int, hi: int, value):
+        tree = self.tree
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                if tree[lo] < value:
+                    tree[lo] = value
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if tree[hi] < value:
+                    tree[hi] = value
+            lo >>= 1
+            hi >>= 1
+
+    def get(self, pos: int):
+        tree = self.tree
+        i = pos + self.size
+        best = tree[i]
+        i >>= 1
+        while i >= 1:
+            if tree[i] > best:
+                best = tree[i]
+            i >>= 1
+        return best
@@ -0,0 +1,375 @@
+import math
+from typing import Dict, List
+from .network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from .hazen_williams import hazen_williams
+
+HW_EXPONENT = 1.852
+
+
+def christiansen_f(outlets: int, first_ratio: float = 1.0) -> float:
+    """
+    Christiansen F factor for a pipe with equally spaced outlets, with Scaloppi's
+    adjustment when the first outlet is at first_ratio * spacing from the inlet.
+    Head loss of the pipe = F * head loss of the full inlet flow over its length.
+    """
+    n = outlets
+    m = HW_EXPONENT
+    f = 1.0 / (m + 1) + 1.0 / (2 * n) + math.sqrt(m - 1) / (6 * n * n)
+    if n > 1 and first_ratio != 1.0:
+        f = (n * f + first_ratio - 1) / (n + first_ratio - 1)
+    return f
+
+
+class NetworkSkeleton:
+    """
+    Reduced copy of a HydraulicNetwork for the solver and the optimizers.
+
+    - Demand-less dead-end hose tails (past the last emitter) are set aside:
+      they carry no flow and only take the pressure of the node they hang from.
+    - Hoses ending in a chain of equally spaced emitters become 'hose' links,
+      one per flat run of emitters (within elevation_tolerance), each to the
+      run's last emitter, with an equivalent length (Christiansen F factor for
+      the last run) and the run's emitter count on that node.
+    - Series links of the same type, diameter and source feature joined by
+      demand-less junctions become one link.
+
+    reduce() builds the reduced network; after solving it, expand() writes
+    diameters, flows and pressures back to every element of the full network.
+    """
+
+    def __init__(self, network: HydraulicNetwork):
+        self.network = network
+        self.elevation_tolerance = 0.1 # m, max elevation range along a collapsed run of emitters
+        self.spacing_tolerance = 0.05 # relative spread of the emitter spacing
+        self.reduced = None
+        self.chains = {} # first link id -> chain (attach node, emitters, links from the attach node, runs)
+        self.tails = [] # (upstream node, link, downstream node) set aside, from the dead end inwards
+        self.series = {} # reduced link id -> (node ids, links) along the merged path
+        self.plain = {} # reduced link id -> full link
+
+    def reduce(self) -> HydraulicNetwork:
+        """Builds and returns the reduced network."""
+        self.tails = self._find_dead_tails()
+        tail_links = {link.id for _, link, _ in self.tails}
+        removed_nodes = {node.id for _, _, node in self.tails}
+
+        chains = self._find_emitter_chains(tail_links)
+        chain_links = set(tail_links)
+        for chain in chains:
+            chain_links.update(link.id for link in chain['links'])
+            run_ends = {chain['emitters'][hi - 1].id for _, hi in chain['runs']}
+            removed_nodes.update(node.id for node in chain['emitters'] if node.id not in run_ends)
+
+        paths = self._find_series_paths(chain_links)
+        series_links = set()
+        for nodes, links in paths:
+            series_links.update(link.id for link in links)
+            removed_nodes.update(node.id for node in nodes[1:-1])
+
+        reduced = HydraulicNetwork()
+        self.chains = {}
+        self.series = {}
+        self.plain = {}
+
+        for node in self.network.nodes.values():
+            if node.id not in removed_nodes:
+                reduced.add_node(self._copy_node(node))
+
+        for link in self.network.links.values():
+            if link.id in chain_links or link.id in series_links:
+                continue
+            if link.start_node is None or link.end_node is None:
+                continue
+            copy = HydraulicLink(link.id, None, link.type, length=link.length)
+            copy.diameter = link.diameter
+            copy.feature_id = link.feature_id
+            copy.group = link.group
+            copy.stored_diameter = link.stored_diameter
+            reduced.add_link(copy)
+            reduced.connect_link(copy.id, link.start_node.id, link.end_node.id)
+            self.plain[copy.id] = link
+
+        for nodes, links in paths:
+            merged = HydraulicLink(links[0].id, None, links[0].type, length=sum(link.length for link in links))
+            merged.diameter = links[0].diameter
+            merged.feature_id = links[0].feature_id
+            merged.group = links[0].group
+            merged.stored_diameter = links[0].stored_diameter
+            reduced.add_link(merged)
+            reduced.connect_link(merged.id, nodes[0].id, nodes[-1].id)
+            self.series[merged.id] = ([n.id for n in nodes], links)
+
+        for chain in chains:
+            attach, emitters, links = chain['attach'], chain['emitters'], chain['links']
+            for lo, hi in chain['runs']:
+                start = attach if lo == 0 else emitters[lo - 1]
+                equivalent = HydraulicLink(
+                    links[lo].id, None, 'hose', length=self._equivalent_length(links[lo:hi], len(emitters) - hi)
+                )
+                equivalent.diameter = links[lo].diameter
+                equivalent.feature_id = links[lo].feature_id
+                equivalent.group = links[lo].group
+                equivalent.stored_diameter = links[lo].stored_diameter
+                reduced.add_link(equivalent)
+                reduced.connect_link(equivalent.id, start.id, emitters[hi - 1].id)
+                reduced.nodes[emitters[hi - 1].id].emitter_count = hi - lo
+            self.chains[links[0].id] = chain
+
+        self.reduced = reduced
+        return reduced
+
+    def _copy_node(self, node: HydraulicNode) -> HydraulicNode:
+        copy = HydraulicNode(node.id, node.point, node.type)
+        copy.elevation = node.elevation
+        copy.base_demand = node.base_demand
+        copy.emitter_count = node.emitter_count
+        copy.pressure = node.pressure
+        return copy
+
+    def _find_dead_tails(self) -> List[tuple]:
+        """
+        Hose links leading only to demand-less junctions, peeled from the dead ends
+        inwards: (upstream node, link, downstream node) in peeling order.
+        """
+        def trimmable(node):
+            return node.type == 'junction' and node.base_demand == 0
+
+        live = {node.id: [link for link in node.connected_links if link.start_node is not None]
+                for node in self.network.nodes.values()}
+        stack = [node for node in self.network.nodes.values() if trimmable(node) and len(live[node.id]) == 1]
+        tails = []
+        while stack:
+            node = stack.pop()
+            if len(live[node.id]) != 1 or live[node.id][0].type != 'hose':
+                continue
+            link = live[node.id][0]
+            upstream = link.end_node if link.start_node is node else link.start_node
+            if upstream is node:
+                continue
+            tails.append((upstream, link, node))
+            live[node.id] = []
+            live[upstream.id] = [l for l in live[upstream.id] if l is not link]
+            if trimmable(upstream) and len(live[upstream.id]) == 1:
+                stack.append(upstream)
+        return tails
+
+    def _find_emitter_chains(self, excluded_links: set) -> List[dict]:
+        """
+        Dead-end hoses (ignoring excluded_links) whose emitters are uniform in
+        demand, spacing and diameter, split into flat runs by elevation.
+        """
+        def live(node):
+            return [link for link in node.connected_links if link.id not in excluded_links]
+
+        chains = []
+        for end in self.network.nodes.values():
+            if end.type != 'emitter' or len(live(end)) != 1:
+                continue
+
+            emitters = [end]
+            links = []
+            node = end
+            link = live(end)[0]
+            attach = None
+            while link.type == 'hose' and link.start_node is not None:
+                links.append(link)
+                nxt = link.end_node if link.start_node is node else link.start_node
+                nxt_links = live(nxt)
+                if nxt.type == 'emitter' and len(nxt_links) == 2:
+                    emitters.append(nxt)
+                    node = nxt
+                    link = nxt_links[0] if nxt_links[1] is link else nxt_links[1]
+                    continue
+                attach = nxt
+                break
+
+            # Isolated or too short to be worth collapsing
+            if attach is None or len(live(attach)) < 2 or len(emitters) < 2:
+                continue
+
+            # Order from the attach point downstream
+            emitters.reverse()
+            links.reverse()
+            if not self._is_uniform(emitters, links):
+                continue
+            runs = self._flat_runs(emitters)
+            if len(runs) < len(emitters):
+                chains.append({'attach': attach, 'emitters': emitters, 'links': links, 'runs': runs})
+        return chains
+
+    def _flat_runs(self, emitters: List[HydraulicNode]) -> List[tuple]:
+        """(lo, hi) index ranges of consecutive emitters within elevation_tolerance."""
+        runs = []
+        lo = 0
+        low = high = emitters[0].elevation
+        for i, emitter in enumerate(emitters[1:], 1):
+            low, high = min(low, emitter.elevation), max(high, emitter.elevation)
+            if high - low > self.elevation_tolerance:
+                runs.append((lo, i))
+                lo = i
+                low = high = emitter.elevation
+        runs.append((lo, len(emitters)))
+        return runs
+
+    def _equivalent_length(self, links: List[HydraulicLink], downstream: int) -> float:
+        """
+        Length of a plain pipe with the run's inlet flow and head loss. downstream:
+        emitters fed through the run. The last run of a hose uses the F factor,
+        the others the exact outlet sum (flow goes on past their last emitter).
+        """
+        n = len(links)
+        if downstream == 0 and n > 1:
+            spacing = sum(link.length for link in links[1:]) / (n - 1)
+            return christiansen_f(n, links[0].length / spacing) * sum(link.length for link in links)
+        inlet = n + downstream
+        return sum(link.length * ((inlet - j) / inlet) ** HW_EXPONENT for j, link in enumerate(links))
+
+    def _is_uniform(self, emitters: List[HydraulicNode], links: List[HydraulicLink]) -> bool:
+        if any(e.base_demand != emitters[0].base_demand or e.emitter_count != 1 for e in emitters):
+            return False
+        if any(link.diameter != links[0].diameter for link in links):
+            return False
+        spacings = [link.length for link in links[1:]]
+        mean = sum(spacings) / len(spacings)
+        if mean <= 0:
+            return False
+        return all(abs(s - mean) <= self.spacing_tolerance * mean for s in spacings)
+
+    def _find_series_paths(self, excluded_links: set) -> List[tuple]:
+        """Maximal paths through demand-less degree-2 junctions with matching links (same feature)."""
+        def is_interior(node):
+            if node.type != 'junction' or node.base_demand != 0 or len(node.connected_links) != 2:
+                return False
+            a, b = node.connected_links
+            return (a is not b and a.id not in excluded_links and b.id not in excluded_links
+                    and a.type == b.type and a.diameter == b.diameter
+                    and a.feature_id == b.feature_id and a.group == b.group)
+
+        def other(link, node):
+            return link.end_node if link.start_node is node else link.start_node
+
+        def walk(node, link):
+            # From node along link until a non-interior node; returns (nodes, links)
+            nodes, links = [], []
+            while True:
+                links.append(link)
+                node = other(link, node)
+                nodes.append(node)
+                if not is_interior(node) or node is start:
+                    return nodes, links
+                a, b = node.connected_links
+                link = b if a is link else a
+
+        paths = []
+        done = set()
+        for start in self.network.nodes.values():
+            if start.id in done or not is_interior(start):
+                continue
+            a, b = start.connected_links
+            fwd_nodes, fwd_links = walk(start, a)
+            if fwd_nodes[-1] is start:
+                # Closed ring of junctions, nothing to anchor the merged link to
+                done.update(n.id for n in fwd_nodes)
+                continue
+            back_nodes, back_links = walk(start, b)
+            nodes = list(reversed(back_nodes)) + [start] + fwd_nodes
+            links = list(reversed(back_links)) + fwd_links
+            done.update(n.id for n in nodes[1:-1])
+            if nodes[0] is not nodes[-1]:
+                paths.append((nodes, links))
+        return paths
+
+    def expand(self, solver):
+        """
+        Maps the reduced results back to the full network: diameters, flows, head
+        losses, velocities, link directions and pressures. Hose internals are
+        recomputed emitter by emitter from the attach pressure, using the solver's
+        emitter_flow and max_system_flow (simultaneity cap).
+        """
+        reduced = self.reduced
+        full = self.network
+        cap = getattr(solver, 'max_system_flow', float('inf'))
+
+        for node_id, node in reduced.nodes.items():
+            full.nodes[node_id].pressure = node.pressure
+
+        for link_id, link in self.plain.items():
+            r = reduced.links[link_id]
+            self._copy_result(r, link)
+            link.start_node = full.nodes[r.start_node.id]
+            link.end_node = full.nodes[r.end_node.id]
+
+        for link_id, (node_ids, links) in self.series.items():
+            r = reduced.links[link_id]
+            if r.start_node.id != node_ids[0]:
+                node_ids = list(reversed(node_ids))
+                links = list(reversed(links))
+            total = sum(link.length for link in links) or 1.0
+            head = full.nodes[node_ids[0]].pressure + full.nodes[node_ids[0]].elevation
+            for i, link in enumerate(links):
+                self._copy_result(r, link)
+                link.head_loss = r.head_loss * link.length / total
+                link.start_node = full.nodes[node_ids[i]]
+                link.end_node = full.nodes[node_ids[i + 1]]
+                head -= link.head_loss
+                if i < len(links) - 1:
+                    link.end_node.pressure = head - link.end_node.elevation
+
+        for chain in self.chains.values():
+            attach, emitters, links = chain['attach'], chain['emitters'], chain['links']
+            n = len(emitters)
+            q = emitters[0].base_demand if emitters[0].base_demand > 0 else solver.emitter_flow
+            flows = [min((n - i) * q, cap) for i in range(n)]
+            lengths = [link.length for link in links]
+            diameters = [0.0] * n
+            for lo, hi in chain['runs']:
+                diameters[lo:hi] = [reduced.links[links[lo].id].diameter] * (hi - lo)
+            head_losses, velocities = hazen_williams(flows, diameters, lengths)
+
+            upstream = attach
+            head = attach.pressure + attach.elevation
+            for i, link in enumerate(links):
+                link.diameter = diameters[i]
+                link.flow = flows[i]
+                link.head_loss = float(head_losses[i])
+                link.velocity = float(velocities[i])
+                link.start_node = upstream
+                link.end_node = emitters[i]
+                head -= link.head_loss
+                emitters[i].pressure = head - emitters[i].elevation
+                upstream = emitters[i]
+
+        # Dead tails: no flow, static pressure of the node they hang from
+        for upstream, link, node in reversed(self.tails):
+            link.flow = link.head_loss = link.velocity = 0.0
+            link.start_node = upstream
+            link.end_node = node
+            node.pressure = upstream.pressure + upstream.elevation - node.elevation
+
+        self._refresh_direction()
+
+    def _copy_result(self, source: HydraulicLink, target: HydraulicLink):
+        target.diameter = source.diameter
+        target.flow = source.flow
+        target.head_loss = source.head_loss
+        target.velocity = source.velocity
+
+    def _refresh_direction(self):
+        # Keep upstream/downstream lists consistent with the new link directions
+        for node in self.network.nodes.values():
+            node.upstream_link = None
+            node.downstream_links = []
+        for link in self.network.links.values():
+            if link.start_node is None or link.flow <= 0:
+                continue
+            link.start_node.downstream_links.append(link)
+            link.end_node.upstream_link = link
+
+    def stats(self) -> Dict[str, int]:
+        """Node and link counts before and after the reduction."""
+        return {
+            'nodes': len(self.network.nodes),
+            'links': len(self.network.links),
+            'reduced_nodes': len(self.reduced.nodes) if self.reduced else 0,
+            'reduced_links': len(self.reduced.links) if self.reduced else 0,
+        }
@@ -1,6 +1,12 @@
 import math
-from .network import HydraulicNetwork, HydraulicLink, HydraulicNode
-from .constants import DEFAULT_HAZEN_C, VALID_DNS
+import heapq
+import time
+import numpy as np
+from .network import HydraulicNetwork
+from .topology import NetworkTopology
+from .segment_tree import LazyMinSegmentTree, MaxCoverTree
+from .hazen_williams import hazen_williams
+from .constants import VALID_DNS, PIPE_COSTS
 
 class HydraulicSolver:
     def __init__(self, network: HydraulicNetwork):
@@ -9,6 +15,9 @@ class HydraulicSolver:
         self.min_pressure = 10.0 # mca
         self.emitter_flow = 60.0 # l/h (default)
         self.simultaneous_sectors = 1
+        self.topology = None # NetworkTopology, built by _establish_direction
+        self.sizing_stats = {} # iterations / elapsed / feasible of the last _optimize_network
+        self.is_canceled = None # callable; True stops _optimize_network with the sizing so far
 
     def solve(self):
         """Executes the hydraulic calculation."""
@@ -36,202 +45,407 @@ class HydraulicSolver:
         self._optimize_network()
 
     def _establish_direction(self):
-        # Reset visited
-        for node in self.network.nodes.values():
-            node.visited = False
-            node.upstream_link = None
-            node.downstream_links = []
-            
-        queue = []
+        # Build the array view once and run the BFS on it
+        self.topology = NetworkTopology(self.network)
+        topo = self.topology
+        
+        roots = []
         for source in self.network.sources:
-            source.visited = True
             source.pressure = 30.0 # Initial pressure guess or fixed
-            queue.append(source)
+            idx = topo.node_index[source.id]
+            topo.pressure[idx] = source.pressure
+            roots.append(idx)
             
-        while queue:
-            u = queue.pop(0)
-            
-            for link in u.connected_links:
-                # Find the other node
-                v = link.end_node if link.start_node == u else link.start_node
-                
-                if not v.visited:
-                    v.visited = True
-                    # Set direction u -> v
-                    link.start_node = u
-                    link.end_node = v
-                    
-                    u.downstream_links.append(link)
-                    v.upstream_link = link
-                    
-                    queue.append(v)
+        topo.orient(roots)
+        
+        # Keep the object graph consistent for callers that still walk it
+        topo.store_direction()
 
     def _accumulate_flow(self):
-        # We need to process nodes from leaves to root (reverse BFS order or recursion)
-        for source in self.network.sources:
-            self._get_node_flow(source)
-
-    def _get_node_flow(self, node: HydraulicNode) -> float:
-        # Calculate Potential Flow (Sum of all downstream demands)
-        potential_flow = node.base_demand
+        # Leaves to root: reverse BFS order, one pass over the arrays
+        topo = self.topology
         
+        link_flow, _ = topo.accumulate_flow(self._node_demands(), self.max_system_flow)
+        tree_links = topo.tree_links()
+        topo.flow[tree_links] = link_flow[tree_links]
+        topo.store_links(tree_links.tolist())
+
+    def _node_demands(self) -> np.ndarray:
+        """Demand of every node (m3/h) as the solver sees it."""
+        topo = self.topology
         # Fallback to default emitter flow if demand is missing
-        if node.type == 'emitter' and potential_flow <= 0:
-            potential_flow = self.emitter_flow
-        
-        for link in node.downstream_links:
-            child = link.end_node
-            child_potential = self._get_node_flow(child)
-            
-            # Apply Cap
-            design_flow = min(child_potential, self.max_system_flow)
-            
-            link.flow = design_flow
-            potential_flow += design_flow 
-            
-        return potential_flow
+        demand = topo.base_demand.copy()
+        demand[topo.is_emitter & (demand <= 0)] = self.emitter_flow
+        # Collapsed hoses (see NetworkSkeleton) stand for several emitters
+        return demand * topo.emitter_count
 
-    def _initial_sizing(self):
-        for link in self.network.links.values():
-            if link.flow <= 0:
-                continue
-                
-            # Select Diameter
-            # Q = V * A -> A = Q / V
-            # Q in m3/h -> /3600 -> m3/s
-            q_si = link.flow / 3600.0
-            
-            # Target Area
-            target_area = q_si / self.max_velocity
-            target_diameter_m = math.sqrt(target_area * 4 / math.pi)
-            target_diameter_mm = target_diameter_m * 1000.0
+    def _initial_sizing(self, only_missing: bool = False):
+        topo = self.topology
+        candidates = topo.flow > 0
+        if only_missing:
+            candidates &= topo.diameter <= 0
+        sized = np.flatnonzero(candidates)
+        if sized.size == 0:
+            return
             
-            # Select nearest standard DN
-            # For hoses (16mm or 20mm)
-            if link.type == 'hose':
-                if target_diameter_mm <= 16:
-                    link.diameter = 16.0
-                else:
-                    link.diameter = 20.0
-            else:
-                # For pipes, find smallest valid DN that satisfies velocity
-                selected_dn = VALID_DNS[-1]
-                for dn in VALID_DNS:
-                    if dn >= target_diameter_mm:
-                        selected_dn = dn
-                        break
-                link.diameter = selected_dn
-            
-            self._update_head_loss(link)
+        # Select Diameter
+        # Q = V * A -> A = Q / V
+        # Q in m3/h -> /3600 -> m3/s
+        q_si = topo.flow[sized] / 3600.0
+        
+        # Target Area
+        target_area = q_si / self.max_velocity
+        target_diameter_mm = np.sqrt(target_area * 4 / math.pi) * 1000.0
+        
+        # For pipes, smallest valid DN that satisfies velocity (largest DN if none does)
+        dns = np.asarray(VALID_DNS)
+        pick = np.minimum(np.searchsorted(dns, target_diameter_mm, side='left'), len(dns) - 1)
+        diameters = dns[pick]
+        
+        # For hoses (16mm or 20mm)
+        hoses = topo.is_hose[sized]
+        diameters[hoses] = np.where(target_diameter_mm[hoses] <= 16, 16.0, 20.0)
+        
+        topo.diameter[sized] = diameters
+        self._update_head_losses(sized)
+        topo.store_links(sized.tolist())
 
-    def _update_head_loss(self, link: HydraulicLink):
-        q_si = link.flow / 3600.0
-        d_m = link.diameter / 1000.0
-        c = DEFAULT_HAZEN_C
-        
-        # Hazen-Williams
-        if q_si > 0 and d_m > 0:
-            hf = 10.67 * link.length * (q_si ** 1.852) / ((c ** 1.852) * (d_m ** 4.87))
-            link.head_loss = hf
-            
-            area = math.pi * (d_m ** 2) / 4
-            link.velocity = q_si / area
-        else:
-            link.head_loss = 0.0
-            link.velocity = 0.0
+    def _update_head_losses(self, indices=None):
+        """Updates head loss and velocity of the given link indices (all if None) in the arrays."""
+        topo = self.topology
+        if indices is None:
+            indices = slice(None)
+        head_loss, velocity = hazen_williams(topo.flow[indices], topo.diameter[indices], topo.length[indices])
+        topo.head_loss[indices] = head_loss
+        topo.velocity[indices] = velocity
 
     def _calculate_pressure(self):
-        # Top-Down BFS
-        queue = []
-        for source in self.network.sources:
-            queue.append(source)
-            
-        while queue:
-            u = queue.pop(0)
+        # Top-Down sweep in BFS order
+        topo = self.topology
+        pressure = topo.pressure.tolist()
+        elevation = topo.elevation.tolist()
+        head_loss = topo.head_loss.tolist()
+        parent_link = topo.parent_link.tolist()
+        parent_node = topo.parent_node.tolist()
+        
+        for v in topo.order.tolist():
+            l = parent_link[v]
+            if l < 0:
+                continue
+            u = parent_node[v]
+            # Bernoulli (simplified): P_v = P_u - HF + (Z_u - Z_v)
+            pressure[v] = pressure[u] - head_loss[l] + (elevation[u] - elevation[v])
             
-            for link in u.downstream_links:
-                v = link.end_node
-                # Bernoulli (simplified): P_v = P_u - HF + (Z_u - Z_v)
-                delta_z = u.elevation - v.elevation
-                v.pressure = u.pressure - link.head_loss + delta_z
-                queue.append(v)
+        topo.pressure = np.array(pressure, dtype=float)
+        topo.store_pressures()
+
+    def _next_dn(self, l: int):
+        """Next diameter up for link l, or None if it cannot be upgraded."""
+        topo = self.topology
+        current_dn = topo.diameter[l]
+        if topo.is_hose[l]:
+            return 20.0 if current_dn < 20.0 else None
+        for dn in VALID_DNS:
+            if dn > current_dn:
+                return dn
+        return None
+
+    def _unit_cost(self, dn: float) -> float:
+        # PIPE_COSTS covers the pipe DNs; hoses (16/20) follow the same ~D^1.5 trend
+        if dn in PIPE_COSTS:
+            return PIPE_COSTS[dn]
+        return PIPE_COSTS[VALID_DNS[0]] * (dn / VALID_DNS[0]) ** 1.5
+
+    def _upgrade_ratio(self, l: int):
+        """Head-loss reduction per unit of extra cost for upgrading link l one step (None if not possible)."""
+        new_dn = self._next_dn(l)
+        if new_dn is None:
+            return None
+        topo = self.topology
+        new_hf, _ = hazen_williams(topo.flow[l], new_dn, topo.length[l])
+        reduction = topo.head_loss[l] - float(new_hf)
+        extra_cost = topo.length[l] * (self._unit_cost(new_dn) - self._unit_cost(topo.diameter[l]))
+        ratio = reduction / max(extra_cost, 1e-9)
+        if topo.is_hose[l]:
+            ratio *= 0.1 # Penalty to avoid resizing hoses unless necessary
+        return ratio
+
+    def _lca(self, a: int, b: int) -> int:
+        """Lowest common ancestor of two tree nodes (-1 if they hang from different sources)."""
+        topo = self.topology
+        tin_b = topo.tin[b]
+        while a >= 0 and not (topo.tin[a] <= tin_b < topo.tout[a]):
+            a = topo.parent_node[a]
+        return int(a)
+
+    def _set_aside_blocked(self, tree, node: int, swept, branches):
+        """
+        Sets aside (+inf in tree) node and every node below it reached through links
+        that cannot be upgraded. Needs nothing upgradable between the source and node:
+        then their pressures are final. Each run of consecutive preorder positions
+        (a whole blocked subtree is one) takes a single range update. The subtrees
+        below the upgradable links met on the way are recorded in branches.
+        """
+        topo = self.topology
+        tin = topo.tin
+        runs = []
+        stack = [node]
+        while stack:
+            v = stack.pop()
+            swept[v] = True
+            if runs and runs[-1][1] == tin[v]:
+                runs[-1][1] += 1
+            else:
+                runs.append([tin[v], tin[v] + 1])
+            # Children pushed in reverse: popped in preorder, so runs stay sorted
+            for l in topo.downstream_links(v).tolist()[::-1]:
+                child = int(topo.link_end[l])
+                if self._next_dn(l) is None:
+                    stack.append(child)
+                else:
+                    branches.assign_max(tin[child], topo.tout[child], tin[child])
+        for lo, hi in runs:
+            tree.range_add(lo, hi, math.inf)
+
+    def _push_path(self, heap: list, node: int, stop: int):
+        """Queues the upgradable links on the path from node up to stop (or the source)."""
+        topo = self.topology
+        while node != stop and topo.parent_link[node] >= 0:
+            l = int(topo.parent_link[node])
+            ratio = self._upgrade_ratio(l)
+            if ratio is not None:
+                heapq.heappush(heap, (-ratio, l))
+            node = int(topo.parent_node[node])
 
     def _optimize_network(self):
-        """Iteratively increases pipe diameters to satisfy min pressure."""
-        max_iterations = 50
+        """
+        Upgrades pipe diameters until every valve/emitter reaches min_pressure or no
+        upgrade remains. Candidates are the links shared by all violating nodes (the path
+        from the source to their lowest common ancestor), taken from a priority queue by
+        head-loss reduction per unit of extra PIPE_COSTS cost.
+        """
+        t_start = time.perf_counter()
+        topo = self.topology
+        preorder = topo.preorder.tolist()
+        tin = topo.tin
+        tout = topo.tout
+        min_pressure = self.min_pressure
         
-        for i in range(max_iterations):
-            # Find critical node (lowest pressure)
-            min_p = float('inf')
-            critical_node = None
-            
-            for node in self.network.nodes.values():
-                if node.type in ['valve', 'emitter'] and node.pressure < min_p:
-                    min_p = node.pressure
-                    critical_node = node
-            
-            if min_p >= self.min_pressure:
-                break # All good
-                
-            if not critical_node:
+        # Pressures of the constrained nodes (valves, emitters) in DFS preorder, so the
+        # subtree below any link is one contiguous range. Other nodes hold +inf.
+        constrained = topo.is_constrained[topo.preorder]
+        tree = LazyMinSegmentTree(np.where(constrained, topo.pressure[topo.preorder], np.inf))
+        
+        # Source of every preorder position: each source's tree is one range starting at it
+        is_source = topo.parent_node[topo.preorder] < 0
+        source_at = topo.preorder[np.maximum.accumulate(np.where(is_source, np.arange(len(is_source)), 0))].tolist()
+        
+        iterations = 0
+        passes = 0
+        swept = np.zeros(topo.num_nodes, dtype=bool) # Nodes set aside by _set_aside_blocked
+        # Branches hanging from swept nodes through upgradable links (preorder start of
+        # each, over its range): the deepest one covering a violator is where it is served
+        branches = MaxCoverTree(len(preorder))
+        scope = -1      # Subtree whose violators are being served
+        anchor = -1     # LCA of those violators; the queue holds the upgradable links above it
+        extremes = None # (first, last) violator positions that gave the anchor
+        heap = []
+        
+        canceled = False
+        while tree.min() < min_pressure:
+            passes += 1
+            if self.is_canceled is not None and passes % 64 == 0 and self.is_canceled():
+                canceled = True
                 break
+            first = tree.find_first_below(min_pressure, tin[scope], tout[scope]) if scope >= 0 else -1
+            if first < 0:
+                # Serve the violators fed by the same source as the critical node
+                scope = source_at[tree.argmin()]
+                anchor, extremes, heap = -1, None, []
+                first = tree.find_first_below(min_pressure, tin[scope], tout[scope])
                 
-            # Backtrack to find path from source
-            path_links = []
-            curr = critical_node
-            while curr.upstream_link:
-                path_links.append(curr.upstream_link)
-                curr = curr.upstream_link.start_node
+            lo, hi = tin[scope], tout[scope]
+            last = tree.find_last_below(min_pressure, lo, hi)
+            if (first, last) != extremes:
+                # Upgrades only raise pressures, so the violator set only shrinks and the
+                # new anchor lies below the old one: queue just the links in between
+                extremes = (first, last)
+                new_anchor = self._lca(preorder[first], preorder[last])
+                self._push_path(heap, new_anchor, anchor)
+                anchor = new_anchor
                 
-            # Find best candidate to upgrade
-            # Candidate: Pipe (not hose?) with highest Unit Head Loss
-            # We usually don't resize hoses in main line optimization, but we can if needed.
-            # Let's prioritize Main and Derivation lines.
-            
-            best_link = None
-            max_unit_hf = -1.0
-            
-            for link in path_links:
-                # Skip if already max DN
-                if link.diameter >= VALID_DNS[-1]:
+            if not heap:
+                # Nothing left to upgrade between the source and the anchor
+                extremes = None
+                if not swept[anchor]:
+                    # The anchor and what hangs from it through links at their largest
+                    # DN keep their pressure whatever is upgraded: set them aside at once
+                    self._set_aside_blocked(tree, anchor, swept, branches)
                     continue
                     
-                # Calculate unit HF
-                unit_hf = link.head_loss / link.length if link.length > 0 else 0
+                # The violators left hang below the swept region: serve the branch
+                # holding the worst one, down to where its links can be upgraded again
+                target = preorder[tree.argmin()]
+                if not (lo <= tin[target] < hi):
+                    target = preorder[first]
+                scope = preorder[branches.get(tin[target])]
+                anchor = int(topo.parent_node[scope])
+                continue
                 
-                # Prioritize pipes over hoses?
-                if link.type == 'hose':
-                    unit_hf *= 0.1 # Penalty to avoid resizing hoses unless necessary
-                    
-                if unit_hf > max_unit_hf:
-                    max_unit_hf = unit_hf
-                    best_link = link
+            _, best_link = heapq.heappop(heap)
+            new_dn = self._next_dn(best_link)
             
-            if best_link:
-                # Upgrade
-                current_dn = best_link.diameter
-                new_dn = current_dn
+            old_hf = topo.head_loss[best_link]
+            topo.diameter[best_link] = new_dn
+            self._update_head_losses([best_link])
+            topo.store_links([best_link])
+            iterations += 1
+            
+            # Everything below the link gains the same pressure
+            v = topo.link_end[best_link]
+            tree.range_add(tin[v], tout[v], old_hf - topo.head_loss[best_link])
+            
+            # Only the upgraded link changes rank
+            ratio = self._upgrade_ratio(best_link)
+            if ratio is not None:
+                heapq.heappush(heap, (-ratio, best_link))
                 
-                if best_link.type == 'hose':
-                    if current_dn < 20.0: new_dn = 20.0
-                else:
-                    for dn in VALID_DNS:
-                        if dn > current_dn:
-                            new_dn = dn
-                            break
-                            
-                if new_dn > current_dn:
-                    best_link.diameter = new_dn
-                    self._update_head_loss(best_link)
-                    self._calculate_pressure() # Recalculate all pressures
-                else:
-                    break # Cannot upgrade further
-            else:
-                break # No candidates
+        if iterations:
+            self._calculate_pressure() # One full sweep for the final pressures
+            
+        # Violators left are the ones set aside: no upgrade remains on their path
+        unfixable = int(np.count_nonzero(topo.is_constrained & (topo.tin >= 0) & (topo.pressure < min_pressure)))
+        self.sizing_stats = {
+            'iterations': iterations,
+            'elapsed': time.perf_counter() - t_start,
+            'feasible': unfixable == 0,
+            'unfixable': unfixable,
+            'canceled': canceled,
+        }
+
+    def shift_demands(self, shifts) -> np.ndarray:
+        """
+        Builds the demand matrix for irrigation shifts. Each shift is a list of node
+        ids (usually valves) that run together; a shift draws the demand of every
+        node downstream of them. Returns an array (shifts x nodes).
+        Call after _establish_direction (solve_scenarios does it).
+        """
+        topo = self.topology
+        demand = self._node_demands()
+        
+        matrix = np.zeros((len(shifts), topo.num_nodes))
+        for s, node_ids in enumerate(shifts):
+            active = np.zeros(len(topo.preorder), dtype=bool)
+            for node_id in node_ids:
+                v = topo.node_index[node_id]
+                if topo.tin[v] >= 0:
+                    active[topo.tin[v]:topo.tout[v]] = True
+            members = topo.preorder[active]
+            matrix[s, members] = demand[members]
+        return matrix
+
+    def solve_scenarios(self, demands=None, shifts=None) -> dict:
+        """
+        Solves several demand scenarios at once on the current diameters.
+        
+        demands: array (scenarios x nodes, in network.nodes order), or
+        shifts: lists of node ids operating together (see shift_demands).
+        
+        Flows come from one sparse path-incidence product (P.T @ D), so each
+        scenario carries exactly its own demand (no simultaneity cap). Pipes
+        without a diameter are sized by velocity for the largest scenario flow.
+        The worst case (max flow, min pressure) is written back to the network.
+        """
+        self._establish_direction()
+        topo = self.topology
+        if demands is None:
+            demands = self.shift_demands(shifts or [])
+        demands = np.atleast_2d(np.asarray(demands, dtype=float))
+        
+        P = topo.path_matrix()
+        flows = np.asarray(P.T @ demands.T) # links x scenarios
+        max_flow = flows.max(axis=1) if flows.shape[1] else np.zeros(topo.num_links)
+        
+        # Worst-case velocity sizing where no diameter was given
+        topo.flow = max_flow
+        self._initial_sizing(only_missing=True)
+        
+        head_loss, velocity = hazen_williams(flows, topo.diameter[:, None], topo.length[:, None])
+        
+        # P_v = P_root + (Z_root - Z_v) - sum of losses on the path
+        root = topo.root_of()
+        in_tree = root >= 0
+        static = np.full(topo.num_nodes, np.nan)
+        static[in_tree] = topo.pressure[root[in_tree]] + topo.elevation[root[in_tree]] - topo.elevation[in_tree]
+        pressures = static[:, None] - np.asarray(P @ head_loss) # nodes x scenarios
+        
+        if flows.shape[1]:
+            critical = np.argmin(np.where(np.isnan(pressures), np.inf, pressures), axis=1)
+            min_pressure = pressures[np.arange(topo.num_nodes), critical]
+            worst = np.argmax(flows, axis=1)
+            rows = np.arange(topo.num_links)
+            topo.head_loss = head_loss[rows, worst]
+            topo.velocity = velocity[rows, worst]
+        else:
+            critical = np.zeros(topo.num_nodes, dtype=np.int64)
+            min_pressure = static
+        
+        topo.store_links()
+        topo.pressure = np.where(in_tree, min_pressure, topo.pressure)
+        topo.store_pressures()
+        
+        return {
+            'flows': flows,
+            'pressures': pressures,
+            'velocities': velocity,
+            'max_flow': max_flow,
+            'max_velocity': topo.velocity.copy(),
+            'min_pressure': min_pressure,
+            'critical_scenario': critical,
+        }
 
-    def solve_generative(self):
-        """Executes the hydraulic calculation using Genetic Algorithm optimization."""
-        from .optimizer import GeneticOptimizer
+    def solve_looped(self):
+        """
+        Solves networks with loops (ring mains, interconnected derivations) with the
+        global gradient method. Existing diameters are kept; pipes without one get the
+        velocity-based size from a spanning-tree pass, and loop-closing pipes (which
+        carry no flow in that tree) take the larger DN of the pipes they join.
+        Every node demand is applied at once (no simultaneity cap).
+        Returns the GradientSolver used, with its iteration count and convergence flag.
+        """
+        from .looped_solver import GradientSolver
+        
+        self._establish_direction()
+        self.max_system_flow = float('inf')
+        self._accumulate_flow()
+        self._initial_sizing(only_missing=True)
+        
+        topo = self.topology
+        for l in np.flatnonzero(topo.diameter <= 0).tolist():
+            if topo.link_start[l] < 0:
+                continue
+            neighbours = []
+            for node_idx in (topo.link_start[l], topo.link_end[l]):
+                up = topo.parent_link[node_idx]
+                if up >= 0 and up != l:
+                    neighbours.append(topo.diameter[up])
+            if neighbours:
+                topo.diameter[l] = max(neighbours)
+        topo.store_links()
+        
+        engine = GradientSolver(self.network, emitter_flow=self.emitter_flow)
+        engine.solve()
+        return engine
+
+    def solve_generative(self, workers: int = 1, seed=None, method: str = 'genetic', islands: int = 1,
+                         progress_callback=None, is_canceled=None):
+        """
+        Executes the hydraulic calculation using Genetic Algorithm optimization.
+        workers > 1 scores large populations in a process pool; seed makes runs repeatable.
+        islands > 1 evolves that many populations in parallel processes with migration.
+        progress_callback / is_canceled: see GeneticOptimizer (ignored by the DP method).
+        method='dp' uses the exact tree optimizer (TreeDPOptimizer) instead of the GA.
+        """
 
         # 1. Establish Flow Direction (BFS from Source)
         self._establish_direction()
@@ -253,6 +467,14 @@ class HydraulicSolver:
         # 4. Calculate Pressure (Top-Down)
         self._calculate_pressure()
         
-        # 5. Optimize Network (Genetic Algorithm)
-        optimizer = GeneticOptimizer(self)
+        # 5. Optimize Network (Genetic Algorithm or exact DP)
+        if method == 'dp':
+            from .dp_optimizer import TreeDPOptimizer
+            optimizer = TreeDPOptimizer(self)
+        else:
+            from .optimizer import GeneticOptimizer
+            optimizer = GeneticOptimizer(self, workers=workers, seed=seed, islands=islands)
+            optimizer.progress_callback = progress_callback
+            optimizer.is_canceled = is_canceled
         optimizer.optimize()
+        return optimizer
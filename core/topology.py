@@ -0,0 +1,289 @@
+from collections import deque
+from typing import Iterable, Optional
+import numpy as np
+import scipy.sparse as sp
+from .network import HydraulicNetwork
+
+
+class NetworkTopology:
+    """
+    Compact array view of a HydraulicNetwork.
+
+    Nodes and links get contiguous integer ids (their position in
+    ``network.nodes`` / ``network.links``). Adjacency is stored in CSR form and,
+    after ``orient``, the spanning tree is kept as parent arrays plus the BFS
+    order, so the solver passes become linear sweeps instead of graph walks.
+    """
+
+    def __init__(self, network: HydraulicNetwork):
+        self.nodes = list(network.nodes.values())
+        self.links = list(network.links.values())
+        self.node_index = {node.id: i for i, node in enumerate(self.nodes)}
+        self.link_index = {link.id: i for i, link in enumerate(self.links)}
+
+        n = len(self.nodes)
+        m = len(self.links)
+
+        # Link endpoints (-1 for links that were never connected)
+        start = np.full(m, -1, dtype=np.int64)
+        end = np.full(m, -1, dtype=np.int64)
+        for i, link in enumerate(self.links):
+            if link.start_node is not None and link.end_node is not None:
+                start[i] = self.node_index[link.start_node.id]
+                end[i] = self.node_index[link.end_node.id]
+        self.link_start = start
+        self.link_end = end
+
+        # CSR adjacency (undirected). Keeps the order of node.connected_links so the
+        # BFS visits neighbours exactly like the object graph did.
+        adj_ptr = np.zeros(n + 1, dtype=np.int64)
+        adj_link = []
+        for i, node in enumerate(self.nodes):
+            for link in node.connected_links:
+                adj_link.append(self.link_index[link.id])
+            adj_ptr[i + 1] = len(adj_link)
+        self.adj_ptr = adj_ptr
+        self.adj_link = np.array(adj_link, dtype=np.int64)
+
+        # Static attributes
+        self.length = np.array([link.length for link in self.links], dtype=float)
+        self.elevation = np.array([node.elevation for node in self.nodes], dtype=float)
+        self.base_demand = np.array([node.base_demand for node in self.nodes], dtype=float)
+        self.emitter_count = np.array([node.emitter_count for node in self.nodes], dtype=float)
+        self.is_hose = np.array([link.type == 'hose' for link in self.links], dtype=bool)
+        self.is_emitter = np.array([node.type == 'emitter' for node in self.nodes], dtype=bool)
+        self.is_constrained = np.array([node.type in ('valve', 'emitter') for node in self.nodes], dtype=bool)
+
+        # Hydraulic state (kept in sync with the objects by store_* / load_*)
+        self.flow = np.array([link.flow for link in self.links], dtype=float)
+        self.diameter = np.array([link.diameter for link in self.links], dtype=float)
+        self.head_loss = np.array([link.head_loss for link in self.links], dtype=float)
+        self.velocity = np.array([link.velocity for link in self.links], dtype=float)
+        self.pressure = np.array([node.pressure for node in self.nodes], dtype=float)
+
+        # Tree (filled by orient)
+        self.parent_link = np.full(n, -1, dtype=np.int64)
+        self.parent_node = np.full(n, -1, dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.int64)
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        self.child_link = np.zeros(0, dtype=np.int64)
+
+        # Euler-tour (DFS preorder) intervals: the subtree of node v is
+        # preorder[tin[v]:tout[v]]. tin is -1 for nodes outside the tree.
+        self.preorder = np.zeros(0, dtype=np.int64)
+        self.tin = np.full(n, -1, dtype=np.int64)
+        self.tout = np.full(n, -1, dtype=np.int64)
+        self._path_matrix = None
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def num_links(self) -> int:
+        return len(self.links)
+
+    def orient(self, roots: Iterable[int]):
+        """
+        Runs a BFS from the given root node indices and orients the tree links
+        away from them. Loop-closing links are left out of the tree.
+        """
+        n = self.num_nodes
+        adj_ptr = self.adj_ptr.tolist()
+        adj_link = self.adj_link.tolist()
+        start = self.link_start.tolist()
+        end = self.link_end.tolist()
+
+        visited = [False] * n
+        parent_link = [-1] * n
+        parent_node = [-1] * n
+        order = []
+
+        queue = deque()
+        for r in roots:
+            if not visited[r]:
+                visited[r] = True
+                queue.append(r)
+
+        while queue:
+            u = queue.popleft()
+            order.append(u)
+            for k in range(adj_ptr[u], adj_ptr[u + 1]):
+                l = adj_link[k]
+                v = end[l] if start[l] == u else start[l]
+                if not visited[v]:
+                    visited[v] = True
+                    start[l] = u
+                    end[l] = v
+                    parent_link[v] = l
+                    parent_node[v] = u
+                    queue.append(v)
+
+        self.link_start = np.array(start, dtype=np.int64)
+        self.link_end = np.array(end, dtype=np.int64)
+        self.parent_link = np.array(parent_link, dtype=np.int64)
+        self.parent_node = np.array(parent_node, dtype=np.int64)
+        self.order = np.array(order, dtype=np.int64)
+
+        # Children CSR (downstream links per node, in BFS order of the child)
+        non_roots = self.order[self.parent_node[self.order] >= 0]
+        parents = self.parent_node[non_roots]
+        by_parent = np.argsort(parents, kind='stable')
+        self.child_link = self.parent_link[non_roots[by_parent]]
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parents, minlength=n), out=self.child_ptr[1:])
+
+        self._compute_subtree_ranges(roots_in_order=[v for v in order if parent_node[v] < 0])
+        self._path_matrix = None
+
+    def _compute_subtree_ranges(self, roots_in_order):
+        # Iterative preorder DFS (no recursion, deep chains are fine)
+        child_ptr = self.child_ptr.tolist()
+        child_link = self.child_link.tolist()
+        link_end = self.link_end.tolist()
+
+        preorder = []
+        stack = list(reversed(roots_in_order))
+        while stack:
+            u = stack.pop()
+            preorder.append(u)
+            for k in range(child_ptr[u + 1] - 1, child_ptr[u] - 1, -1):
+                stack.append(link_end[child_link[k]])
+
+        # Subtree sizes from the leaves up (reverse BFS order)
+        size = [1] * self.num_nodes
+        parent_node = self.parent_node.tolist()
+        for v in reversed(self.order.tolist()):
+            p = parent_node[v]
+            if p >= 0:
+                size[p] += size[v]
+
+        self.preorder = np.array(preorder, dtype=np.int64)
+        self.tin = np.full(self.num_nodes, -1, dtype=np.int64)
+        self.tin[self.preorder] = np.arange(len(preorder), dtype=np.int64)
+        self.tout = np.where(self.tin >= 0, self.tin + np.array(size, dtype=np.int64), -1)
+
+    def tree_links(self) -> np.ndarray:
+        """Indices of the links that belong to the oriented tree (BFS order)."""
+        return self.parent_link[self.order[self.parent_node[self.order] >= 0]]
+
+    def downstream_links(self, node_idx: int) -> np.ndarray:
+        return self.child_link[self.child_ptr[node_idx]:self.child_ptr[node_idx + 1]]
+
+    def path_links(self, node_idx: int) -> list:
+        """Links from node_idx back to its root (closest link first)."""
+        path = []
+        parent_link = self.parent_link
+        parent_node = self.parent_node
+        l = parent_link[node_idx]
+        while l >= 0:
+            path.append(int(l))
+            node_idx = parent_node[node_idx]
+            l = parent_link[node_idx]
+        return path
+
+    def path_matrix(self) -> sp.csr_matrix:
+        """
+        Sparse node x link path incidence: P[v, l] = 1 if tree link l lies on the
+        path from the root to node v. Built from the Euler ranges (the downstream
+        end of l spans preorder[tin:tout]) and cached until the next orient.
+
+        With it, link flows are P.T @ demand and the head lost up to each node is
+        P @ head_loss, for any number of demand columns at once.
+        """
+        if self._path_matrix is None:
+            links = self.tree_links()
+            children = self.link_end[links]
+            first = self.tin[children]
+            sizes = self.tout[children] - first
+            total = int(sizes.sum())
+            # Ragged arange: positions tin[c] .. tout[c]-1 for every child c
+            block_start = np.cumsum(sizes) - sizes
+            positions = np.repeat(first - block_start, sizes) + np.arange(total, dtype=np.int64)
+            rows = self.preorder[positions]
+            cols = np.repeat(links, sizes)
+            self._path_matrix = sp.csr_matrix(
+                (np.ones(total), (rows, cols)), shape=(self.num_nodes, self.num_links)
+            )
+        return self._path_matrix
+
+    def root_of(self) -> np.ndarray:
+        """Root node index of every node (-1 for nodes outside the tree)."""
+        root = np.full(self.num_nodes, -1, dtype=np.int64)
+        for r in self.order[self.parent_node[self.order] < 0].tolist():
+            root[self.preorder[self.tin[r]:self.tout[r]]] = r
+        return root
+
+    def accumulate_flow(self, demand, cap: float = float('inf')):
+        """
+        Accumulates node demands from the leaves to the roots in one pass over
+        the reverse BFS order (no recursion, so arbitrarily deep chains are fine).
+
+        Each tree link carries min(potential of its downstream node, cap) and that
+        capped value is what the upstream node accumulates.
+        Returns (link_flow, node_potential); links outside the tree get 0.
+        """
+        potential = [float(d) for d in demand]
+        link_flow = [0.0] * self.num_links
+        parent_link = self.parent_link.tolist()
+        parent_node = self.parent_node.tolist()
+
+        for v in reversed(self.order.tolist()):
+            l = parent_link[v]
+            if l < 0:
+                continue
+            design_flow = min(potential[v], cap)
+            link_flow[l] = design_flow
+            potential[parent_node[v]] += design_flow
+
+        return np.array(link_flow, dtype=float), np.array(potential, dtype=float)
+
+    # --- Sync with the object graph ---
+
+    def store_direction(self):
+        """Copies the tree orientation to the HydraulicNode/HydraulicLink objects."""
+        nodes = self.nodes
+        links = self.links
+        for node in nodes:
+            node.upstream_link = None
+            node.downstream_links = []
+        parent_link = self.parent_link.tolist()
+        parent_node = self.parent_node.tolist()
+        for v in self.order.tolist():
+            l = parent_link[v]
+            if l < 0:
+                continue
+            link = links[l]
+            u_node = nodes[parent_node[v]]
+            v_node = nodes[v]
+            link.start_node = u_node
+            link.end_node = v_node
+            u_node.downstream_links.append(link)
+            v_node.upstream_link = link
+
+    def store_links(self, indices: Optional[Iterable[int]] = None):
+        """Writes flow, diameter, head loss and velocity back to the link objects."""
+        if indices is None:
+            indices = range(self.num_links)
+            flow = self.flow.tolist()
+            diameter = self.diameter.tolist()
+            head_loss = self.head_loss.tolist()
+            velocity = self.velocity.tolist()
+        else:
+            # A handful of links: skip converting the whole arrays
+            flow, diameter, head_loss, velocity = self.flow, self.diameter, self.head_loss, self.velocity
+        for i in indices:
+            link = self.links[i]
+            link.flow = float(flow[i])
+            link.diameter = float(diameter[i])
+            link.head_loss = float(head_loss[i])
+            link.velocity = float(velocity[i])
+
+    def store_pressures(self):
+        """Writes node pressures back to the node objects."""
+        for node, p in zip(self.nodes, self.pressure.tolist()):
+            node.pressure = p
+
+    def load_diameters(self):
+        """Reads the link diameters from the objects (e.g. after an external change)."""
+        self.diameter = np.array([link.diameter for link in self.links], dtype=float)
@@ -4,13 +4,14 @@ from .core.calculations import HydraulicCalculator
 from .core.reports import ReportGenerator
 from .core.network import HydraulicNetwork
 from .core.network_builder import NetworkBuilder
+from .core.skeleton import NetworkSkeleton
 from .core.solver import HydraulicSolver
 from .core.pumps import PumpSelector
 from .core.elevation import ElevationManager
 from .core.geometry_tools import GeometryTools
 
-from qgis.core import QgsProject, QgsMapLayer, edit, QgsField, QgsGeometry, QgsWkbTypes, QgsFeature, QgsSpatialIndex, QgsDistanceArea, QgsUnitTypes
-from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsProject, QgsMapLayer, edit, QgsField, QgsGeometry, QgsWkbTypes, QgsFeature, QgsSpatialIndex, QgsDistanceArea, QgsUnitTypes, QgsTask
+from qgis.PyQt.QtCore import QVariant, pyqtSignal
 class HydraulicsLogic:
     def __init__(self, iface: Any):
         self.iface = iface
@@ -54,136 +55,193 @@ class HydraulicsLogic:
     def run_clipper_tool(self, line_layer: QgsMapLayer, poly_layer: QgsMapLayer) -> str:
         return self.geometry_tools.clip_lines_and_update(line_layer, poly_layer)
 
-    def run_genetic_optimization(self) -> str:
+    def run_genetic_optimization(self, group_field: Optional[str] = None) -> str:
         """
-        Orchestrates the genetic optimization process:
+        group_field: optional line attribute (e.g. sector) whose features share one diameter.
+        Orchestrates the genetic optimization process in the calling thread:
         1. Identifies layers.
         2. Builds network.
         3. Runs genetic solver.
         4. Updates QGIS layers.
+        The plugin runs steps 2-3 in a GeneticOptimizationTask instead.
         """
         try:
-            # 1. Identify Layers (Simple heuristic by name for now)
-            project = QgsProject.instance()
-            layers_map = {}
-            
-            # Define keywords to search for layers
-            keywords = {
-                'source': ['source', 'fonte', 'bomba'],
-                'valves': ['valve', 'valvula', 'registro'],
-                'emitters': ['emitter', 'emissor', 'aspersor'],
-                'hoses': ['hose', 'lateral', 'linha_lateral'], # Hoses usually lateral lines
-                'main': ['main', 'principal', 'adutora'],
-                'derivations': ['derivation', 'derivacao', 'secundaria']
-            }
-            
-            found_layers = {}
+            job = self.prepare_genetic_optimization(group_field)
+            if isinstance(job, str):
+                return job
+            error = self.optimize_network(job)
+            if error:
+                return error
+            return self.write_optimization_results(job)
             
-            for key, search_terms in keywords.items():
-                for layer in project.mapLayers().values():
-                    if layer.type() != QgsMapLayer.VectorLayer: continue
-                    
-                    name_lower = layer.name().lower()
-                    if any(term in name_lower for term in search_terms):
-                        found_layers[key] = layer
-                        break # Take first match
-            
-            # Validate essential layers
-            if 'source' not in found_layers:
-                return "Erro: Camada de Fonte (Source/Bomba) não encontrada."
-            if 'main' not in found_layers and 'derivations' not in found_layers and 'hoses' not in found_layers:
-                return "Erro: Nenhuma camada de tubulação encontrada."
-                
-            # 1.1 Check for DEM
-            dem_layer = self.elevation.get_dem_layer()
-            dem_msg = ""
-            if dem_layer:
-                dem_msg = f" (Usando DEM: {dem_layer.name()})"
-                
-            # 2. Build Network
-            network = HydraulicNetwork()
-            builder = NetworkBuilder(network)
-            builder.build(found_layers, dem_layer=dem_layer)
-            
-            if not network.nodes:
-                return "Erro: A rede criada está vazia. Verifique as camadas."
+        except Exception as e:
+            import traceback
+            return f"Erro na otimização: {str(e)}\n{traceback.format_exc()}"
+
+    def prepare_genetic_optimization(self, group_field: Optional[str] = None) -> Union[Dict[str, Any], str]:
+        """
+        Main-thread part before the optimization: finds the layers and the DEM and
+        reads their features. Returns the job dict for optimize_network, or an error message.
+        """
+        project = QgsProject.instance()
+        
+        # 1. Identify Layers (Simple heuristic by name for now)
+        layers_map = {}
+        
+        # Define keywords to search for layers
+        keywords = {
+            'source': ['source', 'fonte', 'bomba'],
+            'valves': ['valve', 'valvula', 'registro'],
+            'emitters': ['emitter', 'emissor', 'aspersor'],
+            'hoses': ['hose', 'lateral', 'linha_lateral'], # Hoses usually lateral lines
+            'main': ['main', 'principal', 'adutora'],
+            'derivations': ['derivation', 'derivacao', 'secundaria']
+        }
+        
+        found_layers = {}
+        
+        for key, search_terms in keywords.items():
+            for layer in project.mapLayers().values():
+                if layer.type() != QgsMapLayer.VectorLayer: continue
                 
-            # 3. Run Solver (Genetic)
-            solver = HydraulicSolver(network)
-            # Configure solver parameters if needed
-            solver.solve_generative()
-            
-            # 4. Update Layers
-            # We need to map links back to features.
-            # NetworkBuilder stores original ID in link ID: "{type}_{orig_id}_{segment_index}"
-            # But wait, NetworkBuilder might split lines.
-            # If it splits, we can't easily update the original feature unless we split it in QGIS too.
-            # For this MVP, let's assume lines are NOT split (node-to-node topology already exists) 
-            # OR we only update if the link corresponds to a full feature.
-            
-            # Actually, NetworkBuilder splits lines in `_process_line_segments`.
-            # If we want to write back, we should ideally rewrite the geometry or just update attributes if 1-to-1.
-            # If 1-to-N (one feature split into N links), we have a problem if they get different diameters.
-            # But usually, a single pipe segment in QGIS should have one diameter.
-            # If the optimizer assigns different diameters to segments of the same feature, we have a conflict.
-            # For now, let's take the MAX diameter assigned to any segment of the feature and apply to the whole feature.
-            # This is a safe approximation for "renovating" the pipe.
-            
-            updates = {} # (layer_id, feature_id) -> {'dn': val, 'hf': val}
-            
-            for link in network.links.values():
-                # Parse ID: type_origId_index
-                parts = link.id.split('_')
-                if len(parts) < 3: continue
+                name_lower = layer.name().lower()
+                if any(term in name_lower for term in search_terms):
+                    found_layers[key] = layer
+                    break # Take first match
+        
+        # Validate essential layers
+        if 'source' not in found_layers:
+            return "Erro: Camada de Fonte (Source/Bomba) não encontrada."
+        if 'main' not in found_layers and 'derivations' not in found_layers and 'hoses' not in found_layers:
+            return "Erro: Nenhuma camada de tubulação encontrada."
+            
+        # 1.1 Check for DEM
+        dem_layer = self.elevation.get_dem_layer()
+        dem_msg = ""
+        if dem_layer:
+            dem_msg = f" (Usando DEM: {dem_layer.name()})"
+            
+        # Features and DEM are read here: optimize_network may run in a background
+        # task, where layers and raster providers must not be used
+        reader = NetworkBuilder(HydraulicNetwork())
+        reader.group_field = group_field
+        features = reader.read_layers(found_layers)
+        
+        return {'layers': found_layers, 'features': features, 'elevation': self.elevation.sampler(dem_layer),
+                'dem_msg': dem_msg}
+
+    def optimize_network(self, job: Dict[str, Any], progress_callback=None, is_canceled=None) -> Optional[str]:
+        """
+        Builds the network and runs the genetic solver, storing the network, optimizer
+        and reduction sizes in job. Uses only the data prepare_genetic_optimization read,
+        never the layers, so it can run in a background task. Returns an error message, or None.
+        progress_callback / is_canceled: per-generation hooks, see GeneticOptimizer.
+        """
+        # 2. Build Network
+        network = HydraulicNetwork()
+        builder = NetworkBuilder(network)
+        builder.build_from_features(job['features'], job['elevation'])
+        
+        if not network.nodes:
+            return "Erro: A rede criada está vazia. Verifique as camadas."
+        if is_canceled is not None and is_canceled():
+            return "Otimização cancelada antes do cálculo."
+            
+        # 3. Run Solver (Genetic) on the reduced network, then map back.
+        # A canceled run stops between generations with the best design found so far.
+        skeleton = NetworkSkeleton(network)
+        reduced = skeleton.reduce()
+        solver = HydraulicSolver(reduced)
+        # Configure solver parameters if needed
+        optimizer = solver.solve_generative(progress_callback=progress_callback, is_canceled=is_canceled)
+        skeleton.expand(solver)
+        
+        job['network'] = network
+        job['optimizer'] = optimizer
+        job['sizes'] = skeleton.stats()
+        job['snapped'] = builder.snap_stats.get('snapped', 0)
+        job['tolerance'] = builder.tolerance
+        return None
+
+    def write_optimization_results(self, job: Dict[str, Any]) -> str:
+        """Main-thread part after the optimization: writes DN and head loss to the layers."""
+        project = QgsProject.instance()
+        found_layers = job['layers']
+        network = job['network']
+        
+        # 4. Update Layers
+        # We need to map links back to features.
+        # NetworkBuilder stores original ID in link ID: "{type}_{orig_id}_{segment_index}"
+        # But wait, NetworkBuilder might split lines.
+        # If it splits, we can't easily update the original feature unless we split it in QGIS too.
+        # For this MVP, let's assume lines are NOT split (node-to-node topology already exists) 
+        # OR we only update if the link corresponds to a full feature.
+        
+        # Actually, NetworkBuilder splits lines in `_process_line_segments`.
+        # If we want to write back, we should ideally rewrite the geometry or just update attributes if 1-to-1.
+        # If 1-to-N (one feature split into N links), we have a problem if they get different diameters.
+        # But usually, a single pipe segment in QGIS should have one diameter.
+        # If the optimizer assigns different diameters to segments of the same feature, we have a conflict.
+        # The optimizer uses one gene per feature (link.feature_id), so all segments of a
+        # feature already share a diameter; the MAX below is only a safeguard.
+        
+        updates = {} # (layer_id, feature_id) -> {'dn': val, 'hf': val}
+        
+        for link in network.links.values():
+            # Parse ID: type_origId_index
+            parts = link.id.split('_')
+            if len(parts) < 3: continue
+            
+            l_type = parts[0]
+            try:
+                orig_id = int(parts[1])
+            except ValueError:
+                continue
                 
-                l_type = parts[0]
-                try:
-                    orig_id = int(parts[1])
-                except ValueError:
-                    continue
-                    
-                # Find layer
-                layer_key = None
-                if l_type == 'main': layer_key = 'main'
-                elif l_type == 'derivation': layer_key = 'derivations'
-                elif l_type == 'lateral': layer_key = 'laterals' # hoses?
-                elif l_type == 'hose': layer_key = 'hoses'
+            # Find layer
+            layer_key = None
+            if l_type == 'main': layer_key = 'main'
+            elif l_type == 'derivation': layer_key = 'derivations'
+            elif l_type == 'lateral': layer_key = 'laterals' # hoses?
+            elif l_type == 'hose': layer_key = 'hoses'
+            
+            if layer_key and layer_key in found_layers:
+                layer = found_layers[layer_key]
                 
-                if layer_key and layer_key in found_layers:
-                    layer = found_layers[layer_key]
-                    
-                    if (layer.id(), orig_id) not in updates:
-                        updates[(layer.id(), orig_id)] = {'dn': 0.0, 'hf': 0.0}
-                    
-                    # Accumulate (Max DN, Sum HF?)
-                    # Actually HF is per segment. We should sum HF for the feature.
-                    # DN should be uniform. If segments differ, we might have an issue.
-                    # Let's take the largest DN to be safe.
-                    
-                    curr = updates[(layer.id(), orig_id)]
-                    curr['dn'] = max(curr['dn'], link.diameter)
-                    curr['hf'] += link.head_loss
-            
-            # Apply updates
-            count = 0
-            for (layer_id, fid), data in updates.items():
-                layer = project.mapLayer(layer_id)
-                if not layer: continue
+                if (layer.id(), orig_id) not in updates:
+                    updates[(layer.id(), orig_id)] = {'dn': 0.0, 'hf': 0.0}
                 
-                # Ensure fields exist
-                idx_dn = self.calculator._ensure_field(layer, 'Diametro', QVariant.Double) # Using 'Diametro' or FIELD_DN
-                idx_hf = self.calculator._ensure_field(layer, 'PerdaCarga', QVariant.Double)
+                # Accumulate (Max DN, Sum HF?)
+                # Actually HF is per segment. We should sum HF for the feature.
+                # DN should be uniform. If segments differ, we might have an issue.
+                # Let's take the largest DN to be safe.
                 
-                with edit(layer):
-                    layer.changeAttributeValue(fid, idx_dn, float(data['dn']))
-                    layer.changeAttributeValue(fid, idx_hf, float(data['hf']))
-                    count += 1
+                curr = updates[(layer.id(), orig_id)]
+                curr['dn'] = max(curr['dn'], link.diameter)
+                curr['hf'] += link.head_loss
+        
+        # Apply updates
+        count = 0
+        for (layer_id, fid), data in updates.items():
+            layer = project.mapLayer(layer_id)
+            if not layer: continue
+            
+            # Ensure fields exist
+            idx_dn = self.calculator._ensure_field(layer, 'Diametro', QVariant.Double) # Using 'Diametro' or FIELD_DN
+            idx_hf = self.calculator._ensure_field(layer, 'PerdaCarga', QVariant.Double)
             
-            return f"Otimização Genética Concluída! {count} tubos atualizados.{dem_msg}"
-            
-        except Exception as e:
-            import traceback
-            return f"Erro na otimização: {str(e)}\n{traceback.format_exc()}"
+            with edit(layer):
+                layer.changeAttributeValue(fid, idx_dn, float(data['dn']))
+                layer.changeAttributeValue(fid, idx_hf, float(data['hf']))
+                count += 1
+        
+        run = job['optimizer'].run_stats if job['optimizer'] else {}
+        title = ("Otimização Genética Cancelada: melhor solução encontrada aplicada."
+                 if run.get('stop_reason') == 'canceled' else "Otimização Genética Concluída!")
+        return (f"{title} {count} tubos atualizados.{job['dem_msg']}\n"
+                f"Rede reduzida: {job['sizes']['nodes']} -> {job['sizes']['reduced_nodes']} nós.\n"
+                f"{job['snapped']} pontos ajustados na tolerância de {job['tolerance']} m.\n"
+                f"{run.get('generations', 0)} gerações em {run.get('elapsed', 0.0):.1f} s.")
 
     def select_pump(self, flow, head):
         """Selects suitable pumps."""
@@ -418,3 +476,42 @@ class HydraulicsLogic:
             
         except Exception as e:
             return f"Erro ao salvar fonte: {e}"
+
+
+class GeneticOptimizationTask(QgsTask):
+    """
+    Runs HydraulicsLogic.optimize_network in a QGIS background task. Layer edits
+    stay on the main thread: write_optimization_results runs in finished().
+    Canceling stops the GA after the current generation; its best design is still written.
+    """
+    # generation, generations, best cost (PIPE_COSTS units), worst pressure deficit (m)
+    generationDone = pyqtSignal(int, int, float, float)
+
+    def __init__(self, logic: HydraulicsLogic, job: Dict[str, Any], on_finished):
+        super().__init__("HidroCalc: Otimização Genética", QgsTask.CanCancel)
+        self.logic = logic
+        self.job = job
+        self.on_finished = on_finished # f(message), called on the main thread
+        self.error = None
+
+    def run(self) -> bool:
+        try:
+            self.error = self.logic.optimize_network(self.job, self._progress, self.isCanceled)
+        except Exception as e:
+            import traceback
+            self.error = f"Erro na otimização: {str(e)}\n{traceback.format_exc()}"
+        return self.error is None
+
+    def _progress(self, generation, generations, best_cost, deficit):
+        self.setProgress(100.0 * generation / max(generations, 1))
+        self.generationDone.emit(generation, generations, best_cost, deficit)
+
+    def finished(self, result: bool):
+        if result:
+            try:
+                message = self.logic.write_optimization_results(self.job)
+            except Exception as e:
+                message = f"Erro ao gravar resultados: {str(e)}"
+        else:
+            message = self.error or "Otimização cancelada."
+        self.on_finished(message)
@@ -13,7 +13,7 @@ from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.core import QgsProject, QgsWkbTypes, QgsMapLayer, Qgis, QgsField, edit, QgsCoordinateReferenceSystem, QgsCoordinateTransform
 from qgis.PyQt.QtCore import QVariant, Qt
 from .resources import init_resources, get_icon
-from .logic import HydraulicsLogic
+from .logic import HydraulicsLogic, GeneticOptimizationTask
 from .parts_manager import PartManager
 from .project_parts_manager import ProjectPartsManager
 from .services_manager import ServiceManager
@@ -52,6 +52,7 @@ class HidroCalcPlugin:
         self.toolbar = None
         self.lbl_selection: Optional[QLabel] = None
         self.current_layer: Optional[QgsMapLayer] = None
+        self.optimization_task = None # Running GeneticOptimizationTask, if any
 
     def initGui(self):
         init_resources()
@@ -653,6 +654,11 @@ class HidroCalcPlugin:
 
     def run_genetic_optimization(self):
         """Runs the genetic optimization."""
+        if self.optimization_task is not None:
+            message = "Uma otimização genética já está em andamento. Aguarde ou cancele na barra de tarefas."
+            self.iface.messageBar().pushMessage("HidroCalc", message, level=Qgis.Warning)
+            return message
+            
         # Confirm with user if running from GUI
         reply = QMessageBox.question(
             self.iface.mainWindow(), 
@@ -664,16 +670,48 @@ class HidroCalcPlugin:
         )
         
         if reply == QMessageBox.Yes:
-            self.iface.messageBar().pushMessage("HidroCalc", "Iniciando otimização genética... Isso pode levar alguns segundos.", level=Qgis.Info)
-            # Process events to show message
-            from qgis.PyQt.QtCore import QCoreApplication
-            QCoreApplication.processEvents()
+            # Pipes with the same value of this field share one diameter (e.g. sector)
+            no_group = "(Nenhum: um diâmetro por tubo)"
+            fields = sorted({f.name() for l in QgsProject.instance().mapLayers().values()
+                             if l.type() == QgsMapLayer.VectorLayer and l.geometryType() == QgsWkbTypes.LineGeometry
+                             for f in l.fields()})
+            options = [no_group] + fields
+            default = next((i for i, name in enumerate(options) if name.upper() == "SETOR"), 0)
+            item, ok = QInputDialog.getItem(
+                self.iface.mainWindow(), "Otimização Genética",
+                "Campo de agrupamento (tubos com o mesmo valor recebem o mesmo diâmetro):",
+                options, default, False
+            )
+            if not ok:
+                return "Cancelado pelo usuário."
+
+            job = self.logic.prepare_genetic_optimization(None if item == no_group else item)
+            if isinstance(job, str):
+                QMessageBox.information(self.iface.mainWindow(), "Resultado", job)
+                return job
             
-            result = self.logic.run_genetic_optimization()
-            QMessageBox.information(self.iface.mainWindow(), "Resultado", result)
-            return result
+            # Build and optimize in the background; the layers are written when it finishes
+            from qgis.core import QgsApplication
+            task = GeneticOptimizationTask(self.logic, job, self._on_genetic_optimization_finished)
+            task.generationDone.connect(self._on_genetic_generation)
+            self.optimization_task = task # Keep a reference while it runs
+            QgsApplication.taskManager().addTask(task)
+            self.iface.messageBar().pushMessage(
+                "HidroCalc", "Otimização genética em segundo plano. Acompanhe ou cancele na barra de tarefas.", level=Qgis.Info
+            )
+            return "Otimização iniciada."
         return "Cancelado pelo usuário."
 
+    def _on_genetic_generation(self, generation, generations, best_cost, deficit):
+        status = f"pressão faltante {deficit:.2f} mca" if deficit > 0 else "viável"
+        self.iface.statusBarIface().showMessage(
+            f"HidroCalc: geração {generation}/{generations}, melhor custo {best_cost:,.1f} ({status})", 5000
+        )
+
+    def _on_genetic_optimization_finished(self, message):
+        self.optimization_task = None
+        QMessageBox.information(self.iface.mainWindow(), "Resultado", message)
+
     def run_auto_sectoring(self):
         """Runs automatic sectoring dialog."""
         # 1. Select Emitter Layer
@@ -0,0 +1,103 @@
+"""
+Memory benchmark: bytes per node and per link of the hydraulic network model.
+
+Compares the current HydraulicNode/HydraulicLink (__slots__, straight-link
+geometry built on demand) with replicas of the previous classes (per-instance
+__dict__ and a stored geometry on every link).
+
+Usage: python tests/benchmark_memory.py [number_of_emitters]
+"""
+import sys
+import os
+import tracemalloc
+
+sys.path.append(os.getcwd())
+
+from core.geometry import Point, LineGeometry
+from core.network import HydraulicNetwork, HydraulicNode, HydraulicLink
+
+
+class LegacyNode:
+    def __init__(self, node_id, point, node_type):
+        self.id = node_id
+        self.point = point
+        self.type = node_type
+        self.elevation = 0.0
+        self.base_demand = 0.0
+        self.pressure = 0.0
+        self.connected_links = []
+        self.downstream_links = []
+        self.upstream_link = None
+
+
+class LegacyLink:
+    def __init__(self, link_id, geometry, link_type):
+        self.id = link_id
+        self.geometry = geometry
+        self.type = link_type
+        self.start_node = None
+        self.end_node = None
+        self.length = geometry.length()
+        self.diameter = 0.0
+        self.flow = 0.0
+        self.head_loss = 0.0
+        self.velocity = 0.0
+
+
+def build_hose(n, node_cls, link_cls, stored_geometry):
+    """A hose with n emitters spaced 0.5 m, in a HydraulicNetwork."""
+    network = HydraulicNetwork()
+    prev = node_cls("junc", Point(0.0, 0.0), 'junction')
+    network.nodes[prev.id] = prev
+    for i in range(n):
+        node = node_cls(f"emitter_{i}", Point(0.0, 0.5 * (i + 1)), 'emitter')
+        network.nodes[node.id] = node
+        geometry = LineGeometry.fromPolylineXY([prev.point, node.point]) if stored_geometry else None
+        link = link_cls(f"hose_0_{i}", geometry, 'hose')
+        network.links[link.id] = link
+        if stored_geometry:
+            # Previous connect_link (no length from the node points)
+            link.start_node, link.end_node = prev, node
+            prev.connected_links.append(link)
+            node.connected_links.append(link)
+        else:
+            network.connect_link(link.id, prev.id, node.id)
+        prev = node
+    return network
+
+
+def measure(n, node_cls, link_cls, stored_geometry):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    network = build_hose(n, node_cls, link_cls, stored_geometry)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+
+    # Split the total using a nodes-only build of the same size
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    nodes = [node_cls(f"emitter_{i}", Point(0.0, 0.5 * i), 'emitter') for i in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    node_bytes = sum(s.size_diff for s in after.compare_to(before, 'filename')) / n
+    link_bytes = (total - node_bytes * (n + 1)) / n
+    del network, nodes
+    return node_bytes, link_bytes
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    legacy = measure(n, LegacyNode, LegacyLink, stored_geometry=True)
+    compact = measure(n, HydraulicNode, HydraulicLink, stored_geometry=False)
+
+    print(f"{n} emitters, Python {sys.version.split()[0]}")
+    print(f"{'':10s}{'bytes/node':>12s}{'bytes/link':>12s}")
+    print(f"{'before':10s}{legacy[0]:12.0f}{legacy[1]:12.0f}")
+    print(f"{'after':10s}{compact[0]:12.0f}{compact[1]:12.0f}")
+    print(f"reduction: nodes {legacy[0] / compact[0]:.1f}x, links {legacy[1] / compact[1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,18 @@
 import pytest
 from unittest.mock import MagicMock
 import sys
+import os
+
+# Make the plugin root importable (core/, mock_qgis_setup)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Mock QGIS modules if not running inside QGIS
 try:
     import qgis.core
 except ImportError:
-    # Create mock modules
-    sys.modules['qgis'] = MagicMock()
-    sys.modules['qgis.core'] = MagicMock()
+    # Lightweight QgsPointXY/QgsGeometry so the hydraulic core can run
+    import mock_qgis_setup
     sys.modules['qgis.gui'] = MagicMock()
-    sys.modules['qgis.PyQt'] = MagicMock()
-    sys.modules['qgis.PyQt.QtCore'] = MagicMock()
     sys.modules['qgis.PyQt.QtWidgets'] = MagicMock()
 
 @pytest.fixture
@@ -0,0 +1,73 @@
+import sys
+import os
+import itertools
+import random
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+from core.geometry import Point
+from core.network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from core.solver import HydraulicSolver
+from core.dp_optimizer import TreeDPOptimizer
+from core.fitness import FitnessModel
+from core.constants import VALID_DNS
+
+
+def _random_tree(n, seed):
+    rng = random.Random(seed)
+    network = HydraulicNetwork()
+    network.add_node(HydraulicNode("n0", Point(0, 0), "source"))
+    for i in range(1, n):
+        node_type = "valve" if rng.random() < 0.5 else "junction"
+        node = HydraulicNode(f"n{i}", Point(i * 40.0, rng.uniform(0, 80)), node_type)
+        node.base_demand = rng.uniform(2, 15) if node_type == "valve" else 0.0
+        node.elevation = rng.uniform(0, 8)
+        network.add_node(node)
+        network.add_link(HydraulicLink(f"l{i}", None, "main"))
+        network.connect_link(f"l{i}", f"n{rng.randrange(i)}", f"n{i}")
+    return network
+
+
+def _prepare(network, min_pressure):
+    solver = HydraulicSolver(network)
+    solver.min_pressure = min_pressure
+    solver._establish_direction()
+    solver.max_system_flow = float('inf')
+    solver._accumulate_flow()
+    solver._initial_sizing()
+    solver._calculate_pressure()
+    return solver
+
+
+def test_dp_matches_exhaustive_search():
+    for seed in range(5):
+        network = _random_tree(7, seed)
+        solver = _prepare(network, min_pressure=18.0)
+        links = list(network.links.values())
+        model = FitnessModel(solver, links)
+
+        # Brute force over all 6^6 assignments
+        genomes = list(itertools.product(range(len(VALID_DNS)), repeat=len(links)))
+        cost, penalty, _ = model.states(genomes)
+        feasible = penalty == 0
+
+        dp = TreeDPOptimizer(solver)
+        dp.optimize()
+        assert dp.stats['feasible'] == feasible.any()
+        if feasible.any():
+            best = cost[feasible].min()
+            assert abs(dp.stats['cost'] - best) < 1e-6
+            assert all(n.pressure >= 18.0 - 1e-9 for n in network.nodes.values() if n.type == 'valve')
+            chosen = [VALID_DNS.index(link.diameter) for link in links]
+            assert abs(model.evaluate([chosen])[0] - best) < 1e-6
+
+
+def test_solve_generative_dp_method():
+    network = _random_tree(300, 1)
+    solver = HydraulicSolver(network)
+    solver.min_pressure = 5.0
+    optimizer = solver.solve_generative(method='dp')
+    assert isinstance(optimizer, TreeDPOptimizer)
+    assert optimizer.stats['feasible']
+    assert min(n.pressure for n in network.nodes.values() if n.type == 'valve') >= 5.0 - 1e-9
@@ -0,0 +1,108 @@
+import sys
+import os
+import pickle
+import subprocess
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+from core.geometry import Point, LineGeometry, cluster_points, segment_intersections
+from core.network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from core.solver import HydraulicSolver
+
+
+def test_line_geometry_length_and_points():
+    line = LineGeometry.fromPolylineXY([Point(0, 0), Point(3, 4), Point(3, 10)])
+    assert line.length() == 11.0
+    assert line.asPolyline()[1] == Point(3, 4)
+    assert Point(0, 0).sqrDist(Point(3, 4)) == 25.0
+
+
+def test_solved_network_pickles():
+    network = HydraulicNetwork()
+    for node_id, x, node_type in (("s", 0, "source"), ("v", 100, "valve")):
+        node = HydraulicNode(node_id, Point(x, 0), node_type)
+        node.base_demand = 5.0 if node_type == "valve" else 0.0
+        network.add_node(node)
+    network.add_link(HydraulicLink("l", LineGeometry.fromPolylineXY([Point(0, 0), Point(100, 0)]), "main"))
+    network.connect_link("l", "s", "v")
+    HydraulicSolver(network).solve()
+
+    copy = pickle.loads(pickle.dumps(network))
+    assert copy.links["l"].diameter == network.links["l"].diameter
+    assert copy.nodes["v"].pressure == network.nodes["v"].pressure
+    assert copy.links["l"].end_node is copy.nodes["v"]
+
+
+def test_core_imports_without_qgis():
+    code = (
+        "import sys; sys.modules['qgis'] = None\n"
+        "import core.network, core.solver, core.optimizer, core.skeleton, core.looped_solver\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_cluster_points_merges_across_cell_boundaries():
+    import random
+    import numpy as np
+
+    # 1 mm apart on both sides of a cell (and rounding) boundary
+    labels = cluster_points([(0.0995, 5.0), (0.1005, 5.0), (0.3, 5.0)], 0.1)
+    assert labels.tolist() == [0, 0, 2]
+
+    # Same groups as the transitive closure of the brute-force close pairs
+    rng = random.Random(4)
+    xy = np.array([(rng.uniform(0, 3), rng.uniform(0, 3)) for _ in range(300)])
+    labels = cluster_points(xy, 0.1)
+    close = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1)) < 0.1
+    reach = close.copy()
+    for _ in range(len(xy)):
+        grown = (reach.astype(int) @ close.astype(int)) > 0
+        if (grown == reach).all():
+            break
+        reach = grown
+    assert (labels == reach.argmax(axis=1)).all()
+
+
+def _brute_intersections(a, b, owners):
+    found = set()
+    for p in range(len(a)):
+        for q in range(p + 1, len(a)):
+            if owners[p] == owners[q]:
+                continue
+            r, s, d = b[p] - a[p], b[q] - a[q], a[q] - a[p]
+            denom = r[0] * s[1] - r[1] * s[0]
+            if abs(denom) < 1e-12:
+                continue
+            t = (d[0] * s[1] - d[1] * s[0]) / denom
+            u = (d[0] * r[1] - d[1] * r[0]) / denom
+            if -1e-9 <= t <= 1 + 1e-9 and -1e-9 <= u <= 1 + 1e-9:
+                found.add(tuple(round(c, 6) for c in a[p] + min(max(t, 0.0), 1.0) * r))
+    return found
+
+
+def test_segment_intersections_match_brute_force_on_and_off_grid_lines():
+    import random
+    import numpy as np
+
+    rng = random.Random(7)
+    for snap in (False, True):
+        # Snapped: ends and crossings on cell edges and corners (cell 1)
+        coord = (lambda: float(rng.randint(0, 6))) if snap else (lambda: rng.uniform(0, 6))
+        a = np.array([(coord(), coord()) for _ in range(150)])
+        b = np.array([(coord(), coord()) for _ in range(150)])
+        owners = np.arange(150) // 3
+        got = segment_intersections(a, b, owners, 1.0)
+        assert {tuple(round(c, 6) for c in pt) for pt in got.tolist()} == _brute_intersections(a, b, owners)
+
+
+def test_segment_intersections_long_diagonal_stays_small():
+    import numpy as np
+
+    # 10 km diagonal among 1 m segments: cells along it, not its bounding box
+    a = np.array([(0.0, 0.0)] + [(x + 0.5, 5000.0 - 0.5) for x in range(4990, 5010)])
+    b = np.array([(10000.0, 10000.0)] + [(x + 0.5, 5000.0 + 0.5) for x in range(4990, 5010)])
+    owners = np.arange(len(a))
+    # Its bounding box alone is 10**8 cells
+    got = segment_intersections(a, b, owners, 1.0)
+    assert sorted(got.tolist()) == [[4999.5, 4999.5], [5000.5, 5000.5]]
@@ -0,0 +1,27 @@
+import sys
+import os
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+import numpy as np
+from core.hazen_williams import hazen_williams
+
+
+def test_matches_scalar_formula_and_broadcasts():
+    flows = np.array([10.0, 0.0, 5.0])
+    dns = np.array([50.0, 50.0, 0.0])
+    head_loss, velocity = hazen_williams(flows, dns, 100.0)
+
+    q, d = 10.0 / 3600.0, 0.05
+    expected = 10.67 * 100.0 * (q ** 1.852) / ((135.0 ** 1.852) * (d ** 4.87))
+    assert abs(head_loss[0] - expected) < 1e-12
+    assert abs(velocity[0] - q / (np.pi * d * d / 4)) < 1e-12
+    # No flow or no diameter -> no loss
+    assert head_loss[1] == 0.0 and head_loss[2] == 0.0
+    assert velocity[1] == 0.0 and velocity[2] == 0.0
+
+    # Flow column x DN row gives a full table
+    table, _ = hazen_williams(flows[:, None], np.array([32.0, 50.0, 75.0])[None, :], 1.0)
+    assert table.shape == (3, 3)
+    assert table[0, 0] > table[0, 1] > table[0, 2]
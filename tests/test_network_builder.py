@@ -0,0 +1,269 @@
+import sys
+import os
+import random
+
+import numpy as np
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+# Mock QGIS environment
+try:
+    import qgis.core
+except ImportError:
+    import mock_qgis_setup
+
+from core.geometry import Point
+from core.network import HydraulicNetwork, HydraulicNode
+from core.network_builder import NetworkBuilder
+
+
+def test_find_node_at_uses_grid_index():
+    rng = random.Random(1)
+    builder = NetworkBuilder(HydraulicNetwork())
+    nodes = []
+    for i in range(500):
+        node = HydraulicNode(f"n{i}", Point(rng.uniform(0, 20), rng.uniform(-5, 5)), 'emitter')
+        builder._add_node(node)
+        nodes.append(node)
+    assert len(builder.node_index) == 500
+
+    tol2 = builder.tolerance ** 2
+    for _ in range(300):
+        query = Point(rng.uniform(0, 20), rng.uniform(-5, 5))
+        found = builder._find_node_at(query)
+        near = [n for n in nodes if n.point.sqrDist(query) < tol2]
+        if not near:
+            assert found is None
+        else:
+            assert found is min(near, key=lambda n: n.point.sqrDist(query))
+
+
+def _locate(line, point):
+    # Reference: closest point over all segments -> (distance, distance along the line)
+    best, start = None, 0.0
+    for (ax, ay), (bx, by) in zip(line, line[1:]):
+        dx, dy = bx - ax, by - ay
+        seg = (dx * dx + dy * dy) ** 0.5
+        t = max(0.0, min(1.0, ((point.x() - ax) * dx + (point.y() - ay) * dy) / (seg * seg)))
+        dist = ((ax + t * dx - point.x()) ** 2 + (ay + t * dy - point.y()) ** 2) ** 0.5
+        if best is None or dist < best[0]:
+            best = (dist, start + t * seg)
+        start += seg
+    return best
+
+
+def test_nodes_on_line_match_brute_force():
+    from core.geometry import LineGeometry
+
+    rng = random.Random(2)
+    line = [(0.0, 0.0), (30.0, 10.0), (30.0, 40.0), (5.0, 42.0)]
+    builder = NetworkBuilder(HydraulicNetwork())
+    for i in range(400):
+        # Points scattered around the line, some within tolerance of it
+        k = rng.randrange(3)
+        t = rng.random()
+        x = line[k][0] + t * (line[k + 1][0] - line[k][0]) + rng.gauss(0, 0.15)
+        y = line[k][1] + t * (line[k + 1][1] - line[k][1]) + rng.gauss(0, 0.15)
+        builder._add_node(HydraulicNode(f"n{i}", Point(x, y), 'emitter'))
+    for x, y in line: # Vertices are nodes too
+        builder._add_node(HydraulicNode(f"v{x}_{y}", Point(x, y), 'junction'))
+
+    found = builder._nodes_on_line(LineGeometry(line).coords)
+    expected = []
+    for node in builder.network.nodes.values():
+        dist, along = _locate(line, node.point)
+        if dist < builder.tolerance:
+            expected.append((along, node))
+    expected.sort(key=lambda x: x[0])
+    assert [n.id for _, n in found] == [n.id for _, n in expected]
+    assert all(abs(a - b) < 1e-9 for (a, _), (b, _) in zip(found, expected))
+
+    builder._process_line_segments(LineGeometry(line), 'hose', 7)
+    assert len(builder.network.links) == len(found) - 1
+
+
+def test_deduplicate_points_reports_snapping():
+    builder = NetworkBuilder(HydraulicNetwork())
+    points = [Point(0.0, 0.0), Point(0.0, 0.0), Point(0.004, 0.0), Point(10.0, 0.0), Point(10.05, 0.03)]
+    unique = builder._deduplicate_points(points)
+    assert list(unique.values()) == [points[0], points[3]]
+    assert builder.snap_stats == {'points': 5, 'unique': 2, 'merged': 3, 'snapped': 2}
+
+
+def test_build_from_geometries_uses_supplied_junctions():
+    import numpy as np
+
+    network = HydraulicNetwork()
+    builder = NetworkBuilder(network)
+    builder.build_from_geometries(
+        lines={
+            'main': [np.array([(0.0, 0.0), (100.0, 0.0)])],
+            'derivations': [[(50.02, 0.0), (50.0, 30.0)]],
+        },
+        points={'source': np.array([(0.0, 0.0)]), 'valves': [Point(50.0, 30.0)]},
+        junctions=[Point(50.0, 0.0)],
+    )
+
+    assert network.nodes["junc_50.000_0.000"].type == 'junction' # As given, not the endpoint
+    assert {n.type for n in network.nodes.values()} == {'source', 'valve', 'junction'}
+    assert len(network.nodes) == 4
+    # The main splits at the junction; the derivation starts there
+    assert sorted(network.links) == ['derivation_1_0', 'main_1_0', 'main_1_1']
+    tee = network.nodes["junc_50.000_0.000"]
+    assert len(tee.connected_links) == 3
+    assert network.links['main_1_0'].length == 50.0
+
+
+class _MultiLine:
+    # Minimal multipart line geometry (the QGIS mock has none)
+    def __init__(self, parts):
+        self.parts = [[Point(x, y) for x, y in part] for part in parts]
+
+    def isMultipart(self):
+        return True
+
+    def asMultiPolyline(self):
+        return self.parts
+
+
+def test_crossings_tee_and_multipart_parts_keep_provenance():
+    network = HydraulicNetwork()
+    builder = NetworkBuilder(network)
+    builder.build_from_geometries(
+        lines={
+            'main': [[(0.0, 0.0), (100.0, 0.0)]],
+            # Crosses the main at x=30 with no vertex there; two parts of one feature
+            'derivations': [_MultiLine([[(30.0, -20.0), (30.0, 20.0)], [(80.0, 0.0), (80.0, 25.0)]])],
+        },
+        points={'source': [Point(0.0, 0.0)], 'valves': [Point(30.0, 20.0), Point(80.0, 25.0)]},
+    )
+
+    assert builder.crossing_count >= 1
+    cross = builder._find_node_at(Point(30.0, 0.0))
+    assert cross is not None and len(cross.connected_links) == 4
+    tee = builder._find_node_at(Point(80.0, 0.0))
+    assert tee is not None and len(tee.connected_links) == 3
+
+    derivation = [l for l in network.links.values() if l.type == 'derivation']
+    assert len(derivation) == 3
+    assert {l.feature_id for l in derivation} == {'derivation_1'}
+    assert len({l.id for l in derivation}) == 3
+    assert abs(sum(l.length for l in derivation) - 65.0) < 1e-9
+
+
+def test_reused_builder_does_not_keep_old_nodes():
+    builder = NetworkBuilder(HydraulicNetwork())
+    builder.build_from_geometries(lines={'main': [[(0.0, 0.0), (10.0, 0.0)]]})
+    first = builder.network
+
+    # Same node count, new network: the links must join the new nodes
+    builder.network = HydraulicNetwork()
+    builder.build_from_geometries(lines={'main': [[(0.0, 5.0), (10.0, 5.0)]]})
+    link = next(iter(builder.network.links.values()))
+    assert link.start_node is not None and link.start_node.id in builder.network.nodes
+    assert link.start_node is not first.nodes.get(link.start_node.id)
+    assert link.start_node.point.y() == 5.0
+
+
+def test_geometry_points_do_not_clash_with_layer_node_ids():
+    network = HydraulicNetwork()
+    # As read from a valve layer: named after the feature id
+    network.add_node(HydraulicNode("valve_1", Point(0.0, 50.0), 'valve'))
+    builder = NetworkBuilder(network)
+    builder.build_from_geometries(lines={'main': [[(0.0, 0.0), (10.0, 0.0)]]},
+                                  points={'valves': np.array([(10.0, 0.0)])})
+
+    assert network.nodes["valve_1"].point.y() == 50.0
+    assert network.nodes["valve_g1"].point.x() == 10.0
+
+
+def test_main_crossing_another_sector_hose_is_not_a_tee_when_junctions_given():
+    builder = NetworkBuilder(HydraulicNetwork())
+    # The main feeds sector A's hose at (0, -10) and passes over sector B's hose at (0, 0)
+    builder.build_from_geometries(
+        lines={'main': [[(0.0, -20.0), (0.0, 20.0)]],
+               'hoses': [[(0.0, -10.0), (10.0, -10.0)], [(-5.0, 0.0), (5.0, 0.0)]]},
+        junctions=np.array([(0.0, -10.0)]))
+
+    network = builder.network
+    assert builder.crossing_count == 0
+    assert not any(n.point.sqrDist(Point(0.0, 0.0)) < 1e-6 for n in network.nodes.values())
+    main_links = [l for l in network.links.values() if l.type == 'main']
+    assert len(main_links) == 2 # Split at the supplied junction only
+    hose_b = [l for l in network.links.values() if l.feature_id == 'hose_2']
+    assert len(hose_b) == 1
+
+
+class _Fields:
+    def __init__(self, names):
+        self.names = names
+
+    def indexFromName(self, name):
+        return self.names.index(name) if name in self.names else -1
+
+
+class _Feature:
+    def __init__(self, fid, geometry, attributes=()):
+        self._id, self._geometry, self._attributes = fid, geometry, list(attributes)
+
+    def id(self):
+        return self._id
+
+    def geometry(self):
+        return self._geometry
+
+    def attributes(self):
+        return self._attributes
+
+
+class _Layer:
+    # Minimal vector layer: fields and features only
+    def __init__(self, names, features):
+        self._fields, self.features = _Fields(names), features
+
+    def fields(self):
+        return self._fields
+
+    def getFeatures(self):
+        return iter(self.features)
+
+
+class _MultiPointGeometry:
+    # Point geometry as the QGIS mock sees it (every wkbType is multi)
+    def __init__(self, *points):
+        self.points = [Point(x, y) for x, y in points]
+
+    def wkbType(self):
+        return None
+
+    def asMultiPoint(self):
+        return self.points
+
+
+def test_read_layers_copies_features_for_a_build_without_layers():
+    import pickle
+
+    layers = {
+        'source': _Layer([], [_Feature(3, _MultiPointGeometry((0.0, 0.0)))]),
+        'emitters': _Layer(['Vazao'], [_Feature(5, _MultiPointGeometry((40.0, 0.0)), [1.5])]),
+        'main': _Layer(['Setor', 'Diametro'], [
+            _Feature(7, _MultiLine([[(0.0, 0.0), (40.0, 0.0)]]), ['A', 75.0])]),
+    }
+    reader = NetworkBuilder(HydraulicNetwork())
+    reader.group_field = 'Setor'
+    # Plain data only: it can be handed to a background task
+    features = pickle.loads(pickle.dumps(reader.read_layers(layers)))
+    for layer in layers.values():
+        layer.features = [] # The build below must not read the layers
+
+    builder = NetworkBuilder(HydraulicNetwork())
+    builder.build_from_features(features)
+    network = builder.network
+
+    emitter = network.nodes['emitter_5_40.00']
+    assert emitter.base_demand == 1.5
+    assert 'source_3_0.00' in network.nodes
+    link = network.links['main_7_0']
+    assert link.group == 'main:A' and link.stored_diameter == 75.0
+    assert {link.start_node.id, link.end_node.id} == {'source_3_0.00', 'emitter_5_40.00'}
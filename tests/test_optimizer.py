@@ -89,5 +89,254 @@ def test_optimization():
     # This will be huge.
     # Let's see what it picks.
     
+def _sized_network(min_pressure=25.0, emitter_demand=0.0):
+    network = HydraulicNetwork()
+    for node_id, x, y, node_type, demand, z in (
+        ("source", 0, 0, "source", 0.0, 10.0),
+        ("junc", 100, 0, "junction", 0.0, 6.0),
+        ("valve_a", 200, 0, "valve", 12.0, 2.0),
+        ("valve_b", 100, 150, "valve", 6.0, 0.0),
+        ("emitter", 100, 250, "emitter", emitter_demand, 0.0),
+    ):
+        node = HydraulicNode(node_id, QgsPointXY(x, y), node_type)
+        node.base_demand = demand
+        node.elevation = z
+        network.add_node(node)
+    for link_id, u, v, link_type in (("l1", "source", "junc", "main"), ("l2", "junc", "valve_a", "main"),
+                                     ("l3", "junc", "valve_b", "derivation"), ("l4", "valve_b", "emitter", "hose")):
+        network.add_link(HydraulicLink(link_id, QgsGeometry.fromPolylineXY([network.nodes[u].point, network.nodes[v].point]), link_type))
+        network.connect_link(link_id, u, v)
+
+    solver = HydraulicSolver(network)
+    solver.min_pressure = min_pressure
+    solver._establish_direction()
+    solver.max_system_flow = float('inf')
+    solver._accumulate_flow()
+    solver._initial_sizing()
+    solver._calculate_pressure()
+    return network, solver
+
+
+def test_vectorized_fitness_matches_object_evaluation():
+    import random
+    from core.optimizer import GeneticOptimizer
+    from core.constants import PIPE_COSTS
+
+    network, solver = _sized_network()
+    optimizer = GeneticOptimizer(solver)
+    rng = random.Random(7)
+    population = [[rng.randrange(len(VALID_DNS)) for _ in optimizer.optimizable_links] for _ in range(20)]
+
+    for individual, fitness in zip(population, optimizer._evaluate_population(population)):
+        # Reference: apply to the objects and recompute
+        optimizer._apply_solution(individual)
+        optimizer._recalculate_hydraulics()
+        expected = sum(l.length * PIPE_COSTS[l.diameter] for l in optimizer.optimizable_links)
+        for node in network.nodes.values():
+            if node.type in ('emitter', 'valve') and node.pressure < solver.min_pressure:
+                expected += (solver.min_pressure - node.pressure) ** 2 * 1000
+        assert abs(fitness - expected) < 1e-6 * max(1.0, expected)
+
+
+
+def test_parallel_run_matches_serial_run():
+    from core.optimizer import GeneticOptimizer
+
+    results = []
+    for workers in (1, 2):
+        network, solver = _sized_network()
+        optimizer = GeneticOptimizer(solver, population_size=20, generations=15, workers=workers, seed=42)
+        optimizer.parallel_min_work = 0 # Force the pool even for this small network
+        optimizer.optimize()
+        results.append([link.diameter for link in network.links.values()])
+    assert results[0] == results[1]
+
+
+def test_fitness_cache_skips_elites_and_repeats():
+    from core.optimizer import GeneticOptimizer
+
+    network, solver = _sized_network()
+    optimizer = GeneticOptimizer(solver, population_size=20, generations=10, seed=3)
+    optimizer.optimize()
+    stats = optimizer.cache_stats
+
+    # Elites are carried with their score: only the children are looked up
+    assert stats['hits'] + stats['misses'] == 20 + 9 * (20 - optimizer.elitism_count)
+    assert stats['hits'] > 0
+    assert stats['misses'] == len(optimizer._cache)
+
+
+def test_delta_evaluation_matches_full_evaluation():
+    import random
+    from core.fitness import FitnessModel
+
+    network, solver = _sized_network(min_pressure=28.0)
+    links = [l for l in network.links.values()]
+    model = FitnessModel(solver, links)
+    rng = random.Random(11)
+
+    parent = [rng.randrange(len(VALID_DNS)) for _ in links]
+    cost, penalty, pressures = model.states([parent])
+    state = (cost[0], penalty[0], pressures[0])
+    for _ in range(30):
+        child = list(parent)
+        for g in rng.sample(range(len(links)), 2):
+            child[g] = rng.randrange(len(VALID_DNS))
+        d_cost, d_penalty, d_pressures = model.delta(parent, state, child)
+        f_cost, f_penalty, f_pressures = model.states([child])
+        assert abs(d_cost - f_cost[0]) < 1e-9
+        assert abs(d_penalty - f_penalty[0]) <= 1e-9 * max(1.0, f_penalty[0])
+        assert abs(d_pressures - f_pressures[0]).max() < 1e-9
+        parent, state = child, (d_cost, d_penalty, d_pressures)
+
+
+def test_segments_of_one_feature_share_a_gene():
+    from core.optimizer import GeneticOptimizer
+
+    network, solver = _sized_network()
+    network.links["l1"].feature_id = "main_1"
+    network.links["l2"].feature_id = "main_1"
+    network.links["l3"].feature_id = "derivation_4"
+    optimizer = GeneticOptimizer(solver, population_size=10, generations=5, seed=5)
+    assert len(optimizer.gene_links) == 2
+
+    optimizer.optimize()
+    assert network.links["l1"].diameter == network.links["l2"].diameter
+
+    # Grouped scoring equals scoring the expanded per-link genome
+    grouped = optimizer.model.evaluate([[3, 1]])[0]
+    from core.fitness import FitnessModel
+    per_link = FitnessModel(solver, optimizer.optimizable_links).evaluate([[3, 3, 1]])[0]
+    assert abs(grouped - per_link) < 1e-9
+
+
+def test_warm_start_and_stopping_rules():
+    from core.optimizer import GeneticOptimizer
+
+    network, solver = _sized_network()
+    network.links["l1"].stored_diameter = 150.0
+    optimizer = GeneticOptimizer(solver, population_size=20, generations=500, seed=9)
+    seeds = optimizer._seed_genomes()
+    assert seeds[0] == optimizer._genome_from(lambda link: link.diameter)
+    assert seeds[-1][0] == len(VALID_DNS) - 1 # Stored DN 150 of the previous run
+    assert optimizer._initialize_population()[:len(seeds)] == seeds
+
+    optimizer.stagnation_generations = 5
+    optimizer.optimize()
+    assert optimizer.run_stats['stop_reason'] == 'stagnation'
+    assert optimizer.run_stats['generations'] < 500
+    # Never worse than the greedy design it was seeded with
+    assert optimizer.run_stats['best_fitness'] <= optimizer.model.evaluate([seeds[1]])[0]
+
+    network, solver = _sized_network(min_pressure=10.0, emitter_demand=0.05)
+    optimizer = GeneticOptimizer(solver, population_size=20, generations=500, seed=9)
+    optimizer.target_gap = 1.0
+    optimizer.optimize()
+    assert optimizer.run_stats['stop_reason'] == 'gap'
+    assert optimizer.run_stats['generations'] == 1
+
+
+def test_island_model_migrates_and_applies_best():
+    from core.optimizer import GeneticOptimizer
+
+    results = []
+    for _ in range(2):
+        network, solver = _sized_network(min_pressure=28.0)
+        optimizer = GeneticOptimizer(solver, population_size=12, generations=30, seed=4, islands=3)
+        optimizer.migration_interval = 3
+        optimizer.stagnation_generations = 30
+        optimizer.optimize()
+        results.append([link.diameter for link in network.links.values()])
+
+        stats = optimizer.run_stats
+        assert len(stats['islands']) == 3
+        assert stats['islands'][0]['mutation_rate'] < stats['islands'][2]['mutation_rate']
+        assert stats['best_fitness'] == min(i['best_fitness'] for i in stats['islands'])
+        # The applied network is the best island's individual
+        genome = optimizer._genome_from(lambda link: link.diameter)
+        assert abs(optimizer.model.evaluate([genome])[0] - stats['best_fitness']) < 1e-6
+    # Lockstep ring exchanges: seeded runs repeat
+    assert results[0] == results[1]
+
+
+def test_progress_callback_and_cancel_keep_best():
+    from core.optimizer import GeneticOptimizer
+    from core.constants import PIPE_COSTS
+
+    network, solver = _sized_network(min_pressure=10.0, emitter_demand=0.05)
+    optimizer = GeneticOptimizer(solver, population_size=20, generations=200, seed=2)
+    reports = []
+    optimizer.progress_callback = lambda *report: reports.append(report)
+    optimizer.is_canceled = lambda: len(reports) >= 3
+    optimizer.optimize()
+
+    assert optimizer.run_stats['stop_reason'] == 'canceled'
+    assert [r[0] for r in reports] == [1, 2, 3, 4]
+    generation, generations, best_cost, deficit = reports[-1]
+    assert generations == 200 and deficit == 0.0
+    # The network holds the best design found before canceling
+    applied = sum(l.length * PIPE_COSTS[l.diameter] for l in optimizer.optimizable_links)
+    assert abs(applied - best_cost) < 1e-6
+
+
+def test_directed_mutation_operators():
+    import numpy as np
+    from core.optimizer import GeneticOptimizer
+
+    network, solver = _sized_network(min_pressure=28.0, emitter_demand=0.05)
+    optimizer = GeneticOptimizer(solver, seed=6)
+    optimizer.optimize()
+    model = optimizer.model
+    genome = [0, 0, 0] # l1, l2, l3 at the smallest DN: infeasible
+    _, _, pressures = model.states([genome])
+    pressures = pressures[0]
+
+    # Slack: worst margin below each link (l1 feeds every constrained node)
+    slack = model.slack(pressures)
+    assert abs(slack[0] - (pressures.min() - solver.min_pressure)) < 1e-9
+    assert slack[0] <= slack[1] and slack[0] <= slack[2]
+
+    # Upsizing only touches genes on the path to the lowest-pressure node, by one DN
+    worst = int(np.argmin(pressures))
+    on_path = set(model.path[worst].indices.tolist())
+    for _ in range(20):
+        child = optimizer._upsize(list(genome), pressures)
+        changed = [g for g in range(3) if child[g] != genome[g]]
+        assert len(changed) == 1 and changed[0] in on_path and child[changed[0]] == 1
+
+    # Downsizing from the largest DNs never breaks feasibility where slack allows it
+    top = [len(VALID_DNS) - 1] * 3
+    _, penalty, pressures = model.states([top])
+    assert penalty[0] == 0
+    for _ in range(20):
+        child = optimizer._downsize(list(top), pressures[0])
+        assert sum(top) - sum(child) == 1
+        assert model.states([child])[1][0] == 0
+        # No violation to fix: upsizing falls back to downsizing
+        child = optimizer._upsize(list(top), pressures[0])
+        assert sum(top) - sum(child) == 1
+    assert all(tries > 0 for tries, _ in optimizer.operator_stats.values())
+    assert 'uniform' not in optimizer.operator_stats # Only +-1 DN moves
+
+    # Parent states missing after pool scoring are evaluated in one batch
+    calls = []
+    states = model.states
+    model.states = lambda population: calls.append(len(population)) or states(population)
+    optimizer._states = {}
+    parents = [[0, 0, 0], [1, 0, 0], top, [0, 0, 0]]
+    optimizer._load_states([(p, bytes(p)) for p in parents])
+    assert calls == [3] and len(optimizer._states) == 3
+
+
+def test_solve_generative_finishes_when_greedy_seed_is_infeasible():
+    from test_solver import _valve_above_emitters
+
+    network = _valve_above_emitters()
+    solver = HydraulicSolver(network)
+    solver.min_pressure = 200.0
+    optimizer = solver.solve_generative(seed=1)
+    assert optimizer.run_stats['generations'] >= 1
+    assert len(optimizer._seed_genomes()) >= 1
+
 if __name__ == "__main__":
     test_optimization()
@@ -0,0 +1,141 @@
+import sys
+import os
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+# Mock QGIS environment
+try:
+    import qgis.core
+except ImportError:
+    import mock_qgis_setup
+
+from qgis.core import QgsPointXY, QgsGeometry
+from core.network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from core.solver import HydraulicSolver
+from core.skeleton import NetworkSkeleton, christiansen_f
+
+
+def _add_node(network, node_id, x, y, node_type, demand=0.0):
+    node = HydraulicNode(node_id, QgsPointXY(x, y), node_type)
+    node.base_demand = demand
+    network.add_node(node)
+
+
+def _add_link(network, link_id, u, v, link_type, diameter):
+    geom = QgsGeometry.fromPolylineXY([network.nodes[u].point, network.nodes[v].point])
+    link = HydraulicLink(link_id, geom, link_type)
+    link.diameter = diameter
+    network.add_link(link)
+    network.connect_link(link_id, u, v)
+
+
+def _field_network(emitters=20, slope=0.0, tail=0):
+    # source -> 3 main segments (series) -> manifold with two hoses
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source")
+    _add_node(network, "m1", 50, 0, "junction")
+    _add_node(network, "m2", 100, 0, "junction")
+    _add_node(network, "manifold", 150, 0, "junction")
+    _add_link(network, "main_0", "source", "m1", "main", 50.0)
+    _add_link(network, "main_1", "m1", "m2", "main", 50.0)
+    _add_link(network, "main_2", "m2", "manifold", "main", 50.0)
+    for side in (1, -1):
+        prev = "manifold"
+        for i in range(emitters):
+            node_id = f"e{side}_{i}"
+            _add_node(network, node_id, 150, side * (0.5 + i), "emitter", demand=0.0016)
+            network.nodes[node_id].elevation = slope * i
+            _add_link(network, f"hose{side}_{i}", prev, node_id, "hose", 16.0)
+            prev = node_id
+        # Hose left past the last emitter: demand-less junctions up to the end
+        for i in range(tail):
+            node_id = f"t{side}_{i}"
+            _add_node(network, node_id, 150, side * (emitters + 0.5 + i), "junction")
+            network.nodes[node_id].elevation = slope * (emitters + i)
+            _add_link(network, f"tail{side}_{i}", prev, node_id, "hose", 16.0)
+            prev = node_id
+    return network
+
+
+def _solve_fixed(network):
+    solver = HydraulicSolver(network)
+    solver._establish_direction()
+    solver.max_system_flow = float('inf')
+    solver._accumulate_flow()
+    solver._update_head_losses()
+    solver.topology.store_links()
+    solver._calculate_pressure()
+    return solver
+
+
+def test_christiansen_f_limits():
+    assert abs(christiansen_f(1) - 1.0) < 0.01
+    assert abs(christiansen_f(1000) - 1 / 2.852) < 0.001
+    # First outlet at half spacing lowers F
+    assert christiansen_f(10, 0.5) < christiansen_f(10)
+
+
+def _assert_expanded_matches(network, reference):
+    for link in reference.links.values():
+        expanded = network.links[link.id]
+        assert abs(expanded.flow - link.flow) < 1e-9
+        assert expanded.diameter == link.diameter
+        assert expanded.start_node.id == link.start_node.id
+    for node in reference.nodes.values():
+        # The F factor is an approximation of the exact outlet sum
+        assert abs(network.nodes[node.id].pressure - node.pressure) < 0.01
+
+
+def test_reduce_and_expand_matches_full_network():
+    reference = _field_network()
+    _solve_fixed(reference)
+
+    network = _field_network()
+    skeleton = NetworkSkeleton(network)
+    reduced = skeleton.reduce()
+    assert len(reduced.nodes) == 4 # source, manifold and one node per hose
+    assert len(reduced.links) == 3
+    assert reduced.nodes["e1_19"].emitter_count == 20
+
+    solver = _solve_fixed(reduced)
+    skeleton.expand(solver)
+    _assert_expanded_matches(network, reference)
+
+
+def test_reduce_sets_aside_dead_hose_tails():
+    reference = _field_network(tail=3)
+    _solve_fixed(reference)
+
+    network = _field_network(tail=3)
+    skeleton = NetworkSkeleton(network)
+    reduced = skeleton.reduce()
+    assert len(reduced.nodes) == 4 and len(reduced.links) == 3
+    assert reduced.nodes["e-1_19"].emitter_count == 20
+
+    solver = _solve_fixed(reduced)
+    skeleton.expand(solver)
+    _assert_expanded_matches(network, reference)
+    assert network.links["tail1_2"].flow == 0.0
+    assert abs(network.nodes["t1_2"].pressure - network.nodes["e1_19"].pressure) < 1e-9
+
+
+def test_reduce_splits_sloped_hoses_into_flat_runs():
+    # 4 cm drop per emitter: runs of 3 emitters within the 0.1 m tolerance
+    reference = _field_network(slope=-0.04)
+    _solve_fixed(reference)
+
+    network = _field_network(slope=-0.04)
+    skeleton = NetworkSkeleton(network)
+    reduced = skeleton.reduce()
+    assert len(reduced.nodes) == 2 + 2 * 7 # 20 emitters: six runs of 3 and one of 2 per hose
+    assert reduced.nodes["e1_2"].emitter_count == 3 and reduced.nodes["e1_19"].emitter_count == 2
+
+    solver = _solve_fixed(reduced)
+    skeleton.expand(solver)
+    _assert_expanded_matches(network, reference)
+    # Downhill, the lowest pressure is not at the hose end
+    emitters = [network.nodes[f"e1_{i}"] for i in range(20)]
+    worst = min(emitters, key=lambda e: e.pressure)
+    assert worst.id != "e1_19"
+    assert abs(worst.pressure - min(reference.nodes[e.id].pressure for e in emitters)) < 0.01
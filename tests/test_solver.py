@@ -0,0 +1,352 @@
+import sys
+import os
+import math
+
+# Add root to path
+sys.path.append(os.getcwd())
+
+# Mock QGIS environment
+try:
+    import qgis.core
+except ImportError:
+    import mock_qgis_setup
+
+from qgis.core import QgsPointXY, QgsGeometry
+from core.network import HydraulicNetwork, HydraulicNode, HydraulicLink
+from core.solver import HydraulicSolver
+
+
+def _add_node(network, node_id, x, y, node_type, demand=0.0, elevation=0.0):
+    node = HydraulicNode(node_id, QgsPointXY(x, y), node_type)
+    node.base_demand = demand
+    node.elevation = elevation
+    network.add_node(node)
+    return node
+
+
+def _add_link(network, link_id, u, v, link_type='main'):
+    geom = QgsGeometry.fromPolylineXY([network.nodes[u].point, network.nodes[v].point])
+    network.add_link(HydraulicLink(link_id, geom, link_type))
+    # Connect "backwards" on purpose: the solver must orient links from the source
+    network.connect_link(link_id, v, u)
+
+
+def _branched_network():
+    # source -> junction -> valve_a
+    #                   \-> valve_b
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source", elevation=5.0)
+    _add_node(network, "junc", 100, 0, "junction")
+    _add_node(network, "valve_a", 200, 0, "valve", demand=6.0)
+    _add_node(network, "valve_b", 100, 100, "valve", demand=4.0)
+    _add_link(network, "l1", "source", "junc")
+    _add_link(network, "l2", "junc", "valve_a")
+    _add_link(network, "l3", "junc", "valve_b")
+    return network
+
+
+def test_topology_orientation_and_order():
+    network = _branched_network()
+    solver = HydraulicSolver(network)
+    solver._establish_direction()
+    topo = solver.topology
+
+    idx = topo.node_index
+    assert topo.order.tolist()[0] == idx["source"]
+    assert topo.parent_link[idx["source"]] == -1
+    assert topo.parent_node[idx["valve_a"]] == idx["junc"]
+    assert sorted(topo.downstream_links(idx["junc"]).tolist()) == [topo.link_index["l2"], topo.link_index["l3"]]
+
+    # Objects mirror the arrays
+    assert network.links["l1"].start_node.id == "source"
+    assert network.nodes["valve_b"].upstream_link.id == "l3"
+    assert [l.id for l in network.nodes["junc"].downstream_links] == ["l2", "l3"]
+
+
+def test_solve_flows_and_pressures():
+    network = _branched_network()
+    solver = HydraulicSolver(network)
+    solver.simultaneous_sectors = 2
+    solver.solve()
+
+    assert network.links["l2"].flow == 6.0
+    assert network.links["l3"].flow == 4.0
+    assert network.links["l1"].flow == 10.0
+
+    for node_id in ("junc", "valve_a", "valve_b"):
+        node = network.nodes[node_id]
+        parent = node.upstream_link.start_node
+        expected = parent.pressure - node.upstream_link.head_loss + (parent.elevation - node.elevation)
+        assert abs(node.pressure - expected) < 1e-9
+    assert network.nodes["valve_a"].pressure >= solver.min_pressure
+
+
+def test_lazy_min_segment_tree():
+    from core.segment_tree import LazyMinSegmentTree
+
+    values = [5.0, 3.0, 8.0, 1.0, 7.0]
+    tree = LazyMinSegmentTree(values)
+    assert tree.min() == 1.0 and tree.argmin() == 3
+
+    tree.range_add(2, 5, 10.0) # [5, 3, 18, 11, 17]
+    assert tree.min() == 3.0 and tree.argmin() == 1
+    tree.range_add(0, 2, 20.0) # [25, 23, 18, 11, 17]
+    assert tree.argmin() == 3
+    assert tree.values() == [25.0, 23.0, 18.0, 11.0, 17.0]
+
+
+def test_lazy_min_segment_tree_threshold_searches():
+    import random
+    from core.segment_tree import LazyMinSegmentTree
+
+    rng = random.Random(5)
+    values = [rng.uniform(0, 10) for _ in range(45)]
+    tree = LazyMinSegmentTree(values)
+    for _ in range(300):
+        lo = rng.randrange(45)
+        hi = rng.randrange(lo, 46)
+        delta = rng.uniform(-3, 3)
+        tree.range_add(lo, hi, delta)
+        for pos in range(lo, hi):
+            values[pos] += delta
+
+        threshold = rng.uniform(0, 10)
+        lo = rng.randrange(45)
+        hi = rng.randrange(lo, 46)
+        below = [pos for pos in range(lo, hi) if values[pos] < threshold]
+        assert tree.find_first_below(threshold, lo, hi) == (below[0] if below else -1)
+        assert tree.find_last_below(threshold, lo, hi) == (below[-1] if below else -1)
+    assert tree.find_first_below(math.inf) == 0 and tree.find_last_below(math.inf) == 44
+
+
+def test_optimize_network_upgrades_until_feasible():
+    # Long undersized main line feeding two valves
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source")
+    _add_node(network, "junc", 400, 0, "junction")
+    _add_node(network, "valve_a", 800, 0, "valve", demand=40.0)
+    _add_node(network, "valve_b", 400, 300, "valve", demand=40.0)
+    _add_link(network, "l1", "source", "junc")
+    _add_link(network, "l2", "junc", "valve_a")
+    _add_link(network, "l3", "junc", "valve_b")
+
+    solver = HydraulicSolver(network)
+    solver.simultaneous_sectors = 2
+    solver.max_velocity = 3.0 # Velocity sizing alone leaves the valves short of pressure
+    solver.min_pressure = 20.0
+    solver.solve()
+
+    topo = solver.topology
+    assert min(network.nodes[v].pressure for v in ("valve_a", "valve_b")) >= solver.min_pressure
+
+
+def test_optimize_network_incremental_pressures_match_a_sweep(monkeypatch):
+    import core.solver
+    from core.segment_tree import LazyMinSegmentTree
+
+    trees = []
+
+    class RecordingTree(LazyMinSegmentTree):
+        def __init__(self, values):
+            super().__init__(values)
+            trees.append(self)
+
+    monkeypatch.setattr(core.solver, "LazyMinSegmentTree", RecordingTree)
+    network = _series_to_valve()
+    solver = HydraulicSolver(network)
+    solver.max_velocity = 5.0
+    solver.min_pressure = 10.0
+    solver.solve()
+    assert solver.sizing_stats['feasible'] and solver.sizing_stats['iterations'] > 0
+
+    # The tree holds the pressures kept by the subtree updates alone; topo.pressure
+    # comes from the full sweep that ends _optimize_network
+    topo = solver.topology
+    incremental = trees[-1].values()
+    for pos, v in enumerate(topo.preorder.tolist()):
+        if topo.is_constrained[v]:
+            assert abs(incremental[pos] - topo.pressure[v]) < 1e-9
+
+
+def _chain_network(num_emitters, demand):
+    # source -> e0 -> e1 -> ... (one hose with thousands of emitters in series)
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source")
+    prev = "source"
+    for i in range(num_emitters):
+        node_id = f"e{i}"
+        _add_node(network, node_id, i + 1, 0, "emitter", demand=demand)
+        _add_link(network, f"h{i}", prev, node_id, link_type='hose')
+        prev = node_id
+    return network
+
+
+def test_deep_chain_flow_accumulation():
+    n = 50000
+    network = _chain_network(n, demand=0.001)
+    solver = HydraulicSolver(network)
+    solver.simultaneous_sectors = n # Cap never binds
+    solver.solve()
+
+    assert abs(network.links["h0"].flow - n * 0.001) < 1e-6
+    assert abs(network.links[f"h{n // 2}"].flow - (n - n // 2) * 0.001) < 1e-6
+    assert network.links[f"h{n - 1}"].flow == 0.001
+
+
+def test_deep_chain_flow_cap():
+    n = 50000
+    network = _chain_network(n, demand=0.001)
+    solver = HydraulicSolver(network)
+    solver.simultaneous_sectors = 10 # Cap = 0.01 m3/h
+    solver._establish_direction()
+    solver.max_system_flow = 0.001 * solver.simultaneous_sectors
+    solver._accumulate_flow()
+
+    # Each link carries min(downstream potential, cap)
+    assert abs(network.links["h0"].flow - 0.01) < 1e-12
+    assert abs(network.links[f"h{n - 5}"].flow - 0.005) < 1e-12
+
+
+def _series_to_valve():
+    # 100 pipe segments in series feeding one valve: needs far more than 50 upgrades
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source")
+    prev = "source"
+    for i in range(100):
+        node_id = f"n{i}"
+        _add_node(network, node_id, (i + 1) * 20, 0, "valve" if i == 99 else "junction", demand=60.0 if i == 99 else 0.0)
+        _add_link(network, f"m{i}", prev, node_id)
+        prev = node_id
+    return network
+
+
+def test_optimize_network_runs_past_fifty_upgrades():
+    network = _series_to_valve()
+    solver = HydraulicSolver(network)
+    solver.max_velocity = 5.0
+    solver.min_pressure = 10.0
+    solver.solve()
+
+    stats = solver.sizing_stats
+    assert stats['feasible'] and stats['iterations'] > 50
+    assert network.nodes["n99"].pressure >= solver.min_pressure
+
+
+def test_optimize_network_stops_when_canceled():
+    network = _series_to_valve()
+    solver = HydraulicSolver(network)
+    solver.max_velocity = 5.0
+    solver.min_pressure = 10.0
+    checks = []
+    solver.is_canceled = lambda: checks.append(1) or True
+    solver.solve()
+
+    stats = solver.sizing_stats
+    assert stats['canceled'] and len(checks) == 1
+    assert 0 < stats['iterations'] < 100 and not stats['feasible']
+
+
+def _valve_above_emitters():
+    # The valve (common ancestor of all violators) is also the worst node
+    network = HydraulicNetwork()
+    _add_node(network, "source", 0, 0, "source", elevation=10.0)
+    _add_node(network, "valve", 100, 0, "valve", demand=5.0, elevation=10.0)
+    _add_node(network, "e1", 100, 10, "emitter", demand=0.01)
+    _add_node(network, "e2", 100, -10, "emitter", demand=0.01)
+    _add_link(network, "main", "source", "valve")
+    _add_link(network, "h1", "valve", "e1", "hose")
+    _add_link(network, "h2", "valve", "e2", "hose")
+    return network
+
+
+def test_optimize_network_stops_when_anchor_is_worst():
+    network = _valve_above_emitters()
+    solver = HydraulicSolver(network)
+    solver.min_pressure = 200.0 # Out of reach for any upgrade
+    solver.solve()
+
+    assert solver.sizing_stats['feasible'] is False
+    assert solver.sizing_stats['unfixable'] == 3
+    assert network.links["main"].diameter == 150.0 # Upgraded as far as possible first
+
+
+def test_optimize_network_exhausts_every_unfixable_path():
+    import random
+
+    # Deep random tree out of reach: every violator left must have nothing upgradable
+    # between it and the source (no pass limit may stop the sizer early)
+    rng = random.Random(1)
+    network = HydraulicNetwork()
+    _add_node(network, "n0", 0, 0, "source")
+    for i in range(1, 1500):
+        kind = 'emitter' if rng.random() < 0.6 else 'junction'
+        _add_node(network, f"n{i}", i, 0, kind, demand=0.01 if kind == 'emitter' else 0.0,
+                  elevation=rng.uniform(0, 30))
+        link_type = 'hose' if kind == 'emitter' and rng.random() < 0.5 else 'main'
+        _add_link(network, f"l{i}", f"n{max(0, i - rng.randint(1, 10))}", f"n{i}", link_type)
+
+    solver = HydraulicSolver(network)
+    solver.simultaneous_sectors = 10 ** 9
+    solver.min_pressure = 25.0
+    solver.solve()
+
+    topo = solver.topology
+    violators = [v for v in range(topo.num_nodes)
+                 if topo.is_constrained[v] and topo.pressure[v] < solver.min_pressure]
+    assert solver.sizing_stats['unfixable'] == len(violators) > 0
+    for v in violators:
+        while topo.parent_link[v] >= 0:
+            assert solver._next_dn(int(topo.parent_link[v])) is None
+            v = int(topo.parent_node[v])
+
+
+def test_max_cover_tree():
+    import random
+    from core.segment_tree import MaxCoverTree
+
+    rng = random.Random(3)
+    tree = MaxCoverTree(37)
+    expected = [-1] * 37
+    for _ in range(200):
+        lo = rng.randrange(37)
+        hi = rng.randrange(lo, 38)
+        value = rng.randrange(100)
+        tree.assign_max(lo, hi, value)
+        for pos in range(lo, hi):
+            expected[pos] = max(expected[pos], value)
+        assert [tree.get(pos) for pos in range(37)] == expected
+
+
+def test_solve_scenarios_matches_single_runs():
+    network = _branched_network()
+    solver = HydraulicSolver(network)
+    result = solver.solve_scenarios(shifts=[["valve_a"], ["valve_b"], ["valve_a", "valve_b"]])
+    topo = solver.topology
+    link = topo.link_index
+
+    assert result['flows'][link["l1"]].tolist() == [6.0, 4.0, 10.0]
+    assert result['flows'][link["l2"]].tolist() == [6.0, 0.0, 6.0]
+    assert result['flows'][link["l3"]].tolist() == [0.0, 4.0, 4.0]
+    assert network.links["l1"].flow == 10.0
+
+    # Each column equals a plain tree solve with only that shift's demand
+    diameters = {l.id: l.diameter for l in network.links.values()}
+    for s, active in enumerate([{"valve_a"}, {"valve_b"}, {"valve_a", "valve_b"}]):
+        single = _branched_network()
+        for node in single.nodes.values():
+            if node.id not in active:
+                node.base_demand = 0.0
+        for l in single.links.values():
+            l.diameter = diameters[l.id]
+        single_solver = HydraulicSolver(single)
+        single_solver._establish_direction()
+        single_solver.max_system_flow = float('inf')
+        single_solver._accumulate_flow()
+        single_solver._update_head_losses()
+        single_solver._calculate_pressure()
+        for node in single.nodes.values():
+            assert abs(result['pressures'][topo.node_index[node.id], s] - node.pressure) < 1e-9
+
+    # Envelope: every node reports its lowest pressure
+    assert (result['min_pressure'] == result['pressures'].min(axis=1)).all()
+    assert network.nodes["valve_a"].pressure == result['min_pressure'][topo.node_index["valve_a"]]
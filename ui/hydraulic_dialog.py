@@ -8,6 +8,7 @@ from qgis.core import QgsProject, QgsMapLayer, QgsWkbTypes, QgsVectorLayer, QgsF
 from qgis.PyQt.QtCore import QVariant
 from ..core.network import HydraulicNetwork
 from ..core.network_builder import NetworkBuilder
+from ..core.skeleton import NetworkSkeleton
 from ..core.solver import HydraulicSolver
 from ..core.layout_generator import LayoutGenerator
 
@@ -340,71 +341,31 @@ class HydraulicDesignDialog(QDialog):
             network = HydraulicNetwork()
             builder = NetworkBuilder(network)
             
-            # We need to pass layers or geometries to builder.
-            # Builder expects layers currently.
-            # Let's create temporary memory layers for the builder
-            
             crs = emit_layer.crs().authid()
             
-            def create_mem_layer(geoms, name):
-                l = QgsVectorLayer(f"LineString?crs={crs}", name, "memory")
-                pr = l.dataProvider()
-                feats = [QgsFeature() for _ in geoms]
-                for i, f in enumerate(feats):
-                    f.setGeometry(geoms[i])
-                pr.addFeatures(feats)
-                l.updateExtents()
-                return l
-                
-            def create_point_layer(pts, name):
-                l = QgsVectorLayer(f"Point?crs={crs}", name, "memory")
-                pr = l.dataProvider()
-                feats = []
-                for pt in pts:
-                    f = QgsFeature()
-                    f.setGeometry(QgsGeometry.fromPointXY(pt))
-                    feats.append(f)
-                pr.addFeatures(feats)
-                l.updateExtents()
-                return l
-
-            l_hoses = create_mem_layer(all_hoses, "temp_hoses")
-            l_laterals = create_mem_layer(all_laterals, "temp_laterals")
-            l_collectors = create_mem_layer(all_collectors, "temp_collectors")
-            l_main = create_mem_layer(main_lines, "temp_main")
-            l_valves = create_point_layer(valves, "temp_valves")
-            l_source = create_point_layer([source_pt], "temp_source")
-            l_junctions = create_point_layer(all_junctions, "temp_junctions")
-            
-            # We need to map these to the builder's expected input dict
-            # Builder expects: 'hoses', 'laterals', 'derivations' (collectors), 'main', 'valves', 'source'
-            # Note: 'laterals' in builder usually means the pipe feeding hoses. 
-            # 'derivations' means the pipe feeding laterals.
-            # Our naming: 
-            # Hoses -> Hoses
-            # Laterals (Manifolds) -> Laterals
-            # Collectors (Derivations) -> Derivations
-            
-            layers_map = {
-                'hoses': l_hoses,
-                'laterals': l_laterals,
-                'derivations': l_collectors,
-                'main': l_main,
-                'valves': l_valves,
-                'source': l_source,
-                'junctions': l_junctions, # New layer for explicit connections
-                'emitters': emit_layer # Needed for demand? Or builder uses hoses?
-            }
-            # Builder might need update if it relies on specific attributes or topology
-            # Assuming builder uses spatial connectivity.
-            
-            builder.build(layers_map)
+            # Generated geometries go straight to the builder (no temporary layers).
+            # Builder naming: 'laterals' feed the hoses, 'derivations' (our collectors)
+            # feed the laterals. The generator's junctions are taken as split points.
+            # Emitters still come from their layer (flow field, if any).
+            features = builder.geometry_features(
+                lines={
+                    'hoses': all_hoses,
+                    'laterals': all_laterals,
+                    'derivations': all_collectors,
+                    'main': main_lines,
+                },
+                points={'valves': valves, 'source': [source_pt]},
+                junctions=all_junctions,
+            )
+            features['points'] += builder.read_layers({'emitters': emit_layer})['points']
+            builder.build_from_features(features)
             
             self.progress_bar.setValue(70)
             
             # 4. Solve
             self.lbl_status.setText("Calculando hidráulica...")
-            solver = HydraulicSolver(network)
+            skeleton = NetworkSkeleton(network)
+            solver = HydraulicSolver(skeleton.reduce())
             solver.max_velocity = self.spin_max_velocity.value()
             solver.simultaneous_sectors = self.spin_simultaneous_sectors.value()
             solver.emitter_flow = self.spin_emitter_flow_sect.value()
@@ -423,6 +384,7 @@ class HydraulicDesignDialog(QDialog):
             # If we pass `emitters` layer, it should work.
             
             solver.solve()
+            skeleton.expand(solver)
             
             self.progress_bar.setValue(90)
             self.lbl_status.setText("Gerando resultados...")
@@ -445,7 +407,7 @@ class HydraulicDesignDialog(QDialog):
             feats = []
             for link in network.links.values():
                 feat = QgsFeature()
-                feat.setGeometry(link.geometry)
+                feat.setGeometry(NetworkBuilder.to_qgs_geometry(link.geometry))
                 feat.setAttributes([
                     link.type,
                     link.diameter,
@@ -469,7 +431,7 @@ class HydraulicDesignDialog(QDialog):
             for node in network.nodes.values():
                 if node.type == 'valve': # Assuming builder tags them
                     f = QgsFeature()
-                    f.setGeometry(QgsGeometry.fromPointXY(node.point))
+                    f.setGeometry(QgsGeometry.fromPointXY(NetworkBuilder.to_qgs_point(node.point)))
                     f.setAttributes([node.pressure])
                     v_feats.append(f)
             pr_v.addFeatures(v_feats)
@@ -478,7 +440,13 @@ class HydraulicDesignDialog(QDialog):
             
             self.progress_bar.setValue(100)
             self.lbl_status.setText("Concluído!")
-            QMessageBox.information(self, "Sucesso", "Rede gerada e dimensionada com sucesso!")
+            
+            stats = solver.sizing_stats
+            msg = "Rede gerada e dimensionada com sucesso!"
+            msg += f"\n{stats.get('iterations', 0)} ampliações de diâmetro em {stats.get('elapsed', 0.0):.2f} s."
+            if not stats.get('feasible', True):
+                msg += f"\nAtenção: {stats.get('unfixable', 0)} pontos continuam abaixo da pressão mínima (sem ampliações disponíveis)."
+            QMessageBox.information(self, "Sucesso", msg)
             
         except Exception as e:
             self.progress_bar.setValue(0)